@@ -0,0 +1,253 @@
+"""Adverse event (FAERS) summaries per drug, built from openFDA count queries.
+
+Instead of downloading individual reports, a rollup is assembled from a handful
+of ``count`` queries run in parallel: reaction frequencies, serious versus
+non-serious reports, each seriousness criterion, reaction outcomes and reports
+received per day (kept as monthly totals). Rollups are stored in SQLite for
+ADVERSE_EVENT_ROLLUP_TTL_SECONDS, so repeat queries make no upstream calls and
+survive restarts. If a refresh fails, the stored rollup is served stale. A
+rollup without reports (a misspelled or unknown drug) is never stored.
+
+Raw reports are still available a page at a time, using openFDA's skip/limit.
+"""
+import asyncio
+import json
+import logging
+import os
+import time
+from typing import Dict, List, Optional, Tuple
+
+import aiosqlite
+
+from app.config import DATA_DIR, env_bool, env_float, env_int
+from app.fda import SingleFlight, fda_params, normalize_drug_name
+from app.http_clients import clients
+
+logger = logging.getLogger(__name__)
+
+ADVERSE_EVENT_STORE_ENABLED = env_bool("ADVERSE_EVENT_STORE_ENABLED", True)
+ADVERSE_EVENT_STORE_PATH = os.getenv("ADVERSE_EVENT_STORE_PATH", os.path.join(DATA_DIR, "adverse_events.sqlite3"))
+ADVERSE_EVENT_ROLLUP_TTL_SECONDS = env_float("ADVERSE_EVENT_ROLLUP_TTL_SECONDS", 24 * 3600)
+# Reaction terms kept per rollup (openFDA returns at most 1000 per count query)
+ADVERSE_EVENT_MAX_TERMS = env_int("ADVERSE_EVENT_MAX_TERMS", 100)
+
+# openFDA limits for paging through raw reports
+EVENT_PAGE_MAX = 100
+EVENT_SKIP_MAX = 25000
+
+SERIOUSNESS_CRITERIA: Tuple[Tuple[str, str], ...] = (
+    ("death", "seriousnessdeath"),
+    ("hospitalization", "seriousnesshospitalization"),
+    ("life_threatening", "seriousnesslifethreatening"),
+    ("disabling", "seriousnessdisabling"),
+    ("congenital_anomaly", "seriousnesscongenitalanomali"),
+    ("other", "seriousnessother"),
+)
+REACTION_OUTCOMES = {
+    "1": "recovered", "2": "recovering", "3": "not_recovered",
+    "4": "recovered_with_sequelae", "5": "fatal", "6": "unknown",
+}
+BUCKETS = ("month", "year")
+
+
+def event_search(drug_name: str) -> str:
+    name = " ".join(drug_name.replace('"', " ").split())
+    return f'patient.drug.medicinalproduct:"{name}"'
+
+
+async def _count(search: str, field: str, limit: int = 1000) -> List[Dict]:
+    """Results of one openFDA count query; no matching reports gives []."""
+    response = await clients.fda.get(
+        "/drug/event.json", params=fda_params({"search": search, "count": field, "limit": limit}),
+    )
+    if response.status_code == 404:
+        return []
+    response.raise_for_status()
+    return response.json().get("results", [])
+
+
+def _terms(results: List[Dict]) -> Dict[str, int]:
+    return {str(r["term"]): r["count"] for r in results if "term" in r}
+
+
+async def build_rollup(drug_name: str) -> Dict:
+    """Query openFDA for the counts behind a drug's adverse event summary."""
+    search = event_search(drug_name)
+    fields = [
+        ("patient.reaction.reactionmeddrapt.exact", ADVERSE_EVENT_MAX_TERMS),
+        ("serious", 10),
+        ("patient.reaction.reactionoutcome", 10),
+        ("receivedate", 1000),
+    ] + [(field, 10) for _, field in SERIOUSNESS_CRITERIA]
+    reactions, serious, outcomes, dates, *criteria = await asyncio.gather(
+        *(_count(search, field, limit) for field, limit in fields)
+    )
+
+    serious_counts = _terms(serious)
+    monthly: Dict[str, int] = {}
+    for row in dates:
+        day = row.get("time", "")
+        if len(day) >= 6:
+            month = f"{day[:4]}-{day[4:6]}"
+            monthly[month] = monthly.get(month, 0) + row["count"]
+    return {
+        "drug_name": drug_name,
+        # Every report is either serious (1) or not (2)
+        "total_reports": sum(serious_counts.values()),
+        "serious": {"serious": serious_counts.get("1", 0), "non_serious": serious_counts.get("2", 0)},
+        "seriousness": {name: sum(_terms(rows).values()) for (name, _), rows in zip(SERIOUSNESS_CRITERIA, criteria)},
+        "reactions": [{"term": r["term"], "count": r["count"]} for r in reactions],
+        "reaction_outcomes": {
+            REACTION_OUTCOMES.get(term, term): count for term, count in _terms(outcomes).items()
+        },
+        "monthly": dict(sorted(monthly.items())),
+        "updated_at": time.time(),
+    }
+
+
+def summarize(rollup: Dict, top: int = 20, bucket: str = "year") -> Dict:
+    """Compact view of a rollup: top reactions with their share of reports, and time buckets."""
+    total = rollup["total_reports"]
+    buckets: Dict[str, int] = {}
+    for month, count in rollup["monthly"].items():
+        period = month[:4] if bucket == "year" else month
+        buckets[period] = buckets.get(period, 0) + count
+    return {
+        "drug_name": rollup["drug_name"],
+        "total_reports": total,
+        "serious": rollup["serious"],
+        "seriousness": rollup["seriousness"],
+        "reaction_outcomes": rollup["reaction_outcomes"],
+        "reactions": [
+            {**r, "percent": round(100.0 * r["count"] / total, 1) if total else 0.0}
+            for r in rollup["reactions"][:top]
+        ],
+        "bucket": bucket,
+        "time_buckets": [{"period": p, "count": c} for p, c in buckets.items()],
+        "updated_at": rollup["updated_at"],
+    }
+
+
+def _report_summary(report: Dict) -> Dict:
+    patient = report.get("patient", {})
+    return {
+        "report_id": report.get("safetyreportid", "Unknown"),
+        "report_date": report.get("receiptdate", "Unknown"),
+        "reactions": [r.get("reactionmeddrapt", "Unknown") for r in patient.get("reaction", [])],
+        "serious": report.get("serious", "Unknown"),
+        "outcome": patient.get("patientoutcome", "Unknown"),
+    }
+
+
+async def fetch_reports(drug_name: str, skip: int = 0, limit: int = 10) -> Dict:
+    """One page of raw reports, summarized; next_skip is None on the last page."""
+    skip = max(0, min(skip, EVENT_SKIP_MAX))
+    limit = max(1, min(limit, EVENT_PAGE_MAX))
+    response = await clients.fda.get(
+        "/drug/event.json",
+        params=fda_params({"search": event_search(drug_name), "skip": skip, "limit": limit}),
+    )
+    if response.status_code == 404:
+        return {"events": [], "total": 0, "skip": skip, "limit": limit, "next_skip": None}
+    response.raise_for_status()
+    data = response.json()
+    events = [_report_summary(report) for report in data.get("results", [])]
+    total = data.get("meta", {}).get("results", {}).get("total", len(events))
+    next_skip = skip + len(events)
+    if not events or next_skip >= total or next_skip > EVENT_SKIP_MAX:
+        next_skip = None
+    return {"events": events, "total": total, "skip": skip, "limit": limit, "next_skip": next_skip}
+
+
+class AdverseEventStore:
+    """Rollups per drug in SQLite, refreshed from openFDA once they are older than the TTL."""
+
+    def __init__(
+        self,
+        path: str = ADVERSE_EVENT_STORE_PATH,
+        ttl: float = ADVERSE_EVENT_ROLLUP_TTL_SECONDS,
+        enabled: bool = ADVERSE_EVENT_STORE_ENABLED,
+    ):
+        self.path = path
+        self.ttl = ttl
+        self.enabled = enabled
+        self._db: Optional[aiosqlite.Connection] = None
+        self._open_lock = asyncio.Lock()
+        self._flights = SingleFlight()
+        self.counters = {"hits": 0, "misses": 0, "refreshes": 0, "stale_served": 0, "errors": 0, "no_reports": 0}
+
+    async def open(self) -> None:
+        async with self._open_lock:
+            if self._db is not None or not self.enabled:
+                return
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            db = await aiosqlite.connect(self.path)
+            await db.execute("PRAGMA journal_mode=WAL")
+            await db.execute(
+                "CREATE TABLE IF NOT EXISTS rollups ("
+                " key TEXT PRIMARY KEY,"
+                " rollup TEXT NOT NULL,"
+                " updated_at REAL NOT NULL)"
+            )
+            await db.commit()
+            self._db = db
+
+    async def close(self) -> None:
+        if self._db is not None:
+            await self._db.close()
+            self._db = None
+
+    async def _load(self, key: str) -> Optional[Dict]:
+        await self.open()
+        async with self._db.execute("SELECT rollup FROM rollups WHERE key = ?", (key,)) as cursor:
+            row = await cursor.fetchone()
+        return json.loads(row[0]) if row else None
+
+    async def _store(self, key: str, rollup: Dict) -> None:
+        await self.open()
+        await self._db.execute(
+            "INSERT OR REPLACE INTO rollups (key, rollup, updated_at) VALUES (?, ?, ?)",
+            (key, json.dumps(rollup), rollup["updated_at"]),
+        )
+        await self._db.commit()
+
+    async def get(self, drug_name: str, refresh: bool = False) -> Tuple[Dict, str]:
+        """The rollup for a drug and where it came from: "store", "upstream" or "stale".
+
+        Upstream errors propagate when there is no stored rollup to fall back on.
+        """
+        drug_name = " ".join(drug_name.split())
+        if not self.enabled:
+            return await build_rollup(drug_name), "upstream"
+
+        key = normalize_drug_name(drug_name)
+        stored = await self._load(key)
+        if stored is not None and not refresh and time.time() - stored["updated_at"] < self.ttl:
+            self.counters["hits"] += 1
+            return stored, "store"
+
+        self.counters["misses" if stored is None else "refreshes"] += 1
+        try:
+            rollup = await self._flights.do(key, lambda: self._rebuild(key, drug_name))
+        except Exception as e:
+            self.counters["errors"] += 1
+            if stored is None:
+                raise
+            logger.warning("Refreshing adverse event rollup for %r failed, serving stored copy: %s", key, e)
+            self.counters["stale_served"] += 1
+            return stored, "stale"
+        return rollup, "upstream"
+
+    async def _rebuild(self, key: str, drug_name: str) -> Dict:
+        rollup = await build_rollup(drug_name)
+        if rollup["total_reports"] == 0:
+            self.counters["no_reports"] += 1
+        else:
+            await self._store(key, rollup)
+        return rollup
+
+    def stats(self) -> Dict:
+        return {"enabled": self.enabled, "ttl_seconds": self.ttl, "in_flight": len(self._flights), **self.counters}
+
+
+adverse_event_store = AdverseEventStore()
@@ -0,0 +1,40 @@
+import os
+from dotenv import load_dotenv
+
+# Load environment variables before any module reads them
+load_dotenv()
+
+
+def env_int(name: str, default: int) -> int:
+    value = os.getenv(name)
+    return int(value) if value else default
+
+
+def env_float(name: str, default: float) -> float:
+    value = os.getenv(name)
+    return float(value) if value else default
+
+
+def env_bool(name: str, default: bool) -> bool:
+    value = os.getenv(name)
+    if not value:
+        return default
+    return value.strip().lower() in ("1", "true", "yes", "on")
+
+
+# API keys from environment only - never hardcode secrets
+FDA_API_KEY = os.getenv("FDA_API_KEY", "")
+GEMINI_API_KEY = os.getenv("GEMINI_API_KEY", "")
+RESEND_API_KEY = os.getenv("RESEND_API_KEY", "")
+
+# Upstream base URLs; overridable so the service can point at mirrors or local fakes
+FDA_BASE_URL = os.getenv("FDA_BASE_URL", "https://api.fda.gov")
+RESEND_BASE_URL = os.getenv("RESEND_BASE_URL", "https://api.resend.com")
+
+# Local state (caches, stores) lives here unless a more specific path is set
+DATA_DIR = os.getenv("DATA_DIR", os.path.join(os.path.dirname(os.path.dirname(__file__)), "data"))
+
+# Configure CORS - restrict to known origins; override via ALLOWED_ORIGINS env var
+ALLOWED_ORIGINS = os.getenv(
+    "ALLOWED_ORIGINS", "http://localhost:5173,http://localhost:3000"
+).split(",")
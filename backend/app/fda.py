@@ -0,0 +1,84 @@
+"""openFDA drug label lookups shared by the endpoints."""
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional
+
+from app.config import FDA_API_KEY, env_int
+from app.http_clients import clients
+from app.label_cache import label_cache
+from app.label_store import LABEL_SOURCE, label_store
+
+# Maximum number of label lookups a single request runs at once
+LABEL_FETCH_CONCURRENCY = env_int("FDA_LABEL_FETCH_CONCURRENCY", 8)
+
+
+def fda_params(extra: dict) -> dict:
+    params = dict(extra)
+    if FDA_API_KEY:
+        params["api_key"] = FDA_API_KEY
+    return params
+
+
+def normalize_drug_name(name: str) -> str:
+    """Key under which case and whitespace variants of a drug name collapse."""
+    return " ".join(name.split()).casefold()
+
+
+class SingleFlight:
+    """Shares one in-flight call between all concurrent callers of the same key."""
+
+    def __init__(self):
+        self._inflight: Dict[Hashable, asyncio.Future] = {}
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[Any]]) -> Any:
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(fn())
+            self._inflight[key] = task
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        # Shield so one caller going away does not cancel the call for the others
+        return await asyncio.shield(task)
+
+    def __len__(self) -> int:
+        return len(self._inflight)
+
+
+_label_flights = SingleFlight()
+
+
+async def _request_label(name: str) -> Optional[Dict]:
+    response = await clients.fda.get(
+        "/drug/label.json",
+        params=fda_params({"search": f'openfda.brand_name:"{name}"'}),
+    )
+    if response.status_code == 404:
+        # openFDA answers a search with no matches with 404 NOT_FOUND; cached as "no label"
+        return None
+    response.raise_for_status()
+    results = response.json().get("results")
+    return results[0] if results else None
+
+
+async def fetch_label(name: str, on_fetch: Optional[Callable[[], None]] = None) -> Optional[Dict]:
+    """Return the first openFDA label for a brand name, or None if there is none.
+
+    With LABEL_SOURCE set to "local" or "local-first" the offline label store is
+    consulted first. Remote lookups are served from the label cache when
+    possible. Upstream errors are raised (httpx.HTTPStatusError for non-2xx
+    responses) and are never cached. on_fetch is called when the lookup sends a
+    request to openFDA (a cache miss or a background refresh), not when it is
+    served from the cache or joins a request already in flight.
+    """
+    name = " ".join(name.split())
+    if LABEL_SOURCE != "remote":
+        label = await label_store.get_label(name)
+        if label is not None or LABEL_SOURCE == "local":
+            return label
+
+    key = normalize_drug_name(name)
+
+    async def fetch() -> Optional[Dict]:
+        if on_fetch is not None:
+            on_fetch()
+        return await _request_label(name)
+
+    return await _label_flights.do(key, lambda: label_cache.get_or_fetch(key, fetch))
@@ -0,0 +1,361 @@
+"""Application-scoped HTTP connection pools, one per upstream API.
+
+Requests through a pool also go through that upstream's rate limiter, retry
+policy and circuit breaker (see _ResilientTransport), configured from
+<NAME>_* environment variables like the pool itself.
+"""
+from dataclasses import dataclass
+from typing import Callable, Dict, Optional, Set
+import asyncio
+import httpx
+import time
+
+from app.config import FDA_BASE_URL, RESEND_BASE_URL, env_bool, env_float, env_int
+from app.metrics import count_upstream_rejection, count_upstream_retry, observe_upstream
+from app.resilience import (
+    RETRY_STATUSES, CircuitBreaker, CircuitOpenError, RateLimitedError, TokenBucket, backoff, retry_after,
+)
+
+try:
+    import h2  # noqa: F401  (httpx needs it for HTTP/2)
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+
+@dataclass(frozen=True)
+class PoolConfig:
+    name: str
+    base_url: str
+    timeout: float
+    connect_timeout: float
+    max_connections: int
+    max_keepalive_connections: int
+    keepalive_expiry: float
+    http2: bool
+    rate_limit: float = 0.0
+    rate_limit_burst: int = 1
+    rate_limit_max_wait: float = 10.0
+    retries: int = 0
+    retry_base_seconds: float = 0.25
+    retry_max_seconds: float = 4.0
+    breaker_failures: int = 0
+    breaker_reset_seconds: float = 30.0
+    hedge_after_seconds: float = 0.0
+
+    def call_budget_seconds(self) -> float:
+        """Longest a call can take before it returns or fails: per attempt, the rate
+        limiter wait and the connect and read timeouts, plus the delays between retries."""
+        attempts = self.retries + 1
+        return (
+            attempts * (self.rate_limit_max_wait + self.connect_timeout + self.timeout)
+            + self.retries * self.retry_max_seconds
+        )
+
+    @classmethod
+    def from_env(
+        cls, name: str, base_url: str, timeout: float, rate_limit: float = 0.0, rate_limit_burst: int = 1,
+        retries: int = 3,
+    ) -> "PoolConfig":
+        """Read pool settings from <NAME>_* environment variables."""
+        prefix = name.upper()
+        return cls(
+            name=name,
+            base_url=base_url,
+            timeout=env_float(f"{prefix}_TIMEOUT_SECONDS", timeout),
+            connect_timeout=env_float(f"{prefix}_CONNECT_TIMEOUT_SECONDS", 5.0),
+            max_connections=env_int(f"{prefix}_POOL_MAX_CONNECTIONS", 100),
+            max_keepalive_connections=env_int(f"{prefix}_POOL_MAX_KEEPALIVE", 20),
+            keepalive_expiry=env_float(f"{prefix}_POOL_KEEPALIVE_EXPIRY_SECONDS", 30.0),
+            http2=env_bool(f"{prefix}_HTTP2", True) and HTTP2_AVAILABLE,
+            rate_limit=env_float(f"{prefix}_RATE_LIMIT_PER_SECOND", rate_limit),
+            rate_limit_burst=env_int(f"{prefix}_RATE_LIMIT_BURST", rate_limit_burst),
+            rate_limit_max_wait=env_float(f"{prefix}_RATE_LIMIT_MAX_WAIT_SECONDS", 10.0),
+            retries=env_int(f"{prefix}_RETRIES", retries),
+            retry_base_seconds=env_float(f"{prefix}_RETRY_BASE_SECONDS", 0.25),
+            retry_max_seconds=env_float(f"{prefix}_RETRY_MAX_SECONDS", 4.0),
+            breaker_failures=env_int(f"{prefix}_BREAKER_FAILURES", 5),
+            breaker_reset_seconds=env_float(f"{prefix}_BREAKER_RESET_SECONDS", 30.0),
+            hedge_after_seconds=env_float(f"{prefix}_HEDGE_AFTER_SECONDS", 0.0),
+        )
+
+
+def default_pool_configs() -> Dict[str, PoolConfig]:
+    return {
+        # openFDA allows 240 requests per minute per API key
+        "fda": PoolConfig.from_env("fda", FDA_BASE_URL, timeout=10.0, rate_limit=4.0, rate_limit_burst=20),
+        # Resend's default limit is 2 requests per second. Only the email outbox calls
+        # Resend, and it retries on its own schedule, so the transport does not
+        "resend": PoolConfig.from_env(
+            "resend", RESEND_BASE_URL, timeout=10.0, rate_limit=2.0, rate_limit_burst=2, retries=0,
+        ),
+    }
+
+
+class _TrackedStream(httpx.AsyncByteStream):
+    """Response body wrapper that reports when the body has been released."""
+
+    def __init__(self, stream: httpx.AsyncByteStream, on_close: Callable[[], None]):
+        self._stream = stream
+        self._on_close: Optional[Callable[[], None]] = on_close
+
+    async def __aiter__(self):
+        async for chunk in self._stream:
+            yield chunk
+
+    async def aclose(self) -> None:
+        if self._on_close is not None:
+            self._on_close()
+            self._on_close = None
+        await self._stream.aclose()
+
+
+class _CountingTransport(httpx.AsyncHTTPTransport):
+    """Pooled transport that keeps in-flight request counters for sizing the pool.
+
+    Each request's latency, up to the body being read, is reported to app.metrics.
+    """
+
+    def __init__(self, name: str = "upstream", **kwargs):
+        super().__init__(**kwargs)
+        self.name = name
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self.total_requests = 0
+
+    def _release(self, path: str, status: str, started: float) -> None:
+        self.in_flight -= 1
+        observe_upstream(self.name, path, status, time.perf_counter() - started)
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        self.total_requests += 1
+        self.in_flight += 1
+        self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+        started = time.perf_counter()
+        path = request.url.path
+        try:
+            response = await super().handle_async_request(request)
+        except BaseException:
+            self._release(path, "error", started)
+            raise
+        status = str(response.status_code)
+        return httpx.Response(
+            status_code=response.status_code,
+            headers=response.headers,
+            stream=_TrackedStream(response.stream, lambda: self._release(path, status, started)),
+            extensions=response.extensions,
+        )
+
+    def pool_stats(self) -> Dict:
+        connections = self._pool.connections
+        idle = sum(1 for c in connections if c.is_idle())
+        return {
+            "connections": len(connections),
+            "active_connections": len(connections) - idle,
+            "idle_connections": idle,
+            "in_flight": self.in_flight,
+            "peak_in_flight": self.peak_in_flight,
+            "total_requests": self.total_requests,
+        }
+
+
+def _succeeded(task: asyncio.Future) -> bool:
+    return not task.cancelled() and task.exception() is None and task.result().status_code < 500
+
+
+class _ResilientTransport(httpx.AsyncBaseTransport):
+    """Rate limiting, retries, circuit breaking and optional hedging around a pooled transport.
+
+    429 and 5xx responses and connection errors are retried with jittered
+    exponential backoff (honouring Retry-After). Apart from 429s, which the
+    upstream rejected without acting on, only GETs and requests carrying an
+    Idempotency-Key are retried. Once the breaker opens, requests fail at once
+    with CircuitOpenError. With hedge_after_seconds set, a GET with no response
+    by then is sent a second time (if the rate limit allows) and the first
+    good response wins.
+    """
+
+    def __init__(self, inner: httpx.AsyncBaseTransport, config: PoolConfig):
+        self.inner = inner
+        self.name = config.name
+        self.limiter = TokenBucket(config.rate_limit, config.rate_limit_burst, config.rate_limit_max_wait)
+        self.breaker = CircuitBreaker(config.name, config.breaker_failures, config.breaker_reset_seconds)
+        self.retries = config.retries
+        self.retry_base = config.retry_base_seconds
+        self.retry_max = config.retry_max_seconds
+        self.hedge_after = config.hedge_after_seconds
+        self.counters = {"retries": 0, "hedges": 0, "hedge_wins": 0}
+        self._discards: Set[asyncio.Task] = set()
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        try:
+            self.breaker.before_call()
+        except CircuitOpenError:
+            count_upstream_rejection(self.name, "circuit_open")
+            raise
+        failed = None
+        try:
+            response = await self._send_with_retries(request)
+            failed = response.status_code >= 500
+            return response
+        except RateLimitedError:
+            # Not sent, so no outcome: a half-open trial is released, not counted as a success
+            count_upstream_rejection(self.name, "rate_limited")
+            raise
+        except httpx.TransportError:
+            failed = True
+            raise
+        finally:
+            if failed:
+                self.breaker.record_failure()
+            elif failed is None:
+                self.breaker.abandon()
+            else:
+                self.breaker.record_success()
+
+    async def _send_with_retries(self, request: httpx.Request) -> httpx.Response:
+        idempotent = request.method in ("GET", "HEAD") or "idempotency-key" in request.headers
+        attempt = 0
+        while True:
+            await self.limiter.acquire()
+            try:
+                response = await self._send(request)
+            except httpx.TransportError as e:
+                if not idempotent or attempt >= self.retries:
+                    raise
+                reason = type(e).__name__
+                delay = backoff(attempt, self.retry_base, self.retry_max)
+            else:
+                status = response.status_code
+                if status not in RETRY_STATUSES or attempt >= self.retries or (status != 429 and not idempotent):
+                    return response
+                reason = str(status)
+                delay = retry_after(response.headers)
+                delay = backoff(attempt, self.retry_base, self.retry_max) if delay is None else min(delay, self.retry_max)
+                await response.aclose()
+            self.counters["retries"] += 1
+            count_upstream_retry(self.name, reason)
+            attempt += 1
+            await asyncio.sleep(delay)
+
+    async def _send(self, request: httpx.Request) -> httpx.Response:
+        if not self.hedge_after or request.method != "GET":
+            return await self.inner.handle_async_request(request)
+        first = asyncio.ensure_future(self.inner.handle_async_request(request))
+        tasks = [first]
+        winner: Optional[asyncio.Future] = None
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=self.hedge_after)
+            if done or not self.limiter.try_acquire():
+                winner = first
+                return await first
+            self.counters["hedges"] += 1
+            tasks.append(asyncio.ensure_future(self.inner.handle_async_request(request)))
+            pending = set(tasks)
+            while winner is None:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                winner = next((t for t in done if _succeeded(t)), None)
+                if winner is None and not pending:
+                    winner = next(iter(done))
+            if winner is not first:
+                self.counters["hedge_wins"] += 1
+            return winner.result()
+        finally:
+            # Cancel the other request, and release any response it already got
+            losers = [t for t in tasks if t is not winner]
+            if losers:
+                for task in losers:
+                    task.cancel()
+                discard = asyncio.ensure_future(self._discard(losers))
+                self._discards.add(discard)
+                discard.add_done_callback(self._discards.discard)
+
+    @staticmethod
+    async def _discard(tasks) -> None:
+        for result in await asyncio.gather(*tasks, return_exceptions=True):
+            if isinstance(result, httpx.Response):
+                await result.aclose()
+
+    async def aclose(self) -> None:
+        await self.inner.aclose()
+
+    def stats(self) -> Dict:
+        return {"limiter": self.limiter.stats(), "breaker": self.breaker.stats(), **self.counters}
+
+
+class UpstreamClients:
+    """Holds one long-lived AsyncClient per upstream so connections are reused."""
+
+    def __init__(self, configs: Optional[Dict[str, PoolConfig]] = None):
+        self._configs = configs
+        self._clients: Dict[str, httpx.AsyncClient] = {}
+        self._transports: Dict[str, _CountingTransport] = {}
+        self._resilient: Dict[str, _ResilientTransport] = {}
+
+    @property
+    def configs(self) -> Dict[str, PoolConfig]:
+        if self._configs is None:
+            self._configs = default_pool_configs()
+        return self._configs
+
+    def _create(self, config: PoolConfig) -> httpx.AsyncClient:
+        limits = httpx.Limits(
+            max_connections=config.max_connections,
+            max_keepalive_connections=config.max_keepalive_connections,
+            keepalive_expiry=config.keepalive_expiry,
+        )
+        transport = _CountingTransport(name=config.name, limits=limits, http2=config.http2)
+        self._transports[config.name] = transport
+        resilient = self._resilient[config.name] = _ResilientTransport(transport, config)
+        return httpx.AsyncClient(
+            base_url=config.base_url,
+            transport=resilient,
+            timeout=httpx.Timeout(config.timeout, connect=config.connect_timeout),
+        )
+
+    def start(self) -> None:
+        for name in self.configs:
+            self.get(name)
+
+    def get(self, name: str) -> httpx.AsyncClient:
+        client = self._clients.get(name)
+        if client is None or client.is_closed:
+            client = self._clients[name] = self._create(self.configs[name])
+        return client
+
+    @property
+    def fda(self) -> httpx.AsyncClient:
+        return self.get("fda")
+
+    @property
+    def resend(self) -> httpx.AsyncClient:
+        return self.get("resend")
+
+    async def aclose(self) -> None:
+        clients, self._clients = self._clients, {}
+        self._transports = {}
+        self._resilient = {}
+        for client in clients.values():
+            await client.aclose()
+
+    def stats(self) -> Dict:
+        """Pool utilization per upstream, for sizing limits against worker count."""
+        result = {}
+        for name, config in self.configs.items():
+            transport = self._transports.get(name)
+            entry = {
+                "base_url": config.base_url,
+                "http2": config.http2,
+                "max_connections": config.max_connections,
+                "max_keepalive_connections": config.max_keepalive_connections,
+                "keepalive_expiry": config.keepalive_expiry,
+                "open": transport is not None,
+            }
+            if transport is not None:
+                entry.update(transport.pool_stats())
+                entry.update(self._resilient[name].stats())
+            result[name] = entry
+        return result
+
+
+clients = UpstreamClients()
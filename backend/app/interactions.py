@@ -0,0 +1,227 @@
+"""Basic conflict detection between the drugs of one request, from FDA label text.
+
+Every drug_interactions paragraph is split into words a single time and looked
+up against an index of the names of all drugs in the request (generic names,
+their components with salt forms stripped, and common synonyms). Matching is on
+whole words, and the cost grows with the amount of label text rather than with
+the number of drug pairs times the text size. The word sets of a label's
+paragraphs are kept with the label (app.label_text), since the same labels come
+up request after request.
+
+With only a few names to look for, splitting label text into words costs more
+than searching for them, so small requests search the casefolded text for each
+name, like the original pairwise scan did, and check word boundaries with a
+regular expression where a name occurs.
+"""
+import re
+import string
+from functools import lru_cache
+from typing import Dict, FrozenSet, List, Pattern, Sequence, Set, Tuple
+
+from app import label_text
+
+# Word boundaries as label_text.words() splits them
+_SEPARATOR_CHARS = frozenset(string.punctuation)
+_SEPARATOR = r"[\s" + re.escape(string.punctuation) + "]"
+_WORD_CHAR = r"[^\s" + re.escape(string.punctuation) + "]"
+_COMPONENT_SEPARATORS = re.compile(r"\s+and\s+|[,;/]|\s+with\s+")
+
+# Salt and hydrate words dropped to get the active moiety ("warfarin sodium" -> "warfarin")
+SALT_WORDS = frozenset({
+    "acetate", "anhydrous", "besylate", "bitartrate", "bromide", "calcium", "citrate",
+    "dihydrate", "dihydrochloride", "dipropionate", "disodium", "fumarate", "hcl",
+    "hyclate", "hydrobromide", "hydrochloride", "magnesium", "maleate", "mesylate",
+    "monohydrate", "phosphate", "potassium", "propionate", "sodium", "succinate",
+    "sulfate", "tartrate", "trihydrate",
+})
+
+# What is left of a mineral salt once the cation is stripped ("potassium chloride" ->
+# "chloride"); such remainders name the counter-ion of many drugs, not this one
+COUNTER_IONS = frozenset({
+    "bicarbonate", "carbonate", "chloride", "fluoride", "gluconate", "hydroxide", "iodide",
+    "lactate", "nitrate", "oxide", "trisilicate",
+})
+
+# Alternative names seen in label text for the same ingredient
+SYNONYMS: Dict[str, Tuple[str, ...]] = {
+    "acetaminophen": ("paracetamol",),
+    "albuterol": ("salbutamol",),
+    "aspirin": ("acetylsalicylic acid",),
+    "cyclosporine": ("ciclosporin",),
+    "epinephrine": ("adrenaline",),
+    "furosemide": ("frusemide",),
+    "glyburide": ("glibenclamide",),
+    "lidocaine": ("lignocaine",),
+    "meperidine": ("pethidine",),
+    "norepinephrine": ("noradrenaline",),
+    "rifampin": ("rifampicin",),
+}
+
+_MIN_ALIAS_LENGTH = 3
+
+# Up to this many distinct first words, searching the text for each is cheaper
+# than splitting it into words
+_SCAN_MAX_WORDS = 8
+
+
+def _normalized_paragraph(text: str) -> Tuple[FrozenSet[str], str]:
+    """Distinct words of a paragraph, and its words joined by single spaces."""
+    words = label_text.words(text)
+    return frozenset(words), f" {' '.join(words)} "
+
+
+@lru_cache(maxsize=1024)
+def _alias_pattern(alias: str) -> Pattern:
+    """Matches alias at the start of a word of casefolded text, as whole words."""
+    body = (_SEPARATOR + "+").join(re.escape(w) for w in alias.split())
+    return re.compile(f"{body}(?!{_WORD_CHAR})")
+
+
+def _word_starts(folded: str, word: str):
+    """Offsets in casefolded text where word occurs at the start of a word."""
+    start = folded.find(word)
+    while start != -1:
+        if start == 0 or folded[start - 1] in _SEPARATOR_CHARS or folded[start - 1].isspace():
+            yield start
+        start = folded.find(word, start + 1)
+
+
+def drug_aliases(generic_name: str) -> Set[str]:
+    """Names under which a drug may appear in another label's interaction text."""
+    aliases = set()
+    full = " ".join(label_text.words(generic_name))
+    if full:
+        aliases.add(full)
+    for component in _COMPONENT_SEPARATORS.split(generic_name.casefold()):
+        words = label_text.words(component)
+        if not words:
+            continue
+        aliases.add(" ".join(words))
+        moiety = [w for w in words if w not in SALT_WORDS]
+        if moiety and not all(w in COUNTER_IONS for w in moiety):
+            aliases.add(" ".join(moiety))
+    for alias in list(aliases):
+        for synonym in SYNONYMS.get(alias, ()):
+            aliases.add(" ".join(label_text.words(synonym)))
+    return {a for a in aliases if len(a) >= _MIN_ALIAS_LENGTH}
+
+
+class InteractionMatcher:
+    """Finds which drugs of a request are named in a piece of label text."""
+
+    def __init__(self, generic_names: Sequence[str]):
+        # One-word aliases, and multi-word aliases grouped by their first word
+        self._single: Dict[str, Set[int]] = {}
+        self._multi: Dict[str, Dict[str, Set[int]]] = {}
+        for i, generic_name in enumerate(generic_names):
+            if not generic_name:
+                continue
+            for alias in drug_aliases(generic_name):
+                first, _, rest = alias.partition(" ")
+                if rest:
+                    self._multi.setdefault(first, {}).setdefault(alias, set()).add(i)
+                else:
+                    self._single.setdefault(alias, set()).add(i)
+        self._first_words = set(self._single) | set(self._multi)
+        # For searching raw text: the aliases starting with each first word, as patterns
+        self._patterns: Dict[str, List[Tuple[Pattern, Set[int]]]] = {}
+        for word in self._first_words:
+            aliases = list(self._multi.get(word, {}).items())
+            if word in self._single:
+                aliases.append((word, self._single[word]))
+            self._patterns[word] = [(_alias_pattern(alias), drugs) for alias, drugs in aliases]
+
+    def mentions(self, text: str) -> Set[int]:
+        """Indexes of the drugs named in text, matched on whole words."""
+        if len(self._first_words) > _SCAN_MAX_WORDS:
+            return self.mentions_words(*_normalized_paragraph(text))
+        folded = text.casefold()
+        found: Set[int] = set()
+        for word, patterns in self._patterns.items():
+            if word not in folded:
+                continue
+            for start in _word_starts(folded, word):
+                for pattern, drugs in patterns:
+                    if pattern.match(folded, start):
+                        found |= drugs
+        return found
+
+    def mentions_per_paragraph(self, drug) -> List[Set[int]]:
+        """mentions() for each drug_interactions paragraph of a DrugInfo."""
+        if len(self._first_words) <= _SCAN_MAX_WORDS:
+            return [self.mentions(text) for text in drug.drug_interactions]
+        paragraphs = label_text.derived(
+            drug, "drug_interactions", lambda: [_normalized_paragraph(text) for text in drug.drug_interactions]
+        )
+        return [self.mentions_words(words, joined) for words, joined in paragraphs]
+
+    def mentions_words(self, words: FrozenSet[str], joined: str) -> Set[int]:
+        """Same as mentions, for text already split into words (joined: " w1 w2 ... ")."""
+        found: Set[int] = set()
+        for word in self._first_words & words:
+            found |= self._single.get(word, set())
+            for alias, drugs in self._multi.get(word, {}).items():
+                if f" {alias} " in joined:
+                    found |= drugs
+        return found
+
+
+def _shared_by_pair(texts_per_drug: List[List[str]]) -> Dict[Tuple[int, int], List[str]]:
+    """Paragraphs that appear on more than one label, grouped by drug pair."""
+    owners: Dict[str, List[int]] = {}
+    for i, texts in enumerate(texts_per_drug):
+        for text in dict.fromkeys(texts):
+            owners.setdefault(text, []).append(i)
+    shared: Dict[Tuple[int, int], List[str]] = {}
+    for text, drugs in owners.items():
+        for a in range(len(drugs)):
+            for b in range(a + 1, len(drugs)):
+                shared.setdefault((drugs[a], drugs[b]), []).append(text)
+    return shared
+
+
+def find_basic_conflicts(drug_infos: Sequence) -> List[Dict]:
+    """Conflict records for every pair of DrugInfos, in pair order.
+
+    For each pair: "explicit_interaction" records for interaction paragraphs of
+    either label that name the other drug, then a "contraindication" record for
+    shared contraindications and a "warning" record for shared warnings.
+    """
+    generic_names = [d.generic_name for d in drug_infos]
+    matcher = InteractionMatcher(generic_names)
+
+    # hits[i][j]: drug i's interaction paragraphs that name drug j, in label order
+    hits: List[Dict[int, List[str]]] = []
+    for i, drug in enumerate(drug_infos):
+        by_drug: Dict[int, List[str]] = {}
+        if drug.generic_name:
+            for interaction, mentioned in zip(drug.drug_interactions, matcher.mentions_per_paragraph(drug)):
+                for j in mentioned:
+                    if j != i:
+                        by_drug.setdefault(j, []).append(interaction)
+        hits.append(by_drug)
+
+    common_contra = _shared_by_pair([d.contraindications for d in drug_infos])
+    common_warn = _shared_by_pair([d.warnings for d in drug_infos])
+
+    conflicts = []
+    for i, drug1 in enumerate(drug_infos):
+        for j in range(i + 1, len(drug_infos)):
+            drug2 = drug_infos[j]
+            if drug1.generic_name and drug2.generic_name:
+                for interaction in hits[i].get(j, []) + hits[j].get(i, []):
+                    conflicts.append({
+                        "drug1": drug1.brand_name, "drug2": drug2.brand_name,
+                        "type": "explicit_interaction", "details": [interaction],
+                    })
+            if (i, j) in common_contra:
+                conflicts.append({
+                    "drug1": drug1.brand_name, "drug2": drug2.brand_name,
+                    "type": "contraindication", "details": common_contra[(i, j)],
+                })
+            if (i, j) in common_warn:
+                conflicts.append({
+                    "drug1": drug1.brand_name, "drug2": drug2.brand_name,
+                    "type": "warning", "details": common_warn[(i, j)],
+                })
+    return conflicts
@@ -0,0 +1,196 @@
+"""Two-tier cache for FDA label lookups: in-process LRU backed by SQLite.
+
+Entries are fresh for LABEL_CACHE_TTL_SECONDS. After that they are still served
+for LABEL_CACHE_STALE_SECONDS while a background refresh fetches a new copy.
+"No FDA data" results are cached as well, for LABEL_CACHE_NEGATIVE_TTL_SECONDS.
+While openFDA's circuit breaker is open, even entries past the stale window are
+served rather than failing the lookup; they are kept for LABEL_CACHE_RETAIN_SECONDS
+for that purpose, so the fallback also works right after a restart.
+The SQLite tier survives restarts so a fresh worker starts warm.
+"""
+import asyncio
+import json
+import logging
+import os
+import time
+from dataclasses import dataclass
+from typing import Awaitable, Callable, Dict, Optional, Set, Tuple
+
+import aiosqlite
+
+from app.config import DATA_DIR, env_bool, env_float, env_int
+from app.lru import LRUCache
+from app.metrics import start_background
+from app.resilience import CircuitOpenError
+
+logger = logging.getLogger(__name__)
+
+LABEL_CACHE_ENABLED = env_bool("LABEL_CACHE_ENABLED", True)
+LABEL_CACHE_PATH = os.getenv("LABEL_CACHE_PATH", os.path.join(DATA_DIR, "label_cache.sqlite3"))
+LABEL_CACHE_MAX_ENTRIES = env_int("LABEL_CACHE_MAX_ENTRIES", 2048)
+LABEL_CACHE_TTL_SECONDS = env_float("LABEL_CACHE_TTL_SECONDS", 24 * 3600)
+LABEL_CACHE_STALE_SECONDS = env_float("LABEL_CACHE_STALE_SECONDS", 7 * 24 * 3600)
+LABEL_CACHE_NEGATIVE_TTL_SECONDS = env_float("LABEL_CACHE_NEGATIVE_TTL_SECONDS", 3600)
+# How long past the stale window entries are kept as the fallback while openFDA's breaker is open
+LABEL_CACHE_RETAIN_SECONDS = env_float("LABEL_CACHE_RETAIN_SECONDS", 30 * 24 * 3600)
+
+Fetcher = Callable[[], Awaitable[Optional[Dict]]]
+
+
+@dataclass
+class _Entry:
+    label: Optional[Dict]
+    fresh_until: float
+    stale_until: float
+
+
+class LabelCache:
+    def __init__(
+        self,
+        path: str = LABEL_CACHE_PATH,
+        max_entries: int = LABEL_CACHE_MAX_ENTRIES,
+        ttl: float = LABEL_CACHE_TTL_SECONDS,
+        stale: float = LABEL_CACHE_STALE_SECONDS,
+        negative_ttl: float = LABEL_CACHE_NEGATIVE_TTL_SECONDS,
+        retain: float = LABEL_CACHE_RETAIN_SECONDS,
+        enabled: bool = LABEL_CACHE_ENABLED,
+    ):
+        self.path = path
+        self.ttl = ttl
+        self.stale = stale
+        self.negative_ttl = negative_ttl
+        self.retain = retain
+        self.enabled = enabled
+        self._memory = LRUCache(max_entries)
+        self._db: Optional[aiosqlite.Connection] = None
+        self._open_lock = asyncio.Lock()
+        self._refreshing: Set[str] = set()
+        self._tasks: Set[asyncio.Task] = set()
+        self.counters = {
+            "memory_hits": 0,
+            "persistent_hits": 0,
+            "stale_hits": 0,
+            "negative_hits": 0,
+            "misses": 0,
+            "refreshes": 0,
+            "refresh_errors": 0,
+            "served_while_open": 0,
+        }
+
+    async def open(self) -> None:
+        async with self._open_lock:
+            if self._db is not None or not self.enabled:
+                return
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            db = await aiosqlite.connect(self.path)
+            await db.execute("PRAGMA journal_mode=WAL")
+            await db.execute(
+                "CREATE TABLE IF NOT EXISTS labels ("
+                " key TEXT PRIMARY KEY,"
+                " label TEXT,"
+                " fresh_until REAL NOT NULL,"
+                " stale_until REAL NOT NULL)"
+            )
+            await db.execute("DELETE FROM labels WHERE stale_until < ?", (time.time() - self.retain,))
+            await db.commit()
+            self._db = db
+
+    async def close(self) -> None:
+        for task in list(self._tasks):
+            task.cancel()
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+        if self._db is not None:
+            await self._db.close()
+            self._db = None
+        self._memory.clear()
+
+    async def _load(self, key: str) -> Tuple[Optional[_Entry], str]:
+        """The entry for key, whatever its age, and the tier it came from ("memory" or "persistent")."""
+        entry = self._memory.get(key)
+        if entry is not None:
+            return entry, "memory"
+        await self.open()
+        async with self._db.execute(
+            "SELECT label, fresh_until, stale_until FROM labels WHERE key = ?", (key,)
+        ) as cursor:
+            row = await cursor.fetchone()
+        if row is None:
+            return None, "persistent"
+        entry = _Entry(json.loads(row[0]) if row[0] else None, row[1], row[2])
+        self._memory.set(key, entry)
+        return entry, "persistent"
+
+    async def _store(self, key: str, label: Optional[Dict]) -> None:
+        now = time.time()
+        ttl = self.ttl if label else self.negative_ttl
+        entry = _Entry(label, now + ttl, now + ttl + self.stale)
+        self._memory.set(key, entry)
+        await self.open()
+        await self._db.execute(
+            "INSERT OR REPLACE INTO labels (key, label, fresh_until, stale_until) VALUES (?, ?, ?, ?)",
+            (key, json.dumps(label) if label else None, entry.fresh_until, entry.stale_until),
+        )
+        await self._db.commit()
+
+    async def _refresh(self, key: str, fetch: Fetcher) -> None:
+        self.counters["refreshes"] += 1
+        try:
+            await self._store(key, await fetch())
+        except Exception as e:
+            self.counters["refresh_errors"] += 1
+            logger.warning("Background refresh of FDA label %r failed: %s", key, e)
+        finally:
+            self._refreshing.discard(key)
+
+    def _schedule_refresh(self, key: str, fetch: Fetcher) -> None:
+        if key in self._refreshing:
+            return
+        self._refreshing.add(key)
+        task = start_background(self._refresh(key, fetch))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def get_or_fetch(self, key: str, fetch: Fetcher) -> Optional[Dict]:
+        """Return the cached label for key, calling fetch on a miss.
+
+        Exceptions raised by fetch propagate and nothing is cached for them.
+        """
+        if not self.enabled:
+            return await fetch()
+
+        entry, tier = await self._load(key)
+        now = time.time()
+        if entry is not None and now < entry.stale_until:
+            if entry.label is None:
+                self.counters["negative_hits"] += 1
+            if now < entry.fresh_until:
+                self.counters[f"{tier}_hits"] += 1
+            else:
+                self.counters["stale_hits"] += 1
+                self._schedule_refresh(key, fetch)
+            return entry.label
+
+        self.counters["misses"] += 1
+        try:
+            label = await fetch()
+        except CircuitOpenError:
+            if entry is None:
+                raise
+            self.counters["served_while_open"] += 1
+            return entry.label
+        await self._store(key, label)
+        return label
+
+    def stats(self) -> Dict:
+        return {
+            "enabled": self.enabled,
+            "memory_entries": len(self._memory),
+            "max_entries": self._memory.max_entries,
+            "evictions": self._memory.evictions,
+            "refreshes_in_flight": len(self._refreshing),
+            **self.counters,
+        }
+
+
+label_cache = LabelCache()
@@ -0,0 +1,403 @@
+"""Offline FDA drug label store built from the openFDA bulk download.
+
+Labels are imported from the drug label bulk files
+(https://open.fda.gov/data/downloads/, ``drug-label-*.json.zip``) into SQLite,
+with an FTS5 index over brand and generic names. On startup the names are also
+loaded into an in-memory index, so exact and prefix lookups never touch disk
+and fetching a label is a single primary-key read. Database reads run in worker
+threads, off the event loop.
+
+Import or update the store with::
+
+    cd backend
+    python -m app.label_store import path/to/drug-label-0001-of-0013.json.zip ...
+
+Re-importing is incremental: files already imported are skipped, and a label
+only replaces the stored copy when its effective_time is newer. A running
+server picks up new imports within LABEL_STORE_RELOAD_SECONDS: the name index
+is rebuilt in the background and swapped in once complete.
+"""
+import argparse
+import asyncio
+import bisect
+import json
+import logging
+import os
+import sqlite3
+import sys
+import threading
+import time
+import zipfile
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from app.config import DATA_DIR, env_float
+from app.metrics import start_background
+
+logger = logging.getLogger(__name__)
+
+# Where labels come from: "remote" (openFDA API), "local" (this store only)
+# or "local-first" (this store, falling back to openFDA on a miss)
+LABEL_SOURCE = os.getenv("LABEL_SOURCE", "remote").strip().lower()
+LABEL_STORE_PATH = os.getenv("LABEL_STORE_PATH", os.path.join(DATA_DIR, "labels.sqlite3"))
+LABEL_STORE_RELOAD_SECONDS = env_float("LABEL_STORE_RELOAD_SECONDS", 60.0)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS labels (
+    set_id TEXT PRIMARY KEY,
+    effective_time TEXT NOT NULL,
+    brand_name TEXT NOT NULL,
+    generic_name TEXT NOT NULL,
+    manufacturer TEXT NOT NULL,
+    product_type TEXT NOT NULL,
+    data TEXT NOT NULL
+);
+CREATE VIRTUAL TABLE IF NOT EXISTS label_search USING fts5(
+    set_id UNINDEXED, brand_name, generic_name
+);
+CREATE TABLE IF NOT EXISTS imports (
+    file TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime REAL NOT NULL,
+    labels INTEGER NOT NULL,
+    imported_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL);
+"""
+# 1: label_search rows share the rowid of their labels row (earlier stores are reindexed on open)
+_SCHEMA_VERSION = 1
+
+
+def _normalize(name: str) -> str:
+    return " ".join(name.split()).casefold()
+
+
+def _first(openfda: Dict, field: str) -> str:
+    values = openfda.get(field)
+    return values[0] if values else ""
+
+
+@dataclass(frozen=True)
+class _IndexedName:
+    """One searchable name (brand or generic) of one label."""
+
+    key: str
+    set_id: str
+    effective_time: str
+    brand_name: str
+    generic_name: str
+    manufacturer: str
+    product_type: str
+
+    def summary(self) -> Dict:
+        return {
+            "brand_name": self.brand_name,
+            "generic_name": self.generic_name,
+            "manufacturer": self.manufacturer,
+            "product_type": self.product_type,
+        }
+
+
+@dataclass
+class _NameIndex:
+    """In-memory name index of one generation of the store; replaced whole, never modified."""
+
+    # Exact lookups: normalized brand / generic name -> best label
+    by_brand: Dict[str, _IndexedName] = field(default_factory=dict)
+    by_generic: Dict[str, _IndexedName] = field(default_factory=dict)
+    # Prefix search: sorted names, and the entries in the same order
+    keys: List[str] = field(default_factory=list)
+    entries: List[_IndexedName] = field(default_factory=list)
+    generation: Optional[str] = None
+
+
+class LabelStore:
+    def __init__(self, path: str = LABEL_STORE_PATH):
+        self.path = path
+        self._db: Optional[sqlite3.Connection] = None
+        # The connection is shared by worker threads, one statement at a time
+        self._db_lock = threading.Lock()
+        self._index = _NameIndex()
+        self._checked_at = 0.0
+        self._reload: Optional[asyncio.Task] = None
+
+    # -- connection and schema -------------------------------------------------
+
+    def _connect(self) -> sqlite3.Connection:
+        with self._db_lock:
+            if self._db is None:
+                os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+                self._db = sqlite3.connect(self.path, check_same_thread=False)
+                self._db.execute("PRAGMA journal_mode=WAL")
+                self._db.executescript(_SCHEMA)
+                if self._db.execute("PRAGMA user_version").fetchone()[0] < _SCHEMA_VERSION:
+                    self._reindex()
+            return self._db
+
+    def _query(self, sql: str, params: Tuple = ()) -> List[Tuple]:
+        db = self._connect()
+        with self._db_lock:
+            return db.execute(sql, params).fetchall()
+
+    def _reindex(self) -> None:
+        """Rebuild label_search keyed by the labels rowid."""
+        with self._db:
+            self._db.execute("DELETE FROM label_search")
+            self._db.execute(
+                "INSERT INTO label_search (rowid, set_id, brand_name, generic_name)"
+                " SELECT rowid, set_id, brand_name, generic_name FROM labels"
+            )
+            self._db.execute(f"PRAGMA user_version = {_SCHEMA_VERSION}")
+
+    def close(self) -> None:
+        if self._reload is not None:
+            self._reload.cancel()
+            self._reload = None
+        with self._db_lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+    def _read_generation(self) -> Optional[str]:
+        rows = self._query("SELECT value FROM meta WHERE key = 'generation'")
+        return rows[0][0] if rows else None
+
+    # -- in-memory index ---------------------------------------------------------
+
+    def _build_index(self) -> _NameIndex:
+        """Read all names into a new index. Uses its own connection, so lookups go on meanwhile."""
+        self._connect()
+        db = sqlite3.connect(self.path)
+        try:
+            generation = db.execute("SELECT value FROM meta WHERE key = 'generation'").fetchone()
+            rows = db.execute(
+                "SELECT set_id, effective_time, brand_name, generic_name, manufacturer, product_type FROM labels"
+            )
+            index = _NameIndex(generation=generation[0] if generation else None)
+            for set_id, effective_time, brand, generic, manufacturer, product_type in rows:
+                for key, names in ((_normalize(brand), index.by_brand), (_normalize(generic), index.by_generic)):
+                    if not key:
+                        continue
+                    entry = _IndexedName(key, set_id, effective_time, brand, generic, manufacturer, product_type)
+                    # Several labels can share a name; keep the most recent one
+                    current = names.get(key)
+                    if current is None or entry.effective_time > current.effective_time:
+                        names[key] = entry
+        finally:
+            db.close()
+        index.entries = sorted(list(index.by_brand.values()) + list(index.by_generic.values()), key=lambda e: e.key)
+        index.keys = [e.key for e in index.entries]
+        logger.info("Loaded %d label names from %s", len(index.entries), self.path)
+        return index
+
+    def load(self) -> None:
+        """(Re)build the in-memory name index from the database, in the calling thread."""
+        self._index = self._build_index()
+        self._checked_at = time.monotonic()
+
+    async def open(self) -> None:
+        """Build the name index in a worker thread."""
+        self._index = await asyncio.to_thread(self._build_index)
+        self._checked_at = time.monotonic()
+
+    def _maybe_reload(self) -> None:
+        """Start a background reload if the store may have changed; lookups keep the current index."""
+        now = time.monotonic()
+        if now - self._checked_at < LABEL_STORE_RELOAD_SECONDS or self._reload is not None:
+            return
+        self._checked_at = now
+        self._reload = start_background(self._reload_if_changed())
+
+    async def _reload_if_changed(self) -> None:
+        try:
+            if await asyncio.to_thread(self._read_generation) != self._index.generation:
+                self._index = await asyncio.to_thread(self._build_index)
+        except Exception as e:
+            logger.warning("Reloading the label store failed: %s", e)
+        finally:
+            self._reload = None
+
+    def stats(self) -> Dict:
+        index = self._index
+        return {
+            "source": LABEL_SOURCE,
+            "path": self.path,
+            "brand_names": len(index.by_brand),
+            "generic_names": len(index.by_generic),
+        }
+
+    # -- lookups -----------------------------------------------------------------
+
+    async def get_label(self, name: str) -> Optional[Dict]:
+        """Label for a brand name (or generic name), or None if not in the store."""
+        self._maybe_reload()
+        index = self._index
+        key = _normalize(name)
+        entry = index.by_brand.get(key) or index.by_generic.get(key)
+        if entry is None:
+            return None
+        rows = await asyncio.to_thread(self._query, "SELECT data FROM labels WHERE set_id = ?", (entry.set_id,))
+        return json.loads(rows[0][0]) if rows else None
+
+    async def search(self, term: str, limit: int = 10) -> List[Dict]:
+        """Names starting with term first, then labels with a name word starting with it."""
+        self._maybe_reload()
+        index = self._index
+        key = _normalize(term)
+        results: List[Dict] = []
+        seen = set()
+
+        def add(summary: Dict) -> None:
+            marker = (summary["brand_name"].casefold(), summary["generic_name"].casefold())
+            if marker not in seen:
+                seen.add(marker)
+                results.append(summary)
+
+        start = bisect.bisect_left(index.keys, key)
+        for i in range(start, len(index.keys)):
+            if len(results) >= limit or not index.keys[i].startswith(key):
+                break
+            add(index.entries[i].summary())
+
+        if len(results) < limit and key:
+            words = [w.replace('"', "") for w in key.split()]
+            query = " ".join(f'"{w}"*' for w in words if w)
+            if query:
+                rows = await asyncio.to_thread(
+                    self._query,
+                    "SELECT l.brand_name, l.generic_name, l.manufacturer, l.product_type"
+                    " FROM label_search s JOIN labels l ON l.rowid = s.rowid"
+                    " WHERE label_search MATCH ? ORDER BY rank LIMIT ?",
+                    (query, limit * 2),
+                )
+                for brand, generic, manufacturer, product_type in rows:
+                    if len(results) >= limit:
+                        break
+                    add({
+                        "brand_name": brand,
+                        "generic_name": generic,
+                        "manufacturer": manufacturer,
+                        "product_type": product_type,
+                    })
+        return results[:limit]
+
+    # -- import --------------------------------------------------------------------
+
+    def import_files(self, paths: Iterable[str], force: bool = False) -> Dict[str, int]:
+        """Import bulk label files, skipping files that were already imported."""
+        db = self._connect()
+        totals = {"files": 0, "skipped_files": 0, "inserted": 0, "updated": 0, "unchanged": 0}
+        for path in paths:
+            stat = os.stat(path)
+            name = os.path.basename(path)
+            row = db.execute("SELECT size, mtime FROM imports WHERE file = ?", (name,)).fetchone()
+            if row and not force and row[0] == stat.st_size and row[1] == stat.st_mtime:
+                totals["skipped_files"] += 1
+                continue
+            counts = self._import_labels(_read_bulk_file(path))
+            db.execute(
+                "INSERT OR REPLACE INTO imports (file, size, mtime, labels, imported_at) VALUES (?, ?, ?, ?, ?)",
+                (name, stat.st_size, stat.st_mtime, sum(counts), time.time()),
+            )
+            db.execute(
+                "INSERT OR REPLACE INTO meta (key, value) VALUES ('generation', ?)", (str(time.time_ns()),)
+            )
+            db.commit()
+            totals["files"] += 1
+            totals["inserted"] += counts[0]
+            totals["updated"] += counts[1]
+            totals["unchanged"] += counts[2]
+        return totals
+
+    def _import_labels(self, labels: Iterator[Dict]) -> Tuple[int, int, int]:
+        db = self._connect()
+        inserted = updated = unchanged = 0
+        for label in labels:
+            set_id = label.get("set_id") or label.get("id")
+            if not set_id:
+                continue
+            effective_time = label.get("effective_time", "")
+            row = db.execute("SELECT rowid, effective_time FROM labels WHERE set_id = ?", (set_id,)).fetchone()
+            if row and row[1] >= effective_time:
+                unchanged += 1
+                continue
+            openfda = label.get("openfda", {})
+            brand = _first(openfda, "brand_name")
+            generic = _first(openfda, "generic_name")
+            values = (
+                effective_time, brand, generic,
+                _first(openfda, "manufacturer_name"), _first(openfda, "product_type"),
+                json.dumps(label, separators=(",", ":")),
+            )
+            # label_search rows are keyed by the labels rowid: set_id is UNINDEXED in FTS5,
+            # so deleting by it would scan the whole index for every label
+            if row:
+                rowid = row[0]
+                db.execute(
+                    "UPDATE labels SET effective_time = ?, brand_name = ?, generic_name = ?,"
+                    " manufacturer = ?, product_type = ?, data = ? WHERE rowid = ?",
+                    values + (rowid,),
+                )
+                db.execute("DELETE FROM label_search WHERE rowid = ?", (rowid,))
+                updated += 1
+            else:
+                rowid = db.execute(
+                    "INSERT INTO labels"
+                    " (effective_time, brand_name, generic_name, manufacturer, product_type, data, set_id)"
+                    " VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    values + (set_id,),
+                ).lastrowid
+                inserted += 1
+            db.execute(
+                "INSERT INTO label_search (rowid, set_id, brand_name, generic_name) VALUES (?, ?, ?, ?)",
+                (rowid, set_id, brand, generic),
+            )
+        return inserted, updated, unchanged
+
+
+def _read_bulk_file(path: str) -> Iterator[Dict]:
+    """Yield labels from a bulk download file (.json or .json.zip)."""
+    if path.endswith(".zip"):
+        with zipfile.ZipFile(path) as archive:
+            for member in archive.namelist():
+                if member.endswith(".json"):
+                    with archive.open(member) as f:
+                        yield from json.load(f).get("results", [])
+    else:
+        with open(path, "rb") as f:
+            yield from json.load(f).get("results", [])
+
+
+label_store = LabelStore()
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m app.label_store", description=__doc__.split("\n\n")[0])
+    sub = parser.add_subparsers(dest="command", required=True)
+    importer = sub.add_parser("import", help="import openFDA drug label bulk files")
+    importer.add_argument("files", nargs="+")
+    importer.add_argument("--force", action="store_true", help="re-read files that were already imported")
+    importer.add_argument("--db", default=LABEL_STORE_PATH)
+    searcher = sub.add_parser("search", help="search the local store")
+    searcher.add_argument("term")
+    searcher.add_argument("--limit", type=int, default=10)
+    searcher.add_argument("--db", default=LABEL_STORE_PATH)
+    args = parser.parse_args(argv)
+
+    store = LabelStore(args.db)
+    try:
+        if args.command == "import":
+            started = time.perf_counter()
+            totals = store.import_files(args.files, force=args.force)
+            totals["seconds"] = round(time.perf_counter() - started, 2)
+            print(json.dumps(totals))
+        else:
+            store.load()
+            print(json.dumps(asyncio.run(store.search(args.term, args.limit)), indent=2))
+    finally:
+        store.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,48 @@
+"""Splitting label text into words, and text derived from label sections (word
+sets, sentences) kept per label version.
+
+Conflict detection and prompt trimming split the same label sections request
+after request. What they derive is stored with the label's (set id, version)
+key, so an entry is never larger than the label it came from, and there are
+at most as many entries as the label cache holds labels. Drugs without a label
+key (no label found, lookup errors) are processed uncached.
+"""
+import string
+from typing import Callable, Dict, List, TypeVar
+
+from app.label_cache import LABEL_CACHE_MAX_ENTRIES
+from app.lru import LRUCache
+
+T = TypeVar("T")
+
+# Punctuation separates words, so "warfarin-induced" and "(warfarin)" both name warfarin
+_PUNCTUATION_TO_SPACE = str.maketrans({c: " " for c in string.punctuation})
+
+_derived = LRUCache(LABEL_CACHE_MAX_ENTRIES)
+
+
+def words(text: str) -> List[str]:
+    """Casefolded words of text, split on whitespace and punctuation."""
+    return text.casefold().translate(_PUNCTUATION_TO_SPACE).split()
+
+
+def derived(drug, name: str, build: Callable[[], T]) -> T:
+    """build(), computed once per label version of drug and kept under name."""
+    key = getattr(drug, "label_key", None)
+    if key is None:
+        return build()
+    entry: Dict[str, object] = _derived.get(key)
+    if entry is None:
+        entry = {}
+        _derived.set(key, entry)
+    if name not in entry:
+        entry[name] = build()
+    return entry[name]
+
+
+def clear() -> None:
+    _derived.clear()
+
+
+def stats() -> Dict[str, int]:
+    return {"labels": len(_derived), "max_labels": _derived.max_entries, "evictions": _derived.evictions}
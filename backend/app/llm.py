@@ -0,0 +1,469 @@
+"""LLM backends for the AI analysis steps.
+
+All calls go through ``llm``, which keeps them off the event loop, caps how many
+run at once (LLM_MAX_CONCURRENCY) and applies a per-call timeout
+(LLM_TIMEOUT_SECONDS). LLM_BACKEND selects the backend: "gemini" (default),
+"stub", a local deterministic backend for tests and load runs, or "none" for
+FDA-only mode. Gemini without GEMINI_API_KEY also runs in FDA-only mode, where
+every LLM call fails with LLMError and the FDA endpoints work as usual.
+
+The Gemini SDK is imported on first use (or by warm_up), not at import time.
+
+Calls are also paced by an optional rate limit (LLM_RATE_LIMIT_PER_SECOND),
+retried with jittered backoff when the API reports 429 or 5xx (LLM_RETRIES), and
+refused at once while a circuit breaker is open after repeated failures
+(LLM_BREAKER_FAILURES), instead of each request waiting for its own timeout.
+"""
+import asyncio
+import json
+import os
+import logging
+import random
+import threading
+import time
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, AsyncIterator, Dict, Iterable, Optional, Tuple
+
+from app.config import GEMINI_API_KEY, env_float, env_int
+from app.metrics import count_upstream_rejection, count_upstream_retry, observe_upstream
+from app.resilience import (
+    RETRY_STATUSES, CircuitBreaker, CircuitOpenError, RateLimitedError, TokenBucket, backoff,
+)
+
+logger = logging.getLogger(__name__)
+
+LLM_BACKEND = os.getenv("LLM_BACKEND", "gemini").strip().lower()
+LLM_MAX_CONCURRENCY = env_int("LLM_MAX_CONCURRENCY", 8)
+LLM_TIMEOUT_SECONDS = env_float("LLM_TIMEOUT_SECONDS", 60.0)
+GEMINI_MODEL = os.getenv("GEMINI_MODEL", "gemini-1.5-pro")
+STUB_LLM_LATENCY_SECONDS = env_float("STUB_LLM_LATENCY_SECONDS", 0.0)
+STUB_LLM_JITTER_SECONDS = env_float("STUB_LLM_JITTER_SECONDS", 0.0)
+STUB_LLM_ERROR_RATE = env_float("STUB_LLM_ERROR_RATE", 0.0)
+STUB_LLM_RESPONSES_PATH = os.getenv("STUB_LLM_RESPONSES_PATH", "")
+LLM_RATE_LIMIT_PER_SECOND = env_float("LLM_RATE_LIMIT_PER_SECOND", 0.0)
+LLM_RATE_LIMIT_BURST = env_int("LLM_RATE_LIMIT_BURST", LLM_MAX_CONCURRENCY)
+LLM_RETRIES = env_int("LLM_RETRIES", 2)
+LLM_RETRY_BASE_SECONDS = env_float("LLM_RETRY_BASE_SECONDS", 1.0)
+LLM_RETRY_MAX_SECONDS = env_float("LLM_RETRY_MAX_SECONDS", 8.0)
+LLM_BREAKER_FAILURES = env_int("LLM_BREAKER_FAILURES", 5)
+LLM_BREAKER_RESET_SECONDS = env_float("LLM_BREAKER_RESET_SECONDS", 30.0)
+
+LLM_DISABLED_MESSAGE = "AI analysis is disabled (no LLM configured; set GEMINI_API_KEY)"
+
+
+class LLMError(Exception):
+    pass
+
+
+class LLMBackend(ABC):
+    """Generates a completion for a prompt; returns None for an empty response."""
+
+    name = "base"
+    enabled = True
+
+    async def warm_up(self, configs: Iterable[Tuple[str, float, int]]) -> None:
+        """Prepare for calls with these (model, temperature, max_output_tokens) settings."""
+
+    @abstractmethod
+    async def generate(
+        self, prompt: str, *, model: str, temperature: float, max_output_tokens: int
+    ) -> Optional[str]:
+        """The completion for prompt."""
+
+    async def stream(
+        self, prompt: str, *, model: str, temperature: float, max_output_tokens: int
+    ) -> AsyncIterator[str]:
+        """Yield the completion incrementally; backends without streaming yield it whole."""
+        text = await self.generate(
+            prompt, model=model, temperature=temperature, max_output_tokens=max_output_tokens
+        )
+        if text:
+            yield text
+
+
+class GeminiBackend(LLMBackend):
+    name = "gemini"
+
+    def __init__(self, api_key: str, max_workers: int = LLM_MAX_CONCURRENCY):
+        self._api_key = api_key
+        self._genai: Any = None
+        self._import_lock = threading.Lock()
+        # One GenerativeModel per generation config, reused across calls
+        self._handles: Dict[Tuple[str, float, int], Any] = {}
+        # Runs the SDK import, and calls on SDK versions without generate_content_async
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="gemini")
+
+    def _sdk(self):
+        """The google.generativeai module, imported and configured on first use."""
+        if self._genai is None:
+            with self._import_lock:
+                if self._genai is None:
+                    import google.generativeai as genai
+
+                    genai.configure(api_key=self._api_key)
+                    self._genai = genai
+        return self._genai
+
+    async def _model(self, model: str, temperature: float, max_output_tokens: int):
+        key = (model, temperature, max_output_tokens)
+        handle = self._handles.get(key)
+        if handle is None:
+            if self._genai is None:
+                # The SDK import takes seconds; keep it off the event loop
+                await asyncio.get_running_loop().run_in_executor(self._executor, self._sdk)
+            handle = self._handles[key] = self._genai.GenerativeModel(
+                model_name=model,
+                generation_config={"temperature": temperature, "max_output_tokens": max_output_tokens},
+            )
+        return handle
+
+    async def warm_up(self, configs: Iterable[Tuple[str, float, int]]) -> None:
+        for model, temperature, max_output_tokens in configs:
+            await self._model(model, temperature, max_output_tokens)
+
+    async def generate(
+        self, prompt: str, *, model: str, temperature: float, max_output_tokens: int
+    ) -> Optional[str]:
+        handle = await self._model(model, temperature, max_output_tokens)
+        if hasattr(handle, "generate_content_async"):
+            response = await handle.generate_content_async(prompt)
+        else:
+            loop = asyncio.get_running_loop()
+            response = await loop.run_in_executor(self._executor, handle.generate_content, prompt)
+        return response.text if response else None
+
+    async def stream(
+        self, prompt: str, *, model: str, temperature: float, max_output_tokens: int
+    ) -> AsyncIterator[str]:
+        handle = await self._model(model, temperature, max_output_tokens)
+        if not hasattr(handle, "generate_content_async"):
+            async for text in super().stream(
+                prompt, model=model, temperature=temperature, max_output_tokens=max_output_tokens
+            ):
+                yield text
+            return
+        response = await handle.generate_content_async(prompt, stream=True)
+        async for chunk in response:
+            if chunk.text:
+                yield chunk.text
+
+
+class StubBackend(LLMBackend):
+    """Offline backend returning well-formed JSON for each prompt kind.
+
+    For load runs, responses can be delayed (latency plus up to jitter seconds),
+    fail at a given rate, and be replaced by recorded model output: a JSON file
+    mapping a prompt kind ("analysis", "differential", "drug_info") to response text.
+    """
+
+    name = "stub"
+
+    def __init__(
+        self,
+        latency: float = STUB_LLM_LATENCY_SECONDS,
+        jitter: float = STUB_LLM_JITTER_SECONDS,
+        error_rate: float = STUB_LLM_ERROR_RATE,
+        responses_path: str = STUB_LLM_RESPONSES_PATH,
+    ):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.responses: Dict[str, str] = {}
+        if responses_path:
+            with open(responses_path) as f:
+                self.responses = json.load(f)
+
+    @staticmethod
+    def _kind(prompt: str) -> str:
+        if "Patient ids:" in prompt:
+            return "batch"
+        if "advanced_conflicts" in prompt:
+            return "analysis"
+        if "diagnosis_similarity" in prompt:
+            return "differential"
+        return "drug_info"
+
+    def _canned(self, kind: str, prompt: str) -> str:
+        empty_analysis = {"advanced_conflicts": [], "diagnosis_contradictions": [], "additional_warnings": []}
+        if kind == "batch":
+            ids = prompt.split("Patient ids:", 1)[1].split("\n", 1)[0]
+            try:
+                analysis = json.loads(self.responses.get("analysis", ""))
+            except ValueError:
+                analysis = empty_analysis
+            result: Dict = {
+                "patients": [dict(analysis, patient=p.strip()) for p in ids.split(",") if p.strip()]
+            }
+        elif kind in self.responses:
+            return self.responses[kind]
+        elif kind == "analysis":
+            result = empty_analysis
+        elif kind == "differential":
+            result = {
+                "diagnosis_similarity": 0.5,
+                "matching_symptoms": [],
+                "diagnosis_assessment": "Stub assessment",
+                "alternatives": [],
+            }
+        else:
+            result = {
+                "summary": "Stub summary",
+                "key_warnings_explanation": "Stub warnings explanation",
+                "special_considerations": "Stub special considerations",
+            }
+        return json.dumps(result)
+
+    async def generate(
+        self, prompt: str, *, model: str, temperature: float, max_output_tokens: int
+    ) -> Optional[str]:
+        delay = self.latency + (random.uniform(0, self.jitter) if self.jitter else 0)
+        if delay:
+            await asyncio.sleep(delay)
+        if self.error_rate and random.random() < self.error_rate:
+            raise LLMError("Stub LLM error (STUB_LLM_ERROR_RATE)")
+        return self._canned(self._kind(prompt), prompt)
+
+    async def stream(
+        self, prompt: str, *, model: str, temperature: float, max_output_tokens: int
+    ) -> AsyncIterator[str]:
+        text = await self.generate(
+            prompt, model=model, temperature=temperature, max_output_tokens=max_output_tokens
+        )
+        for start in range(0, len(text), 32):
+            yield text[start:start + 32]
+
+
+class DisabledBackend(LLMBackend):
+    """FDA-only mode: no LLM is configured and every call fails."""
+
+    name = "none"
+    enabled = False
+
+    async def generate(
+        self, prompt: str, *, model: str, temperature: float, max_output_tokens: int
+    ) -> Optional[str]:
+        raise LLMError(LLM_DISABLED_MESSAGE)
+
+
+def create_backend(name: str = LLM_BACKEND) -> LLMBackend:
+    if name == "stub":
+        return StubBackend()
+    if name == "none":
+        return DisabledBackend()
+    if name == "gemini":
+        if not GEMINI_API_KEY:
+            logger.warning("GEMINI_API_KEY is not set; running in FDA-only mode without AI analysis")
+            return DisabledBackend()
+        return GeminiBackend(GEMINI_API_KEY)
+    raise RuntimeError(f"Unknown LLM_BACKEND: {name}")
+
+
+def _error_status(error: Exception) -> Optional[int]:
+    """HTTP status carried by an SDK error (google.api_core errors have an int code)."""
+    code = getattr(error, "code", None)
+    return code if isinstance(code, int) else None
+
+
+class LLM:
+    """Concurrency-limited, time-bounded front for an LLMBackend."""
+
+    def __init__(
+        self,
+        backend: LLMBackend,
+        max_concurrency: int = LLM_MAX_CONCURRENCY,
+        timeout: float = LLM_TIMEOUT_SECONDS,
+        retries: int = LLM_RETRIES,
+    ):
+        self.backend = backend
+        self.max_concurrency = max_concurrency
+        self.timeout = timeout
+        self.retries = retries
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self.limiter = TokenBucket(LLM_RATE_LIMIT_PER_SECOND, LLM_RATE_LIMIT_BURST, max_wait=timeout)
+        self.breaker = CircuitBreaker(backend.name, LLM_BREAKER_FAILURES, LLM_BREAKER_RESET_SECONDS)
+        self.in_flight = 0
+        self.waiting = 0
+        self.calls = 0
+        self.timeouts = 0
+        self.retried = 0
+
+    @property
+    def unavailable(self) -> bool:
+        """True while the circuit breaker is open; cached results may then be served expired."""
+        return self.breaker.is_open
+
+    @property
+    def enabled(self) -> bool:
+        return self.backend.enabled
+
+    async def warm_up(self, configs: Iterable[Dict]) -> None:
+        """Build the backend's model handles for these generation configs ahead of the first call."""
+        await self.backend.warm_up(
+            (config.get("model", GEMINI_MODEL), config["temperature"], config["max_output_tokens"])
+            for config in configs
+        )
+
+    async def generate(
+        self,
+        prompt: str,
+        *,
+        temperature: float,
+        max_output_tokens: int = 1000,
+        model: str = GEMINI_MODEL,
+    ) -> Optional[str]:
+        """Generate a completion, retrying with backoff when the API reports 429 or 5xx."""
+        attempt = 0
+        while True:
+            try:
+                return await self._generate_once(
+                    prompt, model=model, temperature=temperature, max_output_tokens=max_output_tokens
+                )
+            except Exception as e:
+                status = _error_status(e)
+                if status not in RETRY_STATUSES or attempt >= self.retries:
+                    raise
+                self.retried += 1
+                count_upstream_retry(self.backend.name, str(status))
+                await asyncio.sleep(backoff(attempt, LLM_RETRY_BASE_SECONDS, LLM_RETRY_MAX_SECONDS))
+                attempt += 1
+
+    async def _generate_once(
+        self, prompt: str, *, model: str, temperature: float, max_output_tokens: int
+    ) -> Optional[str]:
+        await self._before_call()
+        try:
+            await self._acquire()
+        except BaseException:
+            self._record_outcome("cancelled", None)
+            raise
+        started = time.perf_counter()
+        status = "cancelled"
+        error: Optional[Exception] = None
+        try:
+            text = await asyncio.wait_for(
+                self.backend.generate(
+                    prompt, model=model, temperature=temperature, max_output_tokens=max_output_tokens
+                ),
+                self.timeout,
+            )
+            status = "ok" if text else "empty"
+            return text
+        except asyncio.TimeoutError:
+            status = "timeout"
+            raise self._timed_out()
+        except Exception as e:
+            status, error = "error", e
+            raise
+        finally:
+            self._release()
+            self._record_outcome(status, error)
+            observe_upstream(self.backend.name, model, status, time.perf_counter() - started)
+
+    async def stream(
+        self,
+        prompt: str,
+        *,
+        temperature: float,
+        max_output_tokens: int = 1000,
+        model: str = GEMINI_MODEL,
+    ) -> AsyncIterator[str]:
+        """Yield completion text as it is generated; the timeout covers the whole stream."""
+        await self._before_call()
+        try:
+            await self._acquire()
+        except BaseException:
+            self._record_outcome("cancelled", None)
+            raise
+        started = time.perf_counter()
+        status = "cancelled"
+        error: Optional[Exception] = None
+        try:
+            loop = asyncio.get_running_loop()
+            deadline = loop.time() + self.timeout
+            chunks = self.backend.stream(
+                prompt, model=model, temperature=temperature, max_output_tokens=max_output_tokens
+            ).__aiter__()
+            while True:
+                try:
+                    chunk = await asyncio.wait_for(chunks.__anext__(), max(deadline - loop.time(), 0))
+                except StopAsyncIteration:
+                    status = "ok"
+                    return
+                except asyncio.TimeoutError:
+                    status = "timeout"
+                    raise self._timed_out()
+                except Exception as e:
+                    status, error = "error", e
+                    raise
+                yield chunk
+        finally:
+            self._release()
+            self._record_outcome(status, error)
+            observe_upstream(self.backend.name, model, status, time.perf_counter() - started)
+
+    async def _before_call(self) -> None:
+        """Fail fast while the breaker is open, then wait for the rate limiter."""
+        if not self.backend.enabled:
+            return
+        try:
+            self.breaker.before_call()
+        except CircuitOpenError as e:
+            count_upstream_rejection(self.backend.name, "circuit_open")
+            raise LLMError(str(e)) from e
+        try:
+            await self.limiter.acquire()
+        except RateLimitedError as e:
+            self.breaker.abandon()
+            count_upstream_rejection(self.backend.name, "rate_limited")
+            raise LLMError(f"LLM {e}") from e
+
+    def _record_outcome(self, status: str, error: Optional[Exception]) -> None:
+        if not self.backend.enabled:
+            return
+        if status in ("ok", "empty"):
+            self.breaker.record_success()
+        elif status == "cancelled":
+            self.breaker.abandon()
+        else:
+            # Errors for a bad request say nothing about the upstream's health
+            code = _error_status(error) if error is not None else None
+            if code is not None and code < 500 and code != 429:
+                self.breaker.record_success()
+            else:
+                self.breaker.record_failure()
+
+    async def _acquire(self) -> None:
+        self.waiting += 1
+        try:
+            await self._semaphore.acquire()
+        finally:
+            self.waiting -= 1
+        self.in_flight += 1
+        self.calls += 1
+
+    def _release(self) -> None:
+        self.in_flight -= 1
+        self._semaphore.release()
+
+    def _timed_out(self) -> LLMError:
+        self.timeouts += 1
+        return LLMError(f"LLM call timed out after {self.timeout:g}s")
+
+    def stats(self) -> Dict:
+        return {
+            "backend": self.backend.name,
+            "enabled": self.enabled,
+            "max_concurrency": self.max_concurrency,
+            "timeout_seconds": self.timeout,
+            "in_flight": self.in_flight,
+            "waiting": self.waiting,
+            "calls": self.calls,
+            "timeouts": self.timeouts,
+            "retries": self.retried,
+            "limiter": self.limiter.stats(),
+            "breaker": self.breaker.stats(),
+        }
+
+
+llm = LLM(create_backend())
@@ -1,102 +1,120 @@
-from fastapi import FastAPI, HTTPException
+import time
+
+# Measured from here so /api/stats can report how long importing the app took
+_IMPORT_STARTED = time.perf_counter()
+
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from fastapi import APIRouter, FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, PlainTextResponse, Response, StreamingResponse
 from pydantic import BaseModel
-from typing import List, Optional, Dict
+from typing import AsyncIterator, Callable, List, Optional, Dict, Set, Tuple, Type
+import asyncio
 import httpx
 import json
+import logging
 import os
-from dotenv import load_dotenv
-import google.generativeai as genai
-
-# Load environment variables
-load_dotenv()
-
-# API keys from environment only - never hardcode secrets
-FDA_API_KEY = os.getenv("FDA_API_KEY", "")
-GEMINI_API_KEY = os.getenv("GEMINI_API_KEY", "")
-RESEND_API_KEY = os.getenv("RESEND_API_KEY", "")
-
-if not GEMINI_API_KEY:
-    raise RuntimeError("GEMINI_API_KEY environment variable is required")
 
-genai.configure(api_key=GEMINI_API_KEY)
-
-app = FastAPI(title="Healthcare Drug Interaction Analyzer")
+try:
+    import orjson
+    from fastapi.responses import ORJSONResponse as FastJSONResponse
+except ImportError:
+    orjson = None
+    FastJSONResponse = JSONResponse
+
+from app.adverse_events import BUCKETS, adverse_event_store, fetch_reports, summarize
+from app.config import ALLOWED_ORIGINS, RESEND_API_KEY, env_bool, env_int
+from app.fda import LABEL_FETCH_CONCURRENCY, fda_params, fetch_label, normalize_drug_name
+from app.http_clients import clients
+from app.interactions import find_basic_conflicts
+from app.label_cache import label_cache
+from app.label_store import LABEL_SOURCE, label_store
+from app.llm import GEMINI_MODEL, LLM_DISABLED_MESSAGE, llm
+from app import label_text, metrics
+from app.metrics import METRICS_ENABLED, MetricsMiddleware, count_parse_failure, current_server_timing, span
+from app.models import (
+    AdvancedAnalysisOutput, AdverseEventPage, AdverseEventSummary, BatchAnalysis, BatchDrugAnalysisItem,
+    BatchDrugAnalysisRequest, DifferentialDiagnosis, DifferentialDiagnosisOutput, DrugAnalysisRequest,
+    DrugAnalysisResponse, DrugDetail, DrugInfo, DrugSearchResponse, EmailQueued, EmailRequest, EmailStatus,
+    EnhancedInfo, MessageResponse, ModelT, StatsResponse, SymptomAnalysisRequest, parse_llm_output, selected_fields,
+)
+from app.outbox import outbox
+from app.prompts import SECTION_LEGEND, context_terms, prompt_builder
+from app.resilience import STATE_VALUES
+from app.result_cache import canonical_set, canonical_text, result_cache
 
-# Configure CORS - restrict to known origins; override via ALLOWED_ORIGINS env var
-ALLOWED_ORIGINS = os.getenv(
-    "ALLOWED_ORIGINS", "http://localhost:5173,http://localhost:3000"
-).split(",")
+logger = logging.getLogger(__name__)
 
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=ALLOWED_ORIGINS,
-    allow_credentials=True,
-    allow_methods=["GET", "POST"],
-    allow_headers=["Content-Type", "Authorization"],
-)
+router = APIRouter()
 
 
-class DrugAnalysisRequest(BaseModel):
-    medications: List[str]
-    diagnosis: str
-    symptoms: List[str]
+# Batch analysis: items per request, patients per Gemini call, and Gemini calls
+# one batch may have in flight (the rest of LLM_MAX_CONCURRENCY stays free for
+# interactive requests)
+BATCH_MAX_ITEMS = env_int("BATCH_MAX_ITEMS", 1000)
+BATCH_LLM_GROUP_SIZE = env_int("BATCH_LLM_GROUP_SIZE", 5)
+BATCH_MAX_LLM_GROUP_SIZE = 20
+BATCH_LLM_CONCURRENCY = env_int("BATCH_LLM_CONCURRENCY", 2)
 
+ANALYSIS_GENERATION_CONFIG = {"temperature": 0.1, "max_output_tokens": 1000}
+DIFFERENTIAL_GENERATION_CONFIG = {"temperature": 0.2, "max_output_tokens": 1000}
 
-class DrugInfo(BaseModel):
-    brand_name: str
-    generic_name: Optional[str] = None
-    warnings: List[str] = []
-    contraindications: List[str] = []
-    adverse_reactions: List[str] = []
-    drug_interactions: List[str] = []
-    indications_and_usage: List[str] = []
 
+def _result_key(kind: str, generation_config: Dict, **inputs) -> str:
+    """Result cache key for an LLM analysis of canonicalized inputs."""
+    return result_cache.key(kind, llm.backend.name, GEMINI_MODEL, generation_config, inputs)
 
-class SymptomAnalysisRequest(BaseModel):
-    diagnosis: str
-    symptoms: List[str]
 
+def _parse_llm_json(text: str, kind: str, schema: Type[ModelT]) -> Dict:
+    """Parse an LLM response and validate it against schema; failures are counted by kind.
 
-class EmailRequest(BaseModel):
-    to: str
-    subject: str
-    message: str
+    Returns the validated result as a dict without unset optional fields, the
+    form kept in the result cache. Raises ValueError on failure.
+    """
+    with span("parse"):
+        try:
+            return parse_llm_output(text, schema).model_dump(exclude_none=True)
+        except ValueError:
+            count_parse_failure(kind)
+            raise
 
 
-def _extract_json(content: str) -> str:
-    """Extract JSON from a string that may contain markdown code blocks."""
-    if "```json" in content and "```" in content.split("```json", 1)[1]:
-        return content.split("```json", 1)[1].split("```", 1)[0].strip()
-    if "```" in content and "```" in content.split("```", 1)[1]:
-        return content.split("```", 1)[1].split("```", 1)[0].strip()
-    return content
+async def analyze_with_gemini(
+    drug_infos: List[DrugInfo], prompt: str, cache_key: Optional[str] = None, counters: Optional[Dict[str, int]] = None,
+) -> Dict:
+    """Use Gemini API to analyze drug interactions and conflicts.
 
+    counters, if given, gets "cache_hits" or "llm_calls" incremented.
+    """
+    if cache_key:
+        cached = result_cache.get(cache_key, allow_expired=llm.unavailable)
+        if cached is not None:
+            if counters is not None:
+                counters["cache_hits"] += 1
+            return cached
 
-async def analyze_with_gemini(drug_infos: List[DrugInfo], prompt: str) -> Dict:
-    """Use Gemini API to analyze drug interactions and conflicts."""
     try:
-        model = genai.GenerativeModel(
-            model_name="gemini-1.5-pro",
-            generation_config={"temperature": 0.1, "max_output_tokens": 1000},
-        )
-        response = model.generate_content(prompt)
-        if not response:
+        if counters is not None:
+            counters["llm_calls"] += 1
+        text = await llm.generate(prompt, **ANALYSIS_GENERATION_CONFIG)
+        if not text:
             return {"error": "Empty response from Gemini API"}
 
-        content = _extract_json(response.text)
         try:
-            return json.loads(content)
-        except json.JSONDecodeError:
-            return {"analysis": response.text}
+            result = _parse_llm_json(text, "analyze-drugs", AdvancedAnalysisOutput)
+        except ValueError:
+            return {"analysis": text}
+        if cache_key and _labels_complete(drug_infos):
+            result_cache.set(cache_key, result)
+        return result
 
     except Exception as e:
         return {"error": f"Error using Gemini API: {str(e)}"}
 
 
-async def generate_differential_diagnosis(symptoms: List[str], diagnosis: str) -> Dict:
-    """Use Gemini API to generate differential diagnoses based on symptoms."""
-    prompt = f"""
+def _differential_prompt(symptoms: List[str], diagnosis: str) -> str:
+    return f"""
     Based on the following symptoms: {', '.join(symptoms)}
 
     The current diagnosis is: {diagnosis}
@@ -130,130 +148,144 @@ async def generate_differential_diagnosis(symptoms: List[str], diagnosis: str) -
     IMPORTANT: Return ONLY the JSON object without any explanations, markdown formatting, or additional text.
     """
 
+
+def _differential_cache_key(symptoms: List[str], diagnosis: str) -> str:
+    return _result_key(
+        "differential-diagnosis", DIFFERENTIAL_GENERATION_CONFIG,
+        diagnosis=canonical_text(diagnosis), symptoms=canonical_set(symptoms),
+    )
+
+
+def _parse_differential(text: Optional[str], cache_key: Optional[str]) -> Dict:
+    if not text:
+        return {"error": "Empty response from Gemini API"}
+
     try:
-        model = genai.GenerativeModel(
-            model_name="gemini-1.5-pro",
-            generation_config={"temperature": 0.2, "max_output_tokens": 1000},
-        )
-        response = model.generate_content(prompt)
-        if not response:
-            return {"error": "Empty response from Gemini API"}
+        result = _parse_llm_json(text, "differential", DifferentialDiagnosisOutput)
+    except ValueError:
+        return {"error": "Could not parse differential diagnosis JSON", "raw_content": text}
+    if cache_key:
+        result_cache.set(cache_key, result)
+    return result
 
-        content = _extract_json(response.text)
-        try:
-            return json.loads(content)
-        except json.JSONDecodeError:
-            return {"error": "Could not parse differential diagnosis JSON", "raw_content": response.text}
 
+async def generate_differential_diagnosis(symptoms: List[str], diagnosis: str, use_cache: bool = True) -> Dict:
+    """Use Gemini API to generate differential diagnoses based on symptoms."""
+    cache_key = _differential_cache_key(symptoms, diagnosis) if use_cache else None
+    if cache_key:
+        cached = result_cache.get(cache_key, allow_expired=llm.unavailable)
+        if cached is not None:
+            return cached
+
+    try:
+        text = await llm.generate(_differential_prompt(symptoms, diagnosis), **DIFFERENTIAL_GENERATION_CONFIG)
+        return _parse_differential(text, cache_key)
     except Exception as e:
         return {"error": f"Error generating differential diagnosis: {str(e)}"}
 
 
-def _fda_params(extra: dict) -> dict:
-    params = dict(extra)
-    if FDA_API_KEY:
-        params["api_key"] = FDA_API_KEY
-    return params
+def _drug_info_from_label(medication: str, label: Optional[Dict]) -> DrugInfo:
+    if not label:
+        return DrugInfo(
+            brand_name=medication,
+            warnings=["No FDA data available for this medication"],
+        )
+    return DrugInfo.from_label(medication, label)
+
 
+def _drug_info_from_error(medication: str, error: Exception) -> DrugInfo:
+    if isinstance(error, httpx.HTTPStatusError):
+        message = f"HTTP error retrieving information: {error.response.status_code}"
+    else:
+        message = f"Error retrieving information: {str(error)}"
+    return DrugInfo.lookup_error(medication, message)
+
+
+def _labels_complete(drug_infos: List[DrugInfo]) -> bool:
+    """False if a label lookup failed; an analysis of the error placeholders must not be cached,
+    since the cache key covers only the request and not the labels the prompt was built from."""
+    return not any(info.lookup_failed for info in drug_infos)
 
-@app.get("/")
-async def read_root():
-    return {"message": "Welcome to Healthcare Drug Interaction Analyzer API"}
 
+def _drug_info_from_outcome(medication: str, label: Optional[Dict], error: Optional[Exception]) -> DrugInfo:
+    if error is not None:
+        return _drug_info_from_error(medication, error)
+    return _drug_info_from_label(medication, label)
 
-@app.post("/api/analyze-drugs")
-async def analyze_drugs(request: DrugAnalysisRequest):
-    drug_infos: List[DrugInfo] = []
-    basic_conflicts = []
 
-    async with httpx.AsyncClient() as client:
-        for medication in request.medications:
+async def _lookup_labels(
+    medications: List[str], on_fetch: Optional[Callable[[], None]] = None,
+) -> AsyncIterator[Tuple[str, Optional[Dict], Optional[Exception]]]:
+    """Look up FDA labels concurrently, yielding (name key, label, error) as each completes.
+
+    Case and whitespace variants of the same name are fetched once. on_fetch is
+    called for each lookup that goes to openFDA (see fetch_label).
+    """
+    unique: Dict[str, str] = {}
+    for medication in medications:
+        unique.setdefault(normalize_drug_name(medication), medication)
+
+    semaphore = asyncio.Semaphore(LABEL_FETCH_CONCURRENCY)
+
+    async def lookup(key: str, medication: str):
+        async with semaphore:
             try:
-                response = await client.get(
-                    "https://api.fda.gov/drug/label.json",
-                    params=_fda_params({"search": f'openfda.brand_name:"{medication}"'}),
-                )
-                response.raise_for_status()
-                data = response.json()
-
-                if data.get("results"):
-                    drug_info = data["results"][0]
-                    openfda = drug_info.get("openfda", {})
-                    generic_name = openfda["generic_name"][0] if openfda.get("generic_name") else None
-                    drug_infos.append(DrugInfo(
-                        brand_name=medication,
-                        generic_name=generic_name,
-                        warnings=drug_info.get("warnings", []),
-                        contraindications=drug_info.get("contraindications", []),
-                        adverse_reactions=drug_info.get("adverse_reactions", []),
-                        drug_interactions=drug_info.get("drug_interactions", []),
-                        indications_and_usage=drug_info.get("indications_and_usage", []),
-                    ))
-                else:
-                    drug_infos.append(DrugInfo(
-                        brand_name=medication,
-                        warnings=["No FDA data available for this medication"],
-                    ))
-            except httpx.HTTPStatusError as e:
-                drug_infos.append(DrugInfo(
-                    brand_name=medication,
-                    warnings=[f"HTTP error retrieving information: {e.response.status_code}"],
-                ))
+                return key, await fetch_label(medication, on_fetch), None
             except Exception as e:
-                drug_infos.append(DrugInfo(
-                    brand_name=medication,
-                    warnings=[f"Error retrieving information: {str(e)}"],
-                ))
+                return key, None, e
 
-    # Basic conflict detection
+    tasks = [asyncio.ensure_future(lookup(key, medication)) for key, medication in unique.items()]
     try:
-        for i, drug1 in enumerate(drug_infos):
-            for drug2 in drug_infos[i + 1:]:
-                if drug1.generic_name and drug2.generic_name:
-                    for interaction in drug1.drug_interactions:
-                        if drug2.generic_name.lower() in interaction.lower():
-                            basic_conflicts.append({
-                                "drug1": drug1.brand_name, "drug2": drug2.brand_name,
-                                "type": "explicit_interaction", "details": [interaction],
-                            })
-                    for interaction in drug2.drug_interactions:
-                        if drug1.generic_name.lower() in interaction.lower():
-                            basic_conflicts.append({
-                                "drug1": drug1.brand_name, "drug2": drug2.brand_name,
-                                "type": "explicit_interaction", "details": [interaction],
-                            })
-
-                common_contra = set(drug1.contraindications) & set(drug2.contraindications)
-                if common_contra:
-                    basic_conflicts.append({
-                        "drug1": drug1.brand_name, "drug2": drug2.brand_name,
-                        "type": "contraindication", "details": list(common_contra),
-                    })
-
-                common_warn = set(drug1.warnings) & set(drug2.warnings)
-                if common_warn:
-                    basic_conflicts.append({
-                        "drug1": drug1.brand_name, "drug2": drug2.brand_name,
-                        "type": "warning", "details": list(common_warn),
-                    })
+        for next_done in asyncio.as_completed(tasks):
+            yield await next_done
+    finally:
+        for task in tasks:
+            task.cancel()
+
+
+async def _iter_drug_infos(medications: List[str]) -> AsyncIterator[Tuple[int, DrugInfo]]:
+    """Yield (position in medications, DrugInfo) as each FDA label arrives."""
+    positions: Dict[str, List[int]] = {}
+    for i, medication in enumerate(medications):
+        positions.setdefault(normalize_drug_name(medication), []).append(i)
+
+    async for key, label, error in _lookup_labels(medications):
+        for i in positions[key]:
+            yield i, _drug_info_from_outcome(medications[i], label, error)
+
+
+async def _fetch_drug_infos(medications: List[str]) -> List[DrugInfo]:
+    """All DrugInfos for medications, in input order."""
+    drug_infos: List[Optional[DrugInfo]] = [None] * len(medications)
+    with span("labels"):
+        async for i, drug_info in _iter_drug_infos(medications):
+            drug_infos[i] = drug_info
+    return drug_infos
+
+
+def _find_basic_conflicts(drug_infos: List[DrugInfo]) -> List[Dict]:
+    """Basic conflict detection from FDA label text."""
+    try:
+        with span("conflicts"):
+            return find_basic_conflicts(drug_infos)
     except Exception as e:
-        print(f"Error during basic conflict analysis: {e}")
+        logger.exception("Error during basic conflict analysis: %s", e)
+        return []
 
-    drug_data = [
-        {
-            "brand_name": d.brand_name, "generic_name": d.generic_name,
-            "warnings": d.warnings, "contraindications": d.contraindications,
-            "adverse_reactions": d.adverse_reactions, "drug_interactions": d.drug_interactions,
-        }
-        for d in drug_infos
-    ]
 
-    prompt = f"""
+def _label_excerpts(request: DrugAnalysisRequest, drug_infos: List[DrugInfo]) -> str:
+    with span("prompt"):
+        return prompt_builder.label_excerpts(drug_infos, context_terms(request.diagnosis, *request.symptoms))
+
+
+def _drug_analysis_prompt(request: DrugAnalysisRequest, drug_infos: List[DrugInfo]) -> str:
+    return f"""
     Analyze these medications for interactions, diagnosis contradictions, and warnings.
 
     Diagnosis: {request.diagnosis}
     Symptoms: {', '.join(request.symptoms)}
-    Drug data: {json.dumps(drug_data, indent=2)}
+    FDA label excerpts ({SECTION_LEGEND}):
+{_label_excerpts(request, drug_infos)}
 
     Return ONLY a JSON object:
     {{
@@ -263,8 +295,25 @@ async def analyze_drugs(request: DrugAnalysisRequest):
     }}
     """
 
+
+def _analysis_cache_key(request: DrugAnalysisRequest) -> str:
+    return _result_key(
+        "analyze-drugs", ANALYSIS_GENERATION_CONFIG,
+        medications=canonical_set(request.medications),
+        diagnosis=canonical_text(request.diagnosis),
+        symptoms=canonical_set(request.symptoms),
+    )
+
+
+async def _advanced_analysis(
+    request: DrugAnalysisRequest, drug_infos: List[DrugInfo], no_cache: bool, counters: Optional[Dict[str, int]] = None,
+) -> Dict:
+    if not llm.enabled:
+        return {"error": LLM_DISABLED_MESSAGE, **{key: [] for key in _ADVANCED_ANALYSIS_KEYS}}
+    prompt = _drug_analysis_prompt(request, drug_infos)
     try:
-        advanced_analysis = await analyze_with_gemini(drug_infos, prompt)
+        cache_key = None if no_cache else _analysis_cache_key(request)
+        advanced_analysis = await analyze_with_gemini(drug_infos, prompt, cache_key, counters)
     except Exception as e:
         advanced_analysis = {
             "error": str(e),
@@ -272,77 +321,403 @@ async def analyze_drugs(request: DrugAnalysisRequest):
             "diagnosis_contradictions": [],
             "additional_warnings": [],
         }
+    return advanced_analysis
+
+
+_ADVANCED_ANALYSIS_KEYS = ("advanced_conflicts", "diagnosis_contradictions", "additional_warnings")
+
+
+@dataclass
+class _BatchEntry:
+    index: int
+    item: BatchDrugAnalysisItem
+    drug_infos: List[DrugInfo]
+    basic_conflicts: List[Dict]
+    cache_key: Optional[str]
+    fields: Optional[Set[str]] = None
+
+    def result(self, advanced_analysis: Dict) -> bytes:
+        return _ndjson("result", index=self.index, id=self.item.id, data={
+            "drug_infos": [drug.model_dump(include=self.fields) for drug in self.drug_infos],
+            "basic_conflicts": self.basic_conflicts,
+            "advanced_analysis": advanced_analysis,
+        })
+
+
+def _batch_analysis_prompt(group: List[_BatchEntry]) -> str:
+    patients = "\n\n".join(
+        f"Patient {entry.index}\nDiagnosis: {entry.item.diagnosis}\n"
+        f"Symptoms: {', '.join(entry.item.symptoms)}\n{_label_excerpts(entry.item, entry.drug_infos)}"
+        for entry in group
+    )
+
+    return f"""
+    Analyze the medications of each patient below, independently, for interactions,
+    diagnosis contradictions, and warnings. FDA label excerpts use {SECTION_LEGEND}.
+
+    Patient ids: {', '.join(str(entry.index) for entry in group)}
+
+{patients}
+
+    Return ONLY a JSON object with one entry per patient id:
+    {{
+        "patients": [{{
+            "patient": "<patient id>",
+            "advanced_conflicts": [{{"drugs": ["Drug1","Drug2"],"type":"...","severity":"high/medium/low","description":"..."}}],
+            "diagnosis_contradictions": [{{"drug":"...","contradiction":"..."}}],
+            "additional_warnings": [{{"warning":"...","drugs":["Drug1"]}}]
+        }}]
+    }}
+    """
+
+
+async def _analyze_batch_group(
+    group: List[_BatchEntry], no_cache: bool, counters: Dict[str, int], slots: asyncio.Semaphore,
+) -> List[bytes]:
+    """One LLM call for a group of patients; patients missing from the answer are retried alone.
+
+    Every LLM call holds one of the batch's slots.
+    """
+    by_patient: Dict[str, Dict] = {}
+    if len(group) > 1 and llm.enabled:
+        try:
+            async with slots:
+                counters["llm_calls"] += 1
+                text = await llm.generate(
+                    _batch_analysis_prompt(group),
+                    temperature=ANALYSIS_GENERATION_CONFIG["temperature"],
+                    max_output_tokens=min(ANALYSIS_GENERATION_CONFIG["max_output_tokens"] * len(group), 8192),
+                )
+            parsed = _parse_llm_json(text, "analyze-drugs-batch", BatchAnalysis) if text else {}
+            for patient in parsed.get("patients", []):
+                by_patient[str(patient["patient"])] = patient
+        except Exception:
+            by_patient = {}
+
+    async def analyze(entry: _BatchEntry) -> bytes:
+        patient = by_patient.get(str(entry.index))
+        if patient is None:
+            async with slots:
+                return entry.result(await _advanced_analysis(entry.item, entry.drug_infos, no_cache, counters))
+        advanced_analysis = {key: patient.get(key, []) for key in _ADVANCED_ANALYSIS_KEYS}
+        if entry.cache_key and _labels_complete(entry.drug_infos):
+            result_cache.set(entry.cache_key, advanced_analysis)
+        return entry.result(advanced_analysis)
+
+    return await asyncio.gather(*(analyze(entry) for entry in group))
+
+
+async def _run_batch(
+    items: List[BatchDrugAnalysisItem], group_size: int, no_cache: bool, fields: Optional[Set[str]] = None,
+) -> AsyncIterator[bytes]:
+    started = time.perf_counter()
+    counters = {"labels_fetched": 0, "cache_hits": 0, "llm_calls": 0, "errors": 0}
+
+    def count_fetch() -> None:
+        counters["labels_fetched"] += 1
+
+    # Every distinct drug label is looked up once for the whole batch
+    outcomes: Dict[str, Tuple[Optional[Dict], Optional[Exception]]] = {}
+    with span("labels"):
+        async for key, label, error in _lookup_labels([m for item in items for m in item.medications], count_fetch):
+            outcomes[key] = (label, error)
+
+    pending: List[_BatchEntry] = []
+    for index, item in enumerate(items):
+        try:
+            drug_infos = [
+                _drug_info_from_outcome(m, *outcomes[normalize_drug_name(m)]) for m in item.medications
+            ]
+            entry = _BatchEntry(
+                index, item, drug_infos, _find_basic_conflicts(drug_infos),
+                None if no_cache else _analysis_cache_key(item), fields,
+            )
+        except Exception as e:
+            counters["errors"] += 1
+            yield _ndjson("error", index=index, id=item.id, error=str(e))
+            continue
+        cached = result_cache.get(entry.cache_key, allow_expired=llm.unavailable) if entry.cache_key else None
+        if cached is not None:
+            counters["cache_hits"] += 1
+            yield entry.result(cached)
+        else:
+            pending.append(entry)
+        if index % 100 == 99:
+            # Let other requests run between chunks of conflict detection
+            await asyncio.sleep(0)
+
+    groups = [pending[k:k + group_size] for k in range(0, len(pending), group_size)]
+    slots = asyncio.Semaphore(BATCH_LLM_CONCURRENCY)
+    tasks = [asyncio.ensure_future(_analyze_batch_group(group, no_cache, counters, slots)) for group in groups]
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            for line in await next_done:
+                yield line
+    finally:
+        for task in tasks:
+            task.cancel()
+
+    counters["items"] = len(items)
+    counters["seconds"] = round(time.perf_counter() - started, 3)
+    yield _ndjson("done", summary=counters, server_timing=current_server_timing())
+
+
+def _ndjson(event: str, **fields) -> bytes:
+    if orjson is not None:
+        return orjson.dumps({"event": event, **fields}) + b"\n"
+    return (json.dumps({"event": event, **fields}) + "\n").encode()
 
+
+def _model_response(model: BaseModel, include=None) -> Response:
+    """Serialize an already validated model in one pass.
+
+    Returning a Response skips FastAPI's second validation of the response
+    model, which is costly for label sections tens of kilobytes long.
+    """
+    return FastJSONResponse(model.model_dump(include=include))
+
+
+def _fields(fields: Optional[str], model: Type[BaseModel]) -> Optional[Set[str]]:
+    """Fields requested with ?fields= (brand_name is always included), or None for all."""
+    try:
+        return selected_fields(fields, model, always={"brand_name"})
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+
+
+def _ndjson_response(events: AsyncIterator[bytes]) -> StreamingResponse:
+    # Disable proxy buffering so each event reaches the client as soon as it is sent
+    return StreamingResponse(
+        events,
+        media_type="application/x-ndjson",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@router.get("/", response_model=MessageResponse)
+async def read_root():
+    return {"message": "Welcome to Healthcare Drug Interaction Analyzer API"}
+
+
+@router.get("/api/stats", response_model=StatsResponse)
+async def get_stats():
+    """Runtime statistics for capacity planning."""
     return {
-        "drug_infos": [drug.dict() for drug in drug_infos],
-        "basic_conflicts": basic_conflicts,
-        "advanced_analysis": advanced_analysis,
+        "upstream_pools": clients.stats(),
+        "label_cache": label_cache.stats(),
+        "label_text": label_text.stats(),
+        "label_store": label_store.stats(),
+        "llm": llm.stats(),
+        "result_cache": result_cache.stats(),
+        "prompts": prompt_builder.stats(),
+        "adverse_events": adverse_event_store.stats(),
+        "email_outbox": await outbox.stats(),
+        "startup": STARTUP,
     }
 
 
-@app.post("/api/analyze-symptoms")
-async def analyze_symptoms(request: SymptomAnalysisRequest):
+def _gauges() -> List[str]:
+    pools = clients.stats()
+    limiters = [({"upstream": name}, pool["limiter"]) for name, pool in pools.items() if "limiter" in pool]
+    limiters.append(({"upstream": llm.backend.name}, llm.limiter.stats()))
+    breakers = [({"upstream": name}, pool["breaker"]) for name, pool in pools.items() if "breaker" in pool]
+    breakers.append(({"upstream": llm.backend.name}, llm.breaker.stats()))
+    return (
+        metrics.gauge_lines("medsafe_llm_in_flight", "LLM calls in progress.", [({}, llm.in_flight)])
+        + metrics.gauge_lines("medsafe_llm_waiting", "LLM calls waiting for a slot.", [({}, llm.waiting)])
+        + metrics.gauge_lines(
+            "medsafe_upstream_in_flight", "Upstream HTTP requests in progress.",
+            [({"upstream": name}, pool.get("in_flight", 0)) for name, pool in pools.items()],
+        )
+        + metrics.gauge_lines(
+            "medsafe_upstream_limiter_waiting", "Upstream calls waiting for a rate limiter token.",
+            [(labels, limiter["waiting"]) for labels, limiter in limiters],
+        )
+        + metrics.gauge_lines(
+            "medsafe_upstream_circuit_state", "Upstream circuit breaker state (0 closed, 1 half-open, 2 open).",
+            [(labels, STATE_VALUES[breaker["state"]]) for labels, breaker in breakers],
+        )
+    )
+
+
+metrics.add_collector(_gauges)
+
+
+@router.get("/metrics", include_in_schema=False)
+async def get_metrics():
+    """Prometheus metrics (stage and upstream latency histograms, parse failures)."""
+    if not METRICS_ENABLED:
+        raise HTTPException(status_code=404, detail="Metrics are disabled")
+    return PlainTextResponse(metrics.render(), media_type=metrics.CONTENT_TYPE)
+
+
+@router.post("/api/analyze-drugs", response_model=DrugAnalysisResponse)
+async def analyze_drugs(request: DrugAnalysisRequest, no_cache: bool = False, fields: Optional[str] = None):
+    """Interaction analysis of a medication list.
+
+    fields (comma-separated DrugInfo fields, e.g. "generic_name,warnings") limits
+    the label sections returned in drug_infos.
+    """
+    include = _fields(fields, DrugInfo)
+    drug_infos = await _fetch_drug_infos(request.medications)
+    basic_conflicts = _find_basic_conflicts(drug_infos)
+    advanced_analysis = await _advanced_analysis(request, drug_infos, no_cache)
+
+    response = DrugAnalysisResponse(
+        drug_infos=drug_infos, basic_conflicts=basic_conflicts, advanced_analysis=advanced_analysis,
+    )
+    return _model_response(response, {"drug_infos": {"__all__": include}, "basic_conflicts": True,
+                                      "advanced_analysis": True} if include else None)
+
+
+@router.post("/api/analyze-symptoms", response_model=DifferentialDiagnosis, response_model_exclude_none=True)
+async def analyze_symptoms(request: SymptomAnalysisRequest, no_cache: bool = False):
     """Analyze symptoms and provide differential diagnoses."""
+    if not llm.enabled:
+        raise HTTPException(status_code=503, detail=LLM_DISABLED_MESSAGE)
     try:
-        return await generate_differential_diagnosis(request.symptoms, request.diagnosis)
+        return await generate_differential_diagnosis(request.symptoms, request.diagnosis, use_cache=not no_cache)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error analyzing symptoms: {str(e)}")
 
 
-@app.get("/api/drug-info/{drug_name}")
-async def get_drug_info(drug_name: str):
+@router.post("/api/analyze-drugs/stream")
+async def analyze_drugs_stream(request: DrugAnalysisRequest, no_cache: bool = False, fields: Optional[str] = None):
+    """Streaming /api/analyze-drugs: NDJSON events as each stage completes.
+
+    Emits one "drug_info" event per medication as its label arrives (with its
+    index in the request), then "basic_conflicts", then "advanced_analysis",
+    then "done". fields works as for /api/analyze-drugs.
+    """
+    include = _fields(fields, DrugInfo)
+
+    async def events():
+        drug_infos: List[Optional[DrugInfo]] = [None] * len(request.medications)
+        with span("labels"):
+            async for i, drug_info in _iter_drug_infos(request.medications):
+                drug_infos[i] = drug_info
+                yield _ndjson("drug_info", index=i, data=drug_info.model_dump(include=include))
+        yield _ndjson("basic_conflicts", data=_find_basic_conflicts(drug_infos))
+        yield _ndjson("advanced_analysis", data=await _advanced_analysis(request, drug_infos, no_cache))
+        yield _ndjson("done", server_timing=current_server_timing())
+
+    return _ndjson_response(events())
+
+
+@router.post("/api/analyze-drugs/batch")
+async def analyze_drugs_batch(request: BatchDrugAnalysisRequest, no_cache: bool = False, fields: Optional[str] = None):
+    """Analyze many patients' medication lists in one call (NDJSON).
+
+    Each distinct drug label is fetched once for the whole batch, and Gemini
+    analyses are grouped several patients per call. Emits a "result" event per
+    patient (with its index in items and optional id) as it completes, an
+    "error" event for items that could not be processed, then "done" with a
+    summary. fields works as for /api/analyze-drugs.
+    """
+    include = _fields(fields, DrugInfo)
+    if len(request.items) > BATCH_MAX_ITEMS:
+        raise HTTPException(status_code=413, detail=f"Batch too large: at most {BATCH_MAX_ITEMS} items")
+    group_size = max(1, min(request.group_size or BATCH_LLM_GROUP_SIZE, BATCH_MAX_LLM_GROUP_SIZE))
+    return _ndjson_response(_run_batch(request.items, group_size, no_cache, include))
+
+
+@router.post("/api/analyze-symptoms/stream")
+async def analyze_symptoms_stream(request: SymptomAnalysisRequest, no_cache: bool = False):
+    """Streaming /api/analyze-symptoms: NDJSON "chunk" events with raw model text
+    as it is generated, then a "result" event with the parsed analysis, then "done".
+    """
+    async def events():
+        cache_key = None if no_cache else _differential_cache_key(request.symptoms, request.diagnosis)
+        result = result_cache.get(cache_key, allow_expired=llm.unavailable) if cache_key else None
+        if result is None:
+            chunks = []
+            try:
+                prompt = _differential_prompt(request.symptoms, request.diagnosis)
+                async for chunk in llm.stream(prompt, **DIFFERENTIAL_GENERATION_CONFIG):
+                    chunks.append(chunk)
+                    yield _ndjson("chunk", text=chunk)
+                result = _parse_differential("".join(chunks), cache_key)
+            except Exception as e:
+                result = {"error": f"Error generating differential diagnosis: {str(e)}"}
+        yield _ndjson("result", data=result)
+        yield _ndjson("done", server_timing=current_server_timing())
+
+    return _ndjson_response(events())
+
+
+def _first(values: Optional[List[str]]) -> Optional[str]:
+    return values[0] if values else None
+
+
+@router.get("/api/drug-info/{drug_name}", response_model=DrugDetail)
+async def get_drug_info(drug_name: str, no_cache: bool = False, fields: Optional[str] = None):
+    """FDA label details and an AI summary (enhanced_info) for one drug.
+
+    fields (comma-separated, e.g. "generic_name,warnings,enhanced_info") limits
+    the sections returned; the AI summary is only generated if requested.
+    """
+    include = _fields(fields, DrugDetail)
     try:
-        async with httpx.AsyncClient() as client:
-            response = await client.get(
-                "https://api.fda.gov/drug/label.json",
-                params=_fda_params({"search": f'openfda.brand_name:"{drug_name}"'}),
-            )
-            response.raise_for_status()
-            data = response.json()
-
-            if not data.get("results"):
-                raise HTTPException(status_code=404, detail=f"Drug not found: {drug_name}")
-
-            drug_info = data["results"][0]
-            openfda = drug_info.get("openfda", {})
-
-            result = {
-                "brand_name": drug_name,
-                "generic_name": openfda.get("generic_name", [""])[0] if openfda.get("generic_name") else None,
-                "manufacturer": openfda.get("manufacturer_name", [""])[0] if openfda.get("manufacturer_name") else None,
-                "product_type": openfda.get("product_type", [""])[0] if openfda.get("product_type") else None,
-                "route": openfda.get("route", [""])[0] if openfda.get("route") else None,
-                "warnings": drug_info.get("warnings", []),
-                "contraindications": drug_info.get("contraindications", []),
-                "adverse_reactions": drug_info.get("adverse_reactions", []),
-                "drug_interactions": drug_info.get("drug_interactions", []),
-                "boxed_warnings": drug_info.get("boxed_warning", []),
-                "indications_and_usage": drug_info.get("indications_and_usage", []),
-                "dosage_and_administration": drug_info.get("dosage_and_administration", []),
-            }
-
-            prompt = f"""
-            Provide enhanced patient-friendly information about {drug_name}.
-            Generic: {result.get('generic_name')}
-            Warnings: {result.get('warnings')}
-            Contraindications: {result.get('contraindications')}
-
-            Return ONLY this JSON:
-            {{"summary":"...","key_warnings_explanation":"...","special_considerations":"..."}}
-            """
-
-            model = genai.GenerativeModel(
-                model_name="gemini-1.5-pro",
-                generation_config={"temperature": 0.1, "max_output_tokens": 1000},
+        with span("labels"):
+            drug_info = await fetch_label(drug_name)
+        if not drug_info:
+            raise HTTPException(status_code=404, detail=f"Drug not found: {drug_name}")
+
+        openfda = drug_info.get("openfda", {})
+
+        result = DrugDetail(
+            brand_name=drug_name,
+            generic_name=_first(openfda.get("generic_name")),
+            manufacturer=_first(openfda.get("manufacturer_name")),
+            product_type=_first(openfda.get("product_type")),
+            route=_first(openfda.get("route")),
+            warnings=drug_info.get("warnings", []),
+            contraindications=drug_info.get("contraindications", []),
+            adverse_reactions=drug_info.get("adverse_reactions", []),
+            drug_interactions=drug_info.get("drug_interactions", []),
+            boxed_warnings=drug_info.get("boxed_warning", []),
+            indications_and_usage=drug_info.get("indications_and_usage", []),
+            dosage_and_administration=drug_info.get("dosage_and_administration", []),
+        )
+        if not llm.enabled or (include is not None and "enhanced_info" not in include):
+            # FDA-only mode, or the client did not ask for the AI summary
+            return _model_response(result, include)
+
+        with span("prompt"):
+            excerpts = prompt_builder.label_excerpts(
+                [_drug_info_from_label(drug_name, drug_info)], sections=("warnings", "contraindications")
             )
-            ai_response = model.generate_content(prompt)
-            if ai_response:
+        prompt = f"""
+        Provide enhanced patient-friendly information about {drug_name}.
+        FDA label excerpts ({SECTION_LEGEND}):
+{excerpts}
+
+        Return ONLY this JSON:
+        {{"summary":"...","key_warnings_explanation":"...","special_considerations":"..."}}
+        """
+
+        cache_key = None if no_cache else _result_key(
+            "drug-info", ANALYSIS_GENERATION_CONFIG, drug=canonical_text(drug_name)
+        )
+        enhanced_info = result_cache.get(cache_key, allow_expired=llm.unavailable) if cache_key else None
+        if enhanced_info is None:
+            try:
+                ai_text = await llm.generate(prompt, **ANALYSIS_GENERATION_CONFIG)
+            except Exception as e:
+                # Open breaker, timeout or API error: the label is still worth returning
+                logger.warning("AI summary for %r failed: %s", drug_name, e)
+                ai_text = None
+            if ai_text:
                 try:
-                    result["enhanced_info"] = json.loads(_extract_json(ai_response.text))
-                except json.JSONDecodeError:
-                    result["enhanced_info"] = {"summary": ai_response.text}
+                    enhanced_info = _parse_llm_json(ai_text, "drug-info", EnhancedInfo)
+                    if cache_key:
+                        result_cache.set(cache_key, enhanced_info)
+                except ValueError:
+                    enhanced_info = {"summary": ai_text}
+        if enhanced_info is not None:
+            result.enhanced_info = EnhancedInfo(**enhanced_info)
 
-            return result
+        return _model_response(result, include)
 
     except HTTPException:
         raise
@@ -350,93 +725,169 @@ async def get_drug_info(drug_name: str):
         raise HTTPException(status_code=500, detail=f"Error fetching drug info: {str(e)}")
 
 
-@app.get("/api/search-drugs")
+@router.get("/api/search-drugs", response_model=DrugSearchResponse)
 async def search_drugs(term: str, limit: int = 10):
-    try:
-        async with httpx.AsyncClient() as client:
-            response = await client.get(
-                "https://api.fda.gov/drug/label.json",
-                params=_fda_params({"search": f'openfda.brand_name:"{term}"~', "limit": min(limit, 50)}),
-            )
-            response.raise_for_status()
-            data = response.json()
-
-            results = []
-            for item in data.get("results", []):
-                openfda = item.get("openfda", {})
-                results.append({
-                    "brand_name": openfda.get("brand_name", [""])[0] if openfda.get("brand_name") else "",
-                    "generic_name": openfda.get("generic_name", [""])[0] if openfda.get("generic_name") else "",
-                    "manufacturer": openfda.get("manufacturer_name", [""])[0] if openfda.get("manufacturer_name") else "",
-                    "product_type": openfda.get("product_type", [""])[0] if openfda.get("product_type") else "",
-                })
+    if LABEL_SOURCE != "remote":
+        with span("search"):
+            results = await label_store.search(term, min(limit, 50))
+        if results or LABEL_SOURCE == "local":
             return {"results": results}
 
+    try:
+        response = await clients.fda.get(
+            "/drug/label.json",
+            params=fda_params({"search": f'openfda.brand_name:"{term}"~', "limit": min(limit, 50)}),
+        )
+        response.raise_for_status()
+        data = response.json()
+
+        results = []
+        for item in data.get("results", []):
+            openfda = item.get("openfda", {})
+            results.append({
+                "brand_name": openfda.get("brand_name", [""])[0] if openfda.get("brand_name") else "",
+                "generic_name": openfda.get("generic_name", [""])[0] if openfda.get("generic_name") else "",
+                "manufacturer": openfda.get("manufacturer_name", [""])[0] if openfda.get("manufacturer_name") else "",
+                "product_type": openfda.get("product_type", [""])[0] if openfda.get("product_type") else "",
+            })
+        return {"results": results}
+
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error searching drugs: {str(e)}")
 
 
-@app.get("/api/drug-adverse-events")
-async def get_drug_adverse_events(drug_name: str, limit: int = 10):
-    """Get adverse events reported for a specific drug."""
-    async with httpx.AsyncClient() as client:
-        try:
-            response = await client.get(
-                "https://api.fda.gov/drug/event.json",
-                params=_fda_params({
-                    "search": f'patient.drug.medicinalproduct:"{drug_name}"',
-                    "limit": min(limit, 50),
-                }),
-            )
-            response.raise_for_status()
-            data = response.json()
-
-            events = []
-            for report in data.get("results", []):
-                patient = report.get("patient", {})
-                reactions = patient.get("reaction", [])
-                events.append({
-                    "report_id": report.get("safetyreportid", "Unknown"),
-                    "report_date": report.get("receiptdate", "Unknown"),
-                    "reactions": [r.get("reactionmeddrapt", "Unknown") for r in reactions],
-                    "serious": report.get("serious", "Unknown"),
-                    "outcome": patient.get("patientoutcome", "Unknown"),
-                })
-            return {"events": events}
+@router.get("/api/drug-adverse-events", response_model=AdverseEventPage)
+async def get_drug_adverse_events(drug_name: str, limit: int = 10, skip: int = 0):
+    """Get adverse events reported for a specific drug, a page at a time.
 
-        except Exception as e:
-            raise HTTPException(status_code=500, detail=f"Error fetching adverse events: {str(e)}")
+    Pass the returned next_skip as skip to get the following page.
+    """
+    try:
+        return await fetch_reports(drug_name, skip, limit)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error fetching adverse events: {str(e)}")
+
+
+@router.get("/api/drug-adverse-events/summary", response_model=AdverseEventSummary)
+async def get_drug_adverse_event_summary(
+    drug_name: str, top: int = 20, bucket: str = "year", reports: int = 0, skip: int = 0, refresh: bool = False,
+):
+    """Aggregated adverse events for a drug: reaction frequencies, seriousness and
+    outcome breakdowns and reports per month or year.
+
+    Built from openFDA count queries and stored locally, so repeat queries make
+    no upstream calls. reports > 0 adds a page of raw reports starting at skip.
+    A drug without any reports is a 404.
+    """
+    if bucket not in BUCKETS:
+        raise HTTPException(status_code=422, detail=f"bucket must be one of: {', '.join(BUCKETS)}")
+    try:
+        with span("adverse_events"):
+            rollup, source = await adverse_event_store.get(drug_name, refresh=refresh)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error fetching adverse events: {str(e)}")
+    if rollup["total_reports"] == 0:
+        raise HTTPException(status_code=404, detail=f"No adverse event reports found for: {drug_name}")
+    try:
+        summary = summarize(rollup, max(1, top), bucket)
+        summary["source"] = source
+        if reports > 0:
+            summary["reports"] = await fetch_reports(drug_name, skip, reports)
+        return summary
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error fetching adverse events: {str(e)}")
 
 
-@app.post("/api/send-email")
+@router.post("/api/send-email", status_code=202, response_model=EmailQueued)
 async def send_email(request: EmailRequest):
-    """Send an email using the Resend API."""
+    """Queue an email for delivery through the Resend API.
+
+    Returns at once with the message id; poll /api/send-email/{id} for its status.
+    """
     if not RESEND_API_KEY:
         raise HTTPException(status_code=503, detail="Email service not configured")
 
     try:
-        async with httpx.AsyncClient() as client:
-            response = await client.post(
-                "https://api.resend.com/emails",
-                json={
-                    "from": "onboarding@resend.dev",
-                    "to": [request.to],
-                    "subject": request.subject,
-                    "text": request.message,
-                },
-                headers={
-                    "Authorization": f"Bearer {RESEND_API_KEY}",
-                    "Content-Type": "application/json",
-                },
-                timeout=10.0,
-            )
-            response_data = response.json()
-            if response.status_code == 200:
-                return {"success": True, "message": "Email sent successfully"}
-            return {
-                "success": False,
-                "message": f"Failed to send email: {response_data.get('message', 'Unknown error')}",
-            }
-
+        message_id = await outbox.enqueue(request.to, request.subject, request.message)
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error sending email: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Error queueing email: {str(e)}")
+    return {"success": True, "id": message_id, "status": "queued", "message": "Email queued for delivery"}
+
+
+@router.get("/api/send-email/{message_id}", response_model=EmailStatus)
+async def get_email_status(message_id: str):
+    """Delivery status of a queued email: queued, sent or failed."""
+    status = await outbox.status(message_id)
+    if status is None:
+        raise HTTPException(status_code=404, detail="Unknown email id")
+    return status
+
+
+# Optional warm-up before the worker reports ready: import the LLM SDK and build
+# its model handles, and fetch the labels of WARMUP_DRUGS into the label cache
+WARMUP_ON_STARTUP = env_bool("WARMUP_ON_STARTUP", False)
+WARMUP_DRUGS = [d.strip() for d in os.getenv("WARMUP_DRUGS", "").split(",") if d.strip()]
+
+# Seconds spent importing this module, starting the app and warming up
+STARTUP: Dict[str, Optional[float]] = {
+    "import_seconds": round(time.perf_counter() - _IMPORT_STARTED, 3),
+    "startup_seconds": None,
+    "warm_up_seconds": None,
+}
+
+
+async def warm_up() -> None:
+    await llm.warm_up([ANALYSIS_GENERATION_CONFIG, DIFFERENTIAL_GENERATION_CONFIG])
+    async for _, _, error in _lookup_labels(WARMUP_DRUGS):
+        if error is not None:
+            logger.warning("Warm-up label fetch failed: %s", error)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    started = time.perf_counter()
+    # One pooled client per upstream for the lifetime of the worker
+    clients.start()
+    await label_cache.open()
+    await adverse_event_store.open()
+    await outbox.open()
+    if RESEND_API_KEY:
+        outbox.start()
+    if LABEL_SOURCE != "remote":
+        await label_store.open()
+    if app.state.warm_up:
+        warm_up_started = time.perf_counter()
+        await warm_up()
+        STARTUP["warm_up_seconds"] = round(time.perf_counter() - warm_up_started, 3)
+    STARTUP["startup_seconds"] = round(time.perf_counter() - started, 3)
+    try:
+        yield
+    finally:
+        label_store.close()
+        await outbox.close()
+        await adverse_event_store.close()
+        await label_cache.close()
+        await clients.aclose()
+
+
+def create_app(warm_up_on_startup: Optional[bool] = None) -> FastAPI:
+    """Build the API app. Also usable as ``uvicorn --factory app.main:create_app``."""
+    app = FastAPI(
+        title="Healthcare Drug Interaction Analyzer", lifespan=lifespan, default_response_class=FastJSONResponse,
+    )
+    app.state.warm_up = WARMUP_ON_STARTUP if warm_up_on_startup is None else warm_up_on_startup
+    app.add_middleware(
+        CORSMiddleware,
+        allow_origins=ALLOWED_ORIGINS,
+        allow_credentials=True,
+        allow_methods=["GET", "POST"],
+        allow_headers=["Content-Type", "Authorization"],
+        expose_headers=["Server-Timing"],
+    )
+    if METRICS_ENABLED:
+        app.add_middleware(MetricsMiddleware)
+    app.include_router(router)
+    return app
+
+
+app = create_app()
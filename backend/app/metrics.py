@@ -0,0 +1,323 @@
+"""Per-stage latency instrumentation, Prometheus metrics and Server-Timing headers.
+
+Code on the hot path marks stages with ``span("name")`` and upstream calls with
+``observe_upstream``. Within a request these are collected on the request and,
+when it finishes, recorded in histograms labelled with the route it matched.
+``MetricsMiddleware`` adds a ``Server-Timing`` header listing the stages that
+completed before the response started, and ``render()`` produces the text for
+``GET /metrics``.
+
+With METRICS_ENABLED=false the middleware is not installed, ``span`` returns a
+shared no-op context manager and the observe/count functions return at once.
+"""
+import asyncio
+import bisect
+import time
+from contextlib import nullcontext
+from contextvars import ContextVar, copy_context
+from typing import Awaitable, Callable, Dict, List, Optional, Sequence, Tuple
+
+from app.config import env_bool
+
+METRICS_ENABLED = env_bool("METRICS_ENABLED", True)
+
+# Starlette appends "; charset=utf-8" to text/* types; a second charset makes Prometheus reject the scrape
+CONTENT_TYPE = "text/plain; version=0.0.4"
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# Endpoint label for work done outside any request (background cache refreshes)
+BACKGROUND = "background"
+
+_NOOP = nullcontext()
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Counter:
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, *labels: str, amount: float = 1.0) -> None:
+        self._values[labels] = self._values.get(labels, 0.0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        for labels, value in sorted(self._values.items()):
+            lines.append(f"{self.name}{_labels(self.labelnames, labels)} {value:g}")
+        return lines
+
+
+class Histogram:
+    def __init__(
+        self, name: str, help: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS
+    ):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        # Per label set: count per bucket (last one is +Inf), then sum
+        self._series: Dict[Tuple[str, ...], List[float]] = {}
+
+    def observe(self, value: float, *labels: str) -> None:
+        series = self._series.get(labels)
+        if series is None:
+            series = self._series[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+        series[bisect.bisect_left(self.buckets, value)] += 1
+        series[-1] += value
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for labels, series in sorted(self._series.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), series):
+                cumulative += count
+                le = 'le="+Inf"' if bound == float("inf") else f'le="{bound:g}"'
+                lines.append(f"{self.name}_bucket{_labels(self.labelnames, labels, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, labels)} {series[-1]:.6f}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, labels)} {cumulative}")
+        return lines
+
+
+http_request_seconds = Histogram(
+    "medsafe_http_request_seconds", "Time to handle a request, including streamed bodies.",
+    ("endpoint", "method", "status"),
+)
+stage_seconds = Histogram(
+    "medsafe_stage_seconds", "Time spent in each processing stage.", ("endpoint", "stage"),
+)
+upstream_seconds = Histogram(
+    "medsafe_upstream_request_seconds", "Latency of calls to upstream APIs, by result status.",
+    ("endpoint", "upstream", "target", "status"),
+)
+llm_parse_failures = Counter(
+    "medsafe_llm_json_parse_failures_total", "LLM responses that were not valid JSON of the expected shape.",
+    ("endpoint", "kind"),
+)
+upstream_retries = Counter(
+    "medsafe_upstream_retries_total", "Upstream calls retried, by the status or error that caused the retry.",
+    ("upstream", "reason"),
+)
+upstream_rejections = Counter(
+    "medsafe_upstream_rejections_total",
+    "Upstream calls not made because the circuit was open or the rate limit queue was too deep.",
+    ("upstream", "reason"),
+)
+_REGISTRY = [
+    http_request_seconds, stage_seconds, upstream_seconds, llm_parse_failures, upstream_retries, upstream_rejections,
+]
+
+# Extra "name value" lines rendered at scrape time (gauges read from other modules)
+_collectors: List[Callable[[], List[str]]] = []
+
+
+class _RequestTimings:
+    """Stages and upstream calls of the current request, with the perf_counter() time each ended."""
+
+    __slots__ = ("spans", "upstream", "parse_failures")
+
+    def __init__(self):
+        self.spans: List[Tuple[str, float, float]] = []
+        self.upstream: List[Tuple[str, str, str, float, float]] = []
+        self.parse_failures: List[str] = []
+
+
+_current: ContextVar[Optional[_RequestTimings]] = ContextVar("medsafe_request_timings", default=None)
+
+
+class _Span:
+    __slots__ = ("name", "started")
+
+    def __init__(self, name: str):
+        self.name = name
+
+    def __enter__(self) -> None:
+        self.started = time.perf_counter()
+
+    def __exit__(self, *exc_info) -> None:
+        ended = time.perf_counter()
+        elapsed = ended - self.started
+        timings = _current.get()
+        if timings is not None:
+            timings.spans.append((self.name, elapsed, ended))
+        else:
+            stage_seconds.observe(elapsed, BACKGROUND, self.name)
+
+
+def span(name: str):
+    """Context manager timing one processing stage (no-op when metrics are disabled)."""
+    if not METRICS_ENABLED:
+        return _NOOP
+    return _Span(name)
+
+
+def observe_upstream(upstream: str, target: str, status: str, seconds: float) -> None:
+    """Record one upstream call; target is the URL path, or the model for LLM calls."""
+    if not METRICS_ENABLED:
+        return
+    timings = _current.get()
+    if timings is not None:
+        timings.upstream.append((upstream, target, status, seconds, time.perf_counter()))
+    else:
+        upstream_seconds.observe(seconds, BACKGROUND, upstream, target, status)
+
+
+def count_parse_failure(kind: str) -> None:
+    if not METRICS_ENABLED:
+        return
+    timings = _current.get()
+    if timings is not None:
+        timings.parse_failures.append(kind)
+    else:
+        llm_parse_failures.inc(BACKGROUND, kind)
+
+
+def start_background(coro: Awaitable) -> asyncio.Task:
+    """Run coro as a task of its own, recorded under the background endpoint.
+
+    A task copies the context it is created in; without this, work started by
+    a request (a cache refresh) would be recorded on that request, or on
+    nothing once it has finished.
+    """
+    context = copy_context()
+    context.run(_current.set, None)
+    return context.run(asyncio.create_task, coro)
+
+
+def count_upstream_retry(upstream: str, reason: str) -> None:
+    if METRICS_ENABLED:
+        upstream_retries.inc(upstream, reason)
+
+
+def count_upstream_rejection(upstream: str, reason: str) -> None:
+    if METRICS_ENABLED:
+        upstream_rejections.inc(upstream, reason)
+
+
+def add_collector(collect: Callable[[], List[str]]) -> None:
+    """Register a function returning extra exposition lines (see gauge_lines) for render()."""
+    _collectors.append(collect)
+
+
+def gauge_lines(name: str, help: str, samples: Sequence[Tuple[Dict[str, str], float]]) -> List[str]:
+    lines = [f"# HELP {name} {help}", f"# TYPE {name} gauge"]
+    for labels, value in samples:
+        lines.append(f"{name}{_labels(list(labels), list(labels.values()))} {value:g}")
+    return lines
+
+
+def render() -> str:
+    lines: List[str] = []
+    for metric in _REGISTRY:
+        lines.extend(metric.render())
+    for collect in _collectors:
+        lines.extend(collect())
+    return "\n".join(lines) + "\n"
+
+
+def _wall_time(intervals: List[Tuple[float, float]]) -> float:
+    """Time covered by at least one of the (start, end) intervals."""
+    covered = 0.0
+    reached = float("-inf")
+    for start, end in sorted(intervals):
+        if end > reached:
+            covered += end - max(start, reached)
+            reached = end
+    return covered
+
+
+def server_timing(timings: _RequestTimings, total: Optional[float] = None) -> str:
+    """Server-Timing header value; repeated stages are merged and counted.
+
+    The duration of a repeated stage is the wall time it covered, so concurrent
+    calls are not added up; desc then also gives their summed time.
+    """
+    merged: Dict[str, List[Tuple[float, float]]] = {}
+    for name, seconds, ended in timings.spans:
+        merged.setdefault(name, []).append((ended - seconds, ended))
+    for upstream, _, _, seconds, ended in timings.upstream:
+        merged.setdefault(upstream, []).append((ended - seconds, ended))
+    parts = []
+    for name, intervals in merged.items():
+        part = f"{name};dur={_wall_time(intervals) * 1000:.1f}"
+        if len(intervals) > 1:
+            summed = sum(end - start for start, end in intervals)
+            part += f';desc="{len(intervals)} calls, {summed * 1000:.1f} ms summed"'
+        parts.append(part)
+    if total is not None:
+        parts.append(f"total;dur={total * 1000:.1f}")
+    return ", ".join(parts)
+
+
+def current_server_timing() -> Optional[str]:
+    """Server-Timing value for the stages of the current request so far, if metrics are on.
+
+    Streaming endpoints send it in their final event, since their headers go out
+    before the work is done.
+    """
+    timings = _current.get() if METRICS_ENABLED else None
+    return server_timing(timings) if timings is not None else None
+
+
+class MetricsMiddleware:
+    """ASGI middleware that times requests and adds the Server-Timing header."""
+
+    def __init__(self, app):
+        self.app = app
+        self._paths: Dict[Callable, str] = {}
+
+    def _endpoint(self, scope) -> str:
+        endpoint = scope.get("endpoint")
+        if endpoint is None:
+            return "unmatched"
+        path = self._paths.get(endpoint)
+        if path is None:
+            app = scope.get("app")
+            for route in getattr(app, "routes", ()):
+                if getattr(route, "endpoint", None) is endpoint:
+                    path = route.path
+                    break
+            path = self._paths[endpoint] = path or getattr(endpoint, "__name__", "unknown")
+        return path
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        timings = _RequestTimings()
+        token = _current.set(timings)
+        started = time.perf_counter()
+        status = "500"
+
+        async def send_with_timing(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = str(message["status"])
+                header = server_timing(timings, time.perf_counter() - started)
+                message["headers"] = list(message.get("headers", [])) + [(b"server-timing", header.encode())]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            _current.reset(token)
+            endpoint = self._endpoint(scope)
+            http_request_seconds.observe(time.perf_counter() - started, endpoint, scope["method"], status)
+            for name, seconds, _ in timings.spans:
+                stage_seconds.observe(seconds, endpoint, name)
+            for upstream, target, upstream_status, seconds, _ in timings.upstream:
+                upstream_seconds.observe(seconds, endpoint, upstream, target, upstream_status)
+            for kind in timings.parse_failures:
+                llm_parse_failures.inc(endpoint, kind)
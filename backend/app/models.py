@@ -0,0 +1,325 @@
+"""Request and response models for the API, and the schemas Gemini output is checked against."""
+import json
+from typing import Any, Dict, List, Optional, Set, Tuple, Type, TypeVar, Union
+
+from pydantic import BaseModel, PrivateAttr, field_serializer
+
+ModelT = TypeVar("ModelT", bound=BaseModel)
+
+
+# -- requests -----------------------------------------------------------------------
+
+class DrugAnalysisRequest(BaseModel):
+    medications: List[str]
+    diagnosis: str
+    symptoms: List[str]
+
+
+class BatchDrugAnalysisItem(DrugAnalysisRequest):
+    id: Optional[str] = None
+
+
+class BatchDrugAnalysisRequest(BaseModel):
+    items: List[BatchDrugAnalysisItem]
+    group_size: Optional[int] = None
+
+
+class SymptomAnalysisRequest(BaseModel):
+    diagnosis: str
+    symptoms: List[str]
+
+
+class EmailRequest(BaseModel):
+    to: str
+    subject: str
+    message: str
+
+
+# -- Gemini output ------------------------------------------------------------------
+# The *Output schemas require the key field of each answer, so an unrelated or
+# truncated object counts as unparseable; other missing keys get defaults and
+# unknown keys are dropped. The base models are the response shapes, which also
+# carry errors.
+
+class AdvancedConflict(BaseModel):
+    drugs: List[str] = []
+    type: str = ""
+    severity: str = ""
+    description: str = ""
+
+
+class DiagnosisContradiction(BaseModel):
+    drug: str = ""
+    contradiction: str = ""
+
+
+class AdditionalWarning(BaseModel):
+    warning: str = ""
+    drugs: List[str] = []
+
+
+class AdvancedAnalysis(BaseModel):
+    advanced_conflicts: List[AdvancedConflict] = []
+    diagnosis_contradictions: List[DiagnosisContradiction] = []
+    additional_warnings: List[AdditionalWarning] = []
+    # Set instead of the lists when the analysis failed, or could not be parsed (raw text)
+    error: Optional[str] = None
+    analysis: Optional[str] = None
+
+
+class AdvancedAnalysisOutput(AdvancedAnalysis):
+    advanced_conflicts: List[AdvancedConflict]
+
+
+class PatientAnalysis(AdvancedAnalysisOutput):
+    patient: Union[str, int]
+
+
+class BatchAnalysis(BaseModel):
+    patients: List[PatientAnalysis]
+
+
+class AlternativeDiagnosis(BaseModel):
+    condition: str = ""
+    similarity_score: Optional[float] = None
+    matching_symptoms: List[str] = []
+    explanation: str = ""
+
+
+class DifferentialDiagnosis(BaseModel):
+    diagnosis_similarity: Optional[float] = None
+    matching_symptoms: List[str] = []
+    diagnosis_assessment: Optional[str] = None
+    alternatives: List[AlternativeDiagnosis] = []
+    error: Optional[str] = None
+    raw_content: Optional[str] = None
+
+
+class DifferentialDiagnosisOutput(DifferentialDiagnosis):
+    diagnosis_similarity: float
+    alternatives: List[AlternativeDiagnosis]
+
+
+class EnhancedInfo(BaseModel):
+    summary: str
+    key_warnings_explanation: str = ""
+    special_considerations: str = ""
+
+
+# -- responses ----------------------------------------------------------------------
+
+class DrugInfo(BaseModel):
+    brand_name: str
+    generic_name: Optional[str] = None
+    warnings: List[str] = []
+    contraindications: List[str] = []
+    adverse_reactions: List[str] = []
+    drug_interactions: List[str] = []
+    indications_and_usage: List[str] = []
+    _lookup_failed: bool = PrivateAttr(default=False)
+    _label_key: Optional[Tuple[str, str]] = PrivateAttr(default=None)
+
+    @classmethod
+    def from_label(cls, brand_name: str, label: Dict[str, Any]) -> "DrugInfo":
+        """The label sections of an openFDA label, keyed by its set id and version."""
+        openfda = label.get("openfda", {})
+        info = cls(
+            brand_name=brand_name,
+            generic_name=openfda["generic_name"][0] if openfda.get("generic_name") else None,
+            warnings=label.get("warnings", []),
+            contraindications=label.get("contraindications", []),
+            adverse_reactions=label.get("adverse_reactions", []),
+            drug_interactions=label.get("drug_interactions", []),
+            indications_and_usage=label.get("indications_and_usage", []),
+        )
+        set_id = label.get("set_id") or label.get("id")
+        if set_id:
+            info._label_key = (set_id, str(label.get("version") or label.get("effective_time") or ""))
+        return info
+
+    @classmethod
+    def lookup_error(cls, brand_name: str, message: str) -> "DrugInfo":
+        """Placeholder for a drug whose label could not be fetched; message is its only warning."""
+        info = cls(brand_name=brand_name, warnings=[message])
+        info._lookup_failed = True
+        return info
+
+    @property
+    def lookup_failed(self) -> bool:
+        return self._lookup_failed
+
+    @property
+    def label_key(self) -> Optional[Tuple[str, str]]:
+        """(set id, version) of the label this was built from, if known."""
+        return self._label_key
+
+
+class BasicConflict(BaseModel):
+    drug1: str
+    drug2: str
+    type: str
+    details: List[str]
+
+
+class DrugAnalysisResponse(BaseModel):
+    drug_infos: List[DrugInfo]
+    basic_conflicts: List[BasicConflict]
+    advanced_analysis: AdvancedAnalysis
+
+    @field_serializer("advanced_analysis")
+    def _analysis_as_returned(self, analysis: AdvancedAnalysis) -> Dict:
+        # error and analysis only appear when set
+        return analysis.model_dump(exclude_none=True)
+
+
+class DrugDetail(BaseModel):
+    brand_name: str
+    generic_name: Optional[str] = None
+    manufacturer: Optional[str] = None
+    product_type: Optional[str] = None
+    route: Optional[str] = None
+    warnings: List[str] = []
+    contraindications: List[str] = []
+    adverse_reactions: List[str] = []
+    drug_interactions: List[str] = []
+    boxed_warnings: List[str] = []
+    indications_and_usage: List[str] = []
+    dosage_and_administration: List[str] = []
+    enhanced_info: Optional[EnhancedInfo] = None
+
+
+class DrugSearchResult(BaseModel):
+    brand_name: Optional[str] = ""
+    generic_name: Optional[str] = ""
+    manufacturer: Optional[str] = ""
+    product_type: Optional[str] = ""
+
+
+class DrugSearchResponse(BaseModel):
+    results: List[DrugSearchResult]
+
+
+class AdverseEventReport(BaseModel):
+    report_id: str
+    report_date: str
+    reactions: List[str]
+    serious: str
+    outcome: str
+
+
+class AdverseEventPage(BaseModel):
+    events: List[AdverseEventReport]
+    total: int
+    skip: int
+    limit: int
+    next_skip: Optional[int] = None
+
+
+class ReactionFrequency(BaseModel):
+    term: str
+    count: int
+    percent: float
+
+
+class TimeBucket(BaseModel):
+    period: str
+    count: int
+
+
+class AdverseEventSummary(BaseModel):
+    drug_name: str
+    total_reports: int
+    serious: Dict[str, int]
+    seriousness: Dict[str, int]
+    reaction_outcomes: Dict[str, int]
+    reactions: List[ReactionFrequency]
+    bucket: str
+    time_buckets: List[TimeBucket]
+    updated_at: float
+    source: str
+    reports: Optional[AdverseEventPage] = None
+
+
+class EmailQueued(BaseModel):
+    success: bool
+    id: str
+    status: str
+    message: str
+
+
+class EmailStatus(BaseModel):
+    id: str
+    status: str
+    attempts: int
+    next_attempt_at: Optional[float] = None
+    created_at: float
+    updated_at: float
+    provider_id: Optional[str] = None
+    last_error: Optional[str] = None
+
+
+class MessageResponse(BaseModel):
+    message: str
+
+
+class StatsResponse(BaseModel):
+    upstream_pools: Dict[str, Any]
+    label_cache: Dict[str, Any]
+    label_text: Dict[str, Any]
+    label_store: Dict[str, Any]
+    llm: Dict[str, Any]
+    result_cache: Dict[str, Any]
+    prompts: Dict[str, Any]
+    adverse_events: Dict[str, Any]
+    email_outbox: Dict[str, Any]
+    startup: Dict[str, Any]
+
+
+# -- helpers ------------------------------------------------------------------------
+
+_DECODER = json.JSONDecoder()
+
+
+def extract_json(text: str) -> Any:
+    """The JSON object in an LLM response, inside a ``` fence or bare.
+
+    Decodes the object opening at the first "{" after the fence (or in the
+    text) in place with raw_decode, so surrounding prose and the closing fence
+    are never copied. Only that object is tried: an inner object of a response
+    cut off at max_output_tokens must not pass for the answer. Raises
+    json.JSONDecodeError if it is missing or incomplete.
+    """
+    fence = text.find("```")
+    start = text.find("{", fence + 3) if fence >= 0 else -1
+    if start < 0:
+        start = text.find("{")
+    if start < 0:
+        raise json.JSONDecodeError("No JSON object found", text, 0)
+    return _DECODER.raw_decode(text, start)[0]
+
+
+def parse_llm_output(text: str, schema: Type[ModelT]) -> ModelT:
+    """Extract the JSON in an LLM response and validate it against schema.
+
+    Raises ValueError (json.JSONDecodeError or pydantic.ValidationError) when
+    the response has no JSON object or it does not fit the schema.
+    """
+    return schema.model_validate(extract_json(text))
+
+
+def selected_fields(
+    fields: Optional[str], model: Type[BaseModel], always: Set[str] = frozenset(),
+) -> Optional[Set[str]]:
+    """Field names from a comma-separated ?fields= value, or None for all fields.
+
+    Raises ValueError naming the valid fields if one is unknown.
+    """
+    if not fields:
+        return None
+    wanted = {f.strip() for f in fields.split(",") if f.strip()}
+    unknown = wanted - set(model.model_fields)
+    if unknown:
+        raise ValueError(
+            f"Unknown field(s): {', '.join(sorted(unknown))}; valid fields: {', '.join(model.model_fields)}"
+        )
+    return wanted | set(always)
@@ -0,0 +1,319 @@
+"""Durable outbox for report emails, delivered to Resend in the background.
+
+``POST /api/send-email`` only writes the message to a SQLite outbox and returns
+its id, so the request never waits on the email provider. A background worker
+claims due messages in batches of up to EMAIL_BATCH_SIZE, sends them with one
+call to Resend's ``/emails/batch`` endpoint (``/emails`` for a single message)
+and records the outcome. Rate limits, server errors and connection failures are
+retried with exponential backoff until EMAIL_MAX_ATTEMPTS; a batch the provider
+rejects as invalid is retried message by message so one bad address does not
+hold up the rest.
+
+Claims are leases (EMAIL_CLAIM_SECONDS), so several workers can share the outbox
+and messages claimed by a worker that died are picked up again. A lease never
+ends before a send can: it is at least the Resend client's worst case for one
+call (PoolConfig.call_budget_seconds), so no other worker sends the same
+messages while the first is still waiting on Resend. A batch keeps
+its messages together until it is delivered: retries send the same messages
+under the same Idempotency-Key, so a batch that Resend accepted but whose
+response was lost is not sent twice.
+"""
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import time
+import uuid
+from typing import Dict, List, Optional, Tuple
+
+import aiosqlite
+
+from app.config import DATA_DIR, RESEND_API_KEY, env_float, env_int
+from app.http_clients import clients
+from app.resilience import backoff
+
+logger = logging.getLogger(__name__)
+
+EMAIL_OUTBOX_PATH = os.getenv("EMAIL_OUTBOX_PATH", os.path.join(DATA_DIR, "email_outbox.sqlite3"))
+EMAIL_FROM = os.getenv("EMAIL_FROM", "onboarding@resend.dev")
+# Resend accepts at most 100 emails per batch call
+EMAIL_BATCH_SIZE = min(env_int("EMAIL_BATCH_SIZE", 100), 100)
+EMAIL_MAX_ATTEMPTS = env_int("EMAIL_MAX_ATTEMPTS", 8)
+EMAIL_RETRY_BASE_SECONDS = env_float("EMAIL_RETRY_BASE_SECONDS", 2.0)
+EMAIL_RETRY_MAX_SECONDS = env_float("EMAIL_RETRY_MAX_SECONDS", 600.0)
+EMAIL_POLL_SECONDS = env_float("EMAIL_POLL_SECONDS", 1.0)
+EMAIL_CLAIM_SECONDS = env_float("EMAIL_CLAIM_SECONDS", 60.0)
+# Added to the Resend call budget for recording the outcome once the call returns
+EMAIL_LEASE_MARGIN_SECONDS = 10.0
+
+QUEUED = "queued"
+SENDING = "sending"
+SENT = "sent"
+FAILED = "failed"
+
+_Message = Tuple[str, Dict, int]  # id, Resend payload, attempts so far
+
+
+class EmailOutbox:
+    def __init__(
+        self,
+        path: str = EMAIL_OUTBOX_PATH,
+        batch_size: int = EMAIL_BATCH_SIZE,
+        max_attempts: int = EMAIL_MAX_ATTEMPTS,
+        poll_seconds: float = EMAIL_POLL_SECONDS,
+    ):
+        self.path = path
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.poll_seconds = poll_seconds
+        self._db: Optional[aiosqlite.Connection] = None
+        self._open_lock = asyncio.Lock()
+        self._wake = asyncio.Event()
+        self._worker: Optional[asyncio.Task] = None
+        self.counters = {"queued": 0, "sent": 0, "failed": 0, "retries": 0, "batches": 0, "provider_errors": 0}
+
+    async def open(self) -> None:
+        async with self._open_lock:
+            if self._db is not None:
+                return
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            db = await aiosqlite.connect(self.path)
+            await db.execute("PRAGMA journal_mode=WAL")
+            await db.execute("PRAGMA busy_timeout=5000")
+            await db.execute(
+                "CREATE TABLE IF NOT EXISTS messages ("
+                " id TEXT PRIMARY KEY,"
+                " payload TEXT NOT NULL,"
+                " status TEXT NOT NULL,"
+                " attempts INTEGER NOT NULL DEFAULT 0,"
+                " next_attempt_at REAL NOT NULL,"
+                " claimed_by TEXT,"
+                " created_at REAL NOT NULL,"
+                " updated_at REAL NOT NULL,"
+                " provider_id TEXT,"
+                " last_error TEXT,"
+                " batch TEXT)"
+            )
+            async with db.execute("PRAGMA table_info(messages)") as cursor:
+                columns = {row[1] for row in await cursor.fetchall()}
+            if "batch" not in columns:
+                await db.execute("ALTER TABLE messages ADD COLUMN batch TEXT")
+            await db.execute("CREATE INDEX IF NOT EXISTS messages_due ON messages (status, next_attempt_at)")
+            await db.commit()
+            self._db = db
+
+    async def close(self) -> None:
+        await self.stop()
+        if self._db is not None:
+            await self._db.close()
+            self._db = None
+
+    def start(self) -> None:
+        """Start the delivery worker (needs RESEND_API_KEY)."""
+        if self._worker is None:
+            if self.lease_seconds > EMAIL_CLAIM_SECONDS:
+                logger.warning(
+                    "EMAIL_CLAIM_SECONDS=%g is shorter than a Resend call can take; leasing for %gs",
+                    EMAIL_CLAIM_SECONDS, self.lease_seconds,
+                )
+            self._worker = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        worker, self._worker = self._worker, None
+        if worker is not None:
+            worker.cancel()
+            await asyncio.gather(worker, return_exceptions=True)
+
+    async def enqueue(self, to: str, subject: str, text: str) -> str:
+        """Store a message for delivery and return its id."""
+        await self.open()
+        message_id = uuid.uuid4().hex
+        payload = {"from": EMAIL_FROM, "to": [to], "subject": subject, "text": text}
+        now = time.time()
+        await self._db.execute(
+            "INSERT INTO messages (id, payload, status, next_attempt_at, created_at, updated_at)"
+            " VALUES (?, ?, ?, ?, ?, ?)",
+            (message_id, json.dumps(payload), QUEUED, now, now, now),
+        )
+        await self._db.commit()
+        self.counters["queued"] += 1
+        self._wake.set()
+        return message_id
+
+    async def status(self, message_id: str) -> Optional[Dict]:
+        await self.open()
+        async with self._db.execute(
+            "SELECT status, attempts, next_attempt_at, created_at, updated_at, provider_id, last_error"
+            " FROM messages WHERE id = ?", (message_id,),
+        ) as cursor:
+            row = await cursor.fetchone()
+        if row is None:
+            return None
+        status, attempts, next_attempt_at, created_at, updated_at, provider_id, last_error = row
+        return {
+            "id": message_id,
+            "status": QUEUED if status == SENDING else status,
+            "attempts": attempts,
+            "next_attempt_at": next_attempt_at if status == QUEUED else None,
+            "created_at": created_at,
+            "updated_at": updated_at,
+            "provider_id": provider_id,
+            "last_error": last_error,
+        }
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                while await self.deliver_due():
+                    pass
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning("Email outbox delivery failed: %s", e)
+            try:
+                await asyncio.wait_for(self._wake.wait(), self.poll_seconds)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+
+    @property
+    def lease_seconds(self) -> float:
+        budget = clients.configs["resend"].call_budget_seconds()
+        return max(EMAIL_CLAIM_SECONDS, budget + EMAIL_LEASE_MARGIN_SECONDS)
+
+    async def _claim(self) -> Tuple[List[_Message], Optional[str]]:
+        """Lease due messages to this worker: a batch sent before, or up to batch_size new ones.
+
+        Returns the messages and their batch key (None for a single message).
+        """
+        await self.open()
+        now = time.time()
+        token = uuid.uuid4().hex
+        # Due messages, and messages whose lease ran out (their worker died mid-send)
+        due = "status IN (?, ?) AND next_attempt_at <= ?"
+        async with self._db.execute(
+            f"SELECT batch FROM messages WHERE {due} ORDER BY next_attempt_at LIMIT 1", (QUEUED, SENDING, now),
+        ) as cursor:
+            row = await cursor.fetchone()
+        if row is None:
+            return [], None
+        lease = (SENDING, token, now + self.lease_seconds, now)
+        if row[0]:
+            # Retried as the same batch, so the provider recognizes its Idempotency-Key
+            await self._db.execute(
+                "UPDATE messages SET status = ?, claimed_by = ?, next_attempt_at = ?, updated_at = ?"
+                f" WHERE batch = ? AND {due}",
+                lease + (row[0], QUEUED, SENDING, now),
+            )
+        else:
+            await self._db.execute(
+                "UPDATE messages SET status = ?, claimed_by = ?, next_attempt_at = ?, updated_at = ?"
+                f" WHERE id IN (SELECT id FROM messages WHERE batch IS NULL AND {due}"
+                "  ORDER BY next_attempt_at LIMIT ?)",
+                lease + (QUEUED, SENDING, now, self.batch_size),
+            )
+        async with self._db.execute(
+            "SELECT id, payload, attempts FROM messages WHERE claimed_by = ? AND status = ? ORDER BY id",
+            (token, SENDING),
+        ) as cursor:
+            messages = [(r[0], json.loads(r[1]), r[2]) for r in await cursor.fetchall()]
+        batch = row[0]
+        if batch is None and len(messages) > 1:
+            batch = hashlib.sha256(",".join(m[0] for m in messages).encode()).hexdigest()
+            await self._db.execute("UPDATE messages SET batch = ? WHERE claimed_by = ?", (batch, token))
+        await self._db.commit()
+        return messages, batch
+
+    async def deliver_due(self) -> int:
+        """Send one batch of due messages; returns how many were claimed."""
+        messages, batch = await self._claim()
+        if not messages:
+            return 0
+        self.counters["batches"] += 1
+        outcome = await self._send(messages, batch)
+        if outcome is None:
+            # The provider rejected the batch as a whole, so nothing was sent; find the bad
+            # messages one by one, each from now on under its own key
+            for message in messages:
+                await self._record([message], await self._send([message], None), None)
+        else:
+            await self._record(messages, outcome, batch)
+        return len(messages)
+
+    async def _send(self, messages: List[_Message], batch: Optional[str]):
+        """Deliver messages in one call.
+
+        Returns ("sent", provider ids), ("retry", error) or ("failed", error), or
+        None when a batch of several messages was rejected as invalid.
+        """
+        headers = {
+            "Authorization": f"Bearer {RESEND_API_KEY}",
+            # Resend drops repeats of a call with the same key, so a retry after a lost response sends nothing twice
+            "Idempotency-Key": batch or messages[0][0],
+        }
+        try:
+            if len(messages) == 1:
+                response = await clients.resend.post("/emails", json=messages[0][1], headers=headers)
+            else:
+                response = await clients.resend.post("/emails/batch", json=[m[1] for m in messages], headers=headers)
+        except Exception as e:
+            return "retry", f"{type(e).__name__}: {e}"
+
+        if response.status_code == 200:
+            data = response.json()
+            results = data.get("data", []) if len(messages) > 1 else [data]
+            return "sent", [r.get("id") for r in results] + [None] * (len(messages) - len(results))
+        try:
+            error = response.json().get("message") or response.text
+        except ValueError:
+            error = response.text
+        error = f"HTTP {response.status_code}: {error}"
+        if response.status_code == 429 or response.status_code >= 500:
+            return "retry", error
+        if len(messages) > 1:
+            return None
+        return "failed", error
+
+    async def _record(self, messages: List[_Message], outcome, batch: Optional[str]) -> None:
+        kind, detail = outcome
+        now = time.time()
+        if kind == "sent":
+            rows = [(SENT, now, provider_id, m[0]) for m, provider_id in zip(messages, detail)]
+            await self._db.executemany(
+                "UPDATE messages SET status = ?, attempts = attempts + 1, claimed_by = NULL,"
+                " updated_at = ?, provider_id = ?, last_error = NULL WHERE id = ?", rows,
+            )
+            self.counters["sent"] += len(messages)
+        else:
+            self.counters["provider_errors"] += 1
+            # A batch is retried or given up as a whole, so it is sent again unchanged
+            attempts = max(m[2] for m in messages)
+            if kind == "failed" or attempts + 1 >= self.max_attempts:
+                status, next_attempt_at = FAILED, now
+                self.counters["failed"] += len(messages)
+            else:
+                delay = backoff(attempts, EMAIL_RETRY_BASE_SECONDS, EMAIL_RETRY_MAX_SECONDS)
+                status, next_attempt_at = QUEUED, now + max(delay, EMAIL_RETRY_BASE_SECONDS)
+                self.counters["retries"] += len(messages)
+            await self._db.executemany(
+                "UPDATE messages SET status = ?, attempts = attempts + 1, claimed_by = NULL,"
+                " next_attempt_at = ?, updated_at = ?, last_error = ?, batch = ? WHERE id = ?",
+                [(status, next_attempt_at, now, detail, batch, m[0]) for m in messages],
+            )
+            logger.warning("Email delivery of %d message(s) failed: %s", len(messages), detail)
+        await self._db.commit()
+
+    async def stats(self) -> Dict:
+        await self.open()
+        async with self._db.execute("SELECT status, COUNT(*) FROM messages GROUP BY status") as cursor:
+            by_status = {status: count for status, count in await cursor.fetchall()}
+        return {
+            "worker_running": self._worker is not None and not self._worker.done(),
+            "batch_size": self.batch_size,
+            "by_status": by_status,
+            **self.counters,
+        }
+
+
+outbox = EmailOutbox()
@@ -0,0 +1,216 @@
+"""FDA label excerpts for LLM prompts, trimmed to a token budget.
+
+Label sections run to tens of kilobytes, and Gemini latency grows with prompt
+size. Instead of dumping every section verbatim, the prompt carries the
+sentences most relevant to the request: interaction sentences that name another
+drug in the request, sentences that mention the diagnosis or symptoms, and
+sentences with strong safety language, in that order of preference. Boilerplate
+shared by several labels is listed once, and the whole block is cut to
+PROMPT_LABEL_TOKEN_BUDGET (estimated at about four characters per token).
+Set PROMPT_TRIM_ENABLED=false to send full sections as before.
+"""
+import json
+import logging
+import math
+import re
+from dataclasses import dataclass
+from typing import Dict, FrozenSet, Iterable, List, Optional, Sequence, Tuple
+
+from app import label_text
+from app.config import env_bool, env_int
+from app.interactions import InteractionMatcher
+
+logger = logging.getLogger(__name__)
+
+PROMPT_TRIM_ENABLED = env_bool("PROMPT_TRIM_ENABLED", True)
+PROMPT_LABEL_TOKEN_BUDGET = env_int("PROMPT_LABEL_TOKEN_BUDGET", 3000)
+
+# Label sections in the order they are rendered, with their prompt abbreviation
+# and how much a sentence from the section is worth before any other signal
+SECTIONS: Tuple[Tuple[str, str, int], ...] = (
+    ("drug_interactions", "DI", 1),
+    ("contraindications", "C", 2),
+    ("warnings", "W", 1),
+    ("adverse_reactions", "AR", 0),
+)
+SECTION_LEGEND = "DI=drug interactions, C=contraindications, W=warnings, AR=adverse reactions"
+
+_CHARS_PER_TOKEN = 4
+_MAX_SENTENCE_CHARS = 600
+_SENTENCE_END = re.compile(r"(?<=[.!?;])\s+(?=[A-Z0-9(\[])")
+
+_SAFETY_WORDS = frozenset({
+    "avoid", "bleeding", "boxed", "coadministration", "concomitant", "contraindicated",
+    "death", "discontinue", "fatal", "hemorrhage", "inducer", "inducers", "inhibitor",
+    "inhibitors", "monitor", "overdose", "pregnancy", "serious", "severe", "toxicity",
+})
+_CONTEXT_STOP_WORDS = frozenset({
+    "with", "from", "have", "pain", "acute", "chronic", "disease", "disorder", "syndrome",
+    "severe", "mild", "type",
+})
+
+
+def estimate_tokens(text: str) -> int:
+    return math.ceil(len(text) / _CHARS_PER_TOKEN)
+
+
+def _sentences(paragraph: str) -> Tuple[Tuple[str, str, FrozenSet[str]], ...]:
+    """(sentence, normalized key, distinct words) for each sentence of a label paragraph."""
+    sentences = []
+    for sentence in _SENTENCE_END.split(" ".join(paragraph.split())):
+        if len(sentence) > _MAX_SENTENCE_CHARS:
+            sentence = sentence[:_MAX_SENTENCE_CHARS].rsplit(" ", 1)[0] + " …"
+        words = label_text.words(sentence)
+        if words:
+            sentences.append((sentence, " ".join(words), frozenset(words)))
+    return tuple(sentences)
+
+
+def context_terms(*texts: str) -> frozenset:
+    """Words of the diagnosis and symptoms worth matching in label text."""
+    return frozenset(
+        w for text in texts for w in label_text.words(text)
+        if len(w) >= 4 and w not in _CONTEXT_STOP_WORDS
+    )
+
+
+@dataclass
+class _Candidate:
+    key: str
+    owner: int
+    section: int
+    position: int
+    text: str
+    score: int
+    rank: int = 0
+
+
+@dataclass
+class PromptReport:
+    tokens_before: int
+    tokens_after: int
+    sentences: int
+    sentences_kept: int
+
+
+class PromptBuilder:
+    def __init__(self, budget: int = PROMPT_LABEL_TOKEN_BUDGET, enabled: bool = PROMPT_TRIM_ENABLED):
+        self.budget = budget
+        self.enabled = enabled
+        self.prompts = 0
+        self.tokens_before = 0
+        self.tokens_after = 0
+        self.last: Optional[PromptReport] = None
+
+    def label_excerpts(
+        self, drugs: Sequence, terms: Iterable[str] = (), sections: Sequence[str] = (),
+        budget: Optional[int] = None,
+    ) -> str:
+        """Label text for drugs (DrugInfo-like objects), ready to embed in a prompt.
+
+        sections limits which label sections are included (default: all of SECTIONS).
+        """
+        wanted = [s for s in SECTIONS if not sections or s[0] in sections]
+        data = [
+            {"brand_name": d.brand_name, "generic_name": d.generic_name,
+             **{name: getattr(d, name) for name, _, _ in wanted}}
+            for d in drugs
+        ]
+        if not self.enabled:
+            full = json.dumps(data, indent=2)
+            self._record(PromptReport(estimate_tokens(full), estimate_tokens(full), 0, 0))
+            return full
+        # "Before" is measured on compact JSON; indent=2 falls back to the slow pure-Python encoder
+        full = json.dumps(data)
+
+        text, sentences, kept = self._trim(drugs, wanted, frozenset(terms), budget or self.budget)
+        self._record(PromptReport(estimate_tokens(full), estimate_tokens(text), sentences, kept))
+        return text
+
+    def _trim(self, drugs: Sequence, wanted, terms: frozenset, budget: int) -> Tuple[str, int, int]:
+        matcher = InteractionMatcher([d.generic_name for d in drugs])
+        candidates: Dict[str, _Candidate] = {}
+        owners: Dict[str, List[int]] = {}
+        total = 0
+        for i, drug in enumerate(drugs):
+            for section, (name, _, weight) in enumerate(wanted):
+                position = 0
+                paragraphs = label_text.derived(
+                    drug, f"sentences:{name}", lambda: [_sentences(p) for p in getattr(drug, name) or []]
+                )
+                for sentences in paragraphs:
+                    for sentence, key, word_set in sentences:
+                        total += 1
+                        position += 1
+                        drug_owners = owners.setdefault(key, [])
+                        if i not in drug_owners:
+                            drug_owners.append(i)
+                        if key in candidates:
+                            continue
+                        score = weight + min(len(word_set & _SAFETY_WORDS), 2)
+                        if word_set & terms:
+                            score += 2
+                        if drug.generic_name and matcher.mentions_words(word_set, f" {key} ") - {i}:
+                            score += 4
+                        candidates[key] = _Candidate(key, i, section, position, sentence, score)
+
+        # Sentences found on several labels are shown once, under their own heading
+        shared: Dict[Tuple[int, ...], int] = {}
+        for candidate in candidates.values():
+            drug_owners = owners[candidate.key]
+            if len(drug_owners) > 1:
+                candidate.owner = shared.setdefault(tuple(drug_owners), len(drugs) + len(shared))
+
+        # Best sentences first, alternating between owners so every drug gets a share
+        per_owner: Dict[int, int] = {}
+        for candidate in sorted(candidates.values(), key=lambda c: (-c.score, c.section, c.position)):
+            candidate.rank = per_owner.get(candidate.owner, 0)
+            per_owner[candidate.owner] = candidate.rank + 1
+        headings = {i: f"[{d.brand_name} | {d.generic_name or 'unknown generic'}]" for i, d in enumerate(drugs)}
+        for drug_owners, owner in shared.items():
+            headings[owner] = f"[Shared by {', '.join(drugs[i].brand_name for i in drug_owners)}]"
+
+        used = sum(len(h) + 1 for i, h in headings.items() if i < len(drugs))
+        limit = budget * _CHARS_PER_TOKEN
+        kept: Dict[int, List[_Candidate]] = {}
+        for candidate in sorted(candidates.values(), key=lambda c: (-c.score, c.rank, c.owner)):
+            cost = len(candidate.text) + 5 + (0 if candidate.owner in kept else len(headings[candidate.owner]) + 1)
+            if used + cost > limit:
+                continue
+            used += cost
+            kept.setdefault(candidate.owner, []).append(candidate)
+
+        lines = []
+        for owner in sorted(headings):
+            if owner >= len(drugs) and owner not in kept:
+                continue
+            lines.append(headings[owner])
+            chosen = sorted(kept.get(owner, []), key=lambda c: (c.section, c.position))
+            for section, (_, label, _) in enumerate(wanted):
+                texts = [c.text for c in chosen if c.section == section]
+                if texts:
+                    lines.append(f"{label}: {' '.join(texts)}")
+        return "\n".join(lines), total, sum(len(c) for c in kept.values())
+
+    def _record(self, report: PromptReport) -> None:
+        self.prompts += 1
+        self.tokens_before += report.tokens_before
+        self.tokens_after += report.tokens_after
+        self.last = report
+        logger.debug(
+            "Label excerpts: ~%d -> ~%d tokens (%d of %d sentences)",
+            report.tokens_before, report.tokens_after, report.sentences_kept, report.sentences,
+        )
+
+    def stats(self) -> Dict:
+        return {
+            "enabled": self.enabled,
+            "label_token_budget": self.budget,
+            "prompts": self.prompts,
+            "label_tokens_before": self.tokens_before,
+            "label_tokens_after": self.tokens_after,
+            "last": self.last.__dict__ if self.last else None,
+        }
+
+
+prompt_builder = PromptBuilder()
@@ -0,0 +1,175 @@
+"""Building blocks for calling rate-limited, sometimes failing upstream APIs.
+
+``TokenBucket`` paces calls to a quota, ``CircuitBreaker`` fails fast while an
+upstream is down, and ``backoff`` gives jittered exponential retry delays. The
+HTTP clients (app.http_clients) and the LLM front (app.llm) combine them; both
+report limiter queue depth and breaker state in /api/stats and /metrics.
+"""
+import asyncio
+import random
+import time
+from typing import Dict, Optional
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+# Breaker state as a number, for the medsafe_upstream_circuit_state gauge
+STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+RETRY_STATUSES = frozenset({429, 500, 502, 503, 504})
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling an upstream whose circuit breaker is open."""
+
+    def __init__(self, name: str, retry_in: float):
+        super().__init__(f"{name} is unavailable (circuit open, retrying in {retry_in:.0f}s)")
+        self.name = name
+        self.retry_in = retry_in
+
+
+class RateLimitedError(Exception):
+    """Raised when a call would wait longer than allowed for a rate limiter token."""
+
+
+def backoff(attempt: int, base: float, cap: float) -> float:
+    """Delay before retry number attempt (0-based): "full jitter" exponential backoff."""
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+class TokenBucket:
+    """Allows rate calls per second on average, with bursts of up to burst calls.
+
+    A rate of 0 disables limiting.
+    """
+
+    def __init__(self, rate: float, burst: int, max_wait: float = 10.0):
+        self.rate = rate
+        self.burst = max(1, burst)
+        self.max_wait = max_wait
+        self._tokens = float(self.burst)
+        self._updated = time.monotonic()
+        self.waiting = 0
+        self.waits = 0
+        self.wait_seconds = 0.0
+        self.rejected = 0
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def try_acquire(self) -> bool:
+        """Take a token if one is available right now."""
+        if not self.rate:
+            return True
+        self._refill()
+        if self._tokens >= 1:
+            self._tokens -= 1
+            return True
+        return False
+
+    async def acquire(self) -> None:
+        """Wait for a token, in arrival order; RateLimitedError if that would exceed max_wait."""
+        if not self.rate:
+            return
+        # Reserve the next token now (the balance may go negative) and sleep until it is due,
+        # so callers are served in arrival order without holding a lock while they wait
+        self._refill()
+        self._tokens -= 1
+        if self._tokens >= 0:
+            return
+        delay = -self._tokens / self.rate
+        if delay > self.max_wait:
+            self._tokens += 1
+            self.rejected += 1
+            raise RateLimitedError(f"rate limit queue is {delay:.1f}s deep")
+        self.waits += 1
+        self.wait_seconds += delay
+        self.waiting += 1
+        try:
+            await asyncio.sleep(delay)
+        finally:
+            self.waiting -= 1
+
+    def stats(self) -> Dict:
+        return {
+            "rate_per_second": self.rate,
+            "burst": self.burst,
+            "waiting": self.waiting,
+            "waits": self.waits,
+            "wait_seconds": round(self.wait_seconds, 3),
+            "rejected": self.rejected,
+        }
+
+
+class CircuitBreaker:
+    """Opens after failure_threshold consecutive failures and rejects calls for
+    reset_seconds; then lets one trial call through (half-open) to decide whether
+    to close again. A threshold of 0 disables the breaker.
+    """
+
+    def __init__(self, name: str, failure_threshold: int = 5, reset_seconds: float = 30.0):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.state = CLOSED
+        self.failures = 0
+        self._opened_at = 0.0
+        self._trial_in_flight = False
+        self.opened = 0
+        self.short_circuited = 0
+
+    def before_call(self) -> None:
+        """Raise CircuitOpenError if the call should not be made."""
+        if not self.failure_threshold or self.state == CLOSED:
+            return
+        retry_in = self._opened_at + self.reset_seconds - time.monotonic()
+        if self.state == OPEN and retry_in <= 0:
+            self.state = HALF_OPEN
+        if self.state == HALF_OPEN and not self._trial_in_flight:
+            self._trial_in_flight = True
+            return
+        self.short_circuited += 1
+        raise CircuitOpenError(self.name, max(retry_in, 0))
+
+    def record_success(self) -> None:
+        self.failures = 0
+        self._trial_in_flight = False
+        self.state = CLOSED
+
+    def abandon(self) -> None:
+        """The call was cancelled before it had an outcome."""
+        self._trial_in_flight = False
+
+    def record_failure(self) -> None:
+        self.failures += 1
+        self._trial_in_flight = False
+        if self.failure_threshold and (self.state == HALF_OPEN or self.failures >= self.failure_threshold):
+            if self.state != OPEN:
+                self.opened += 1
+            self.state = OPEN
+            self._opened_at = time.monotonic()
+
+    @property
+    def is_open(self) -> bool:
+        return self.state != CLOSED
+
+    def stats(self) -> Dict:
+        return {
+            "state": self.state,
+            "consecutive_failures": self.failures,
+            "failure_threshold": self.failure_threshold,
+            "reset_seconds": self.reset_seconds,
+            "opened": self.opened,
+            "short_circuited": self.short_circuited,
+        }
+
+
+def retry_after(headers) -> Optional[float]:
+    """Seconds from a Retry-After header given in seconds, if any."""
+    value = headers.get("retry-after") if headers is not None else None
+    try:
+        return max(0.0, float(value)) if value else None
+    except ValueError:
+        return None
@@ -0,0 +1,90 @@
+"""In-process cache of parsed LLM analyses, keyed on canonicalized inputs."""
+import hashlib
+import json
+import time
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from app.config import env_bool, env_float, env_int
+from app.lru import LRUCache
+
+RESULT_CACHE_ENABLED = env_bool("RESULT_CACHE_ENABLED", True)
+RESULT_CACHE_MAX_ENTRIES = env_int("RESULT_CACHE_MAX_ENTRIES", 1024)
+RESULT_CACHE_TTL_SECONDS = env_float("RESULT_CACHE_TTL_SECONDS", 6 * 3600)
+
+
+def canonical_text(value: str) -> str:
+    """Case-folded, whitespace-normalized form of a free-text input."""
+    return " ".join(value.split()).casefold()
+
+
+def canonical_set(values: Iterable[str]) -> List[str]:
+    """Order- and duplicate-insensitive form of a list of free-text inputs."""
+    return sorted({canonical_text(v) for v in values} - {""})
+
+
+class ResultCache:
+    def __init__(
+        self,
+        max_entries: int = RESULT_CACHE_MAX_ENTRIES,
+        ttl: float = RESULT_CACHE_TTL_SECONDS,
+        enabled: bool = RESULT_CACHE_ENABLED,
+    ):
+        self.ttl = ttl
+        self.enabled = enabled
+        self._entries = LRUCache(max_entries)
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.stale_hits = 0
+
+    @staticmethod
+    def key(*parts: Any) -> str:
+        """Stable key for JSON-serializable parts (already canonicalized by the caller)."""
+        encoded = json.dumps(parts, sort_keys=True, separators=(",", ":"))
+        return hashlib.sha256(encoded.encode()).hexdigest()
+
+    def get(self, key: str, allow_expired: bool = False) -> Optional[Dict]:
+        """Cached result for key, or None. Callers must not mutate the returned dict.
+
+        With allow_expired (while the LLM is unavailable) an expired result is
+        returned rather than dropped.
+        """
+        if not self.enabled:
+            return None
+        entry: Optional[Tuple[float, Dict]] = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        expires_at, value = entry
+        if time.monotonic() >= expires_at:
+            if allow_expired:
+                self.stale_hits += 1
+                return value
+            self._entries.pop(key)
+            self.expired += 1
+            self.misses += 1
+            return None
+        self.hits += 1
+        return value
+
+    def set(self, key: str, value: Any) -> None:
+        """Store a successfully parsed result; error payloads are never cached."""
+        if not self.enabled or not isinstance(value, dict) or "error" in value:
+            return
+        self._entries.set(key, (time.monotonic() + self.ttl, value))
+
+    def stats(self) -> Dict:
+        return {
+            "enabled": self.enabled,
+            "entries": len(self._entries),
+            "max_entries": self._entries.max_entries,
+            "ttl_seconds": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "expired": self.expired,
+            "stale_hits": self.stale_hits,
+            "evictions": self._entries.evictions,
+        }
+
+
+result_cache = ResultCache()
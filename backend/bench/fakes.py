@@ -0,0 +1,259 @@
+"""Local stand-ins for the openFDA and Resend APIs, for load runs.
+
+Serves /drug/label.json, /drug/event.json (including count queries), /emails
+and /emails/batch with configurable latency and error rate. Responses come from
+recorded openFDA payloads when available, otherwise from synthetic labels the
+size of real ones and synthetic adverse event reports, which count queries
+count over. Unknown drugs get a 404 like the real API.
+
+    cd backend
+    python -m bench.fakes serve --port 9100 --latency 0.15 --error-rate 0.01
+    python -m bench.fakes record warfarin aspirin lipitor   # needs network access
+
+Recorded payloads are stored as <payloads>/label/<name>.json and
+<payloads>/event/<name>.json (the raw openFDA response bodies).
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import re
+from functools import lru_cache
+from typing import Dict, List, Optional, Set
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+
+from bench.text import BOILERPLATE, FILLER
+
+DEFAULT_PAYLOADS_DIR = os.path.join(os.path.dirname(__file__), "payloads")
+
+# Brand name -> generic name of the drugs the synthetic upstream knows about
+DRUGS: Dict[str, str] = {
+    "advil": "IBUPROFEN", "aleve": "NAPROXEN SODIUM", "amoxil": "AMOXICILLIN",
+    "aspirin": "ASPIRIN", "coumadin": "WARFARIN SODIUM", "crestor": "ROSUVASTATIN CALCIUM",
+    "diflucan": "FLUCONAZOLE", "eliquis": "APIXABAN", "glucophage": "METFORMIN HYDROCHLORIDE",
+    "lasix": "FUROSEMIDE", "lexapro": "ESCITALOPRAM OXALATE", "lipitor": "ATORVASTATIN CALCIUM",
+    "lisinopril": "LISINOPRIL", "nexium": "ESOMEPRAZOLE MAGNESIUM", "norvasc": "AMLODIPINE BESYLATE",
+    "plavix": "CLOPIDOGREL BISULFATE", "prozac": "FLUOXETINE HYDROCHLORIDE", "synthroid": "LEVOTHYROXINE SODIUM",
+    "tylenol": "ACETAMINOPHEN", "ultram": "TRAMADOL HYDROCHLORIDE", "warfarin": "WARFARIN SODIUM",
+    "xarelto": "RIVAROXABAN", "zocor": "SIMVASTATIN", "zoloft": "SERTRALINE HYDROCHLORIDE",
+}
+_REACTIONS = [
+    "NAUSEA", "HEADACHE", "DIZZINESS", "FATIGUE", "RASH", "DIARRHOEA", "VOMITING",
+    "HAEMORRHAGE", "DYSPNOEA", "PRURITUS", "ARTHRALGIA", "INSOMNIA",
+]
+_SEARCH_VALUE = re.compile(r':"([^"]*)"')
+# Reports per known drug
+_EVENT_TOTAL = 1000
+
+
+def synthetic_label(brand: str, generic: str) -> Dict:
+    """A label shaped like a real openFDA result, with sections of realistic size."""
+    rng = random.Random(brand)
+    others = [g.split()[0].lower() for b, g in DRUGS.items() if b != brand]
+    interactions = [
+        FILLER * 6 + f"Coadministration with {', '.join(rng.sample(others, 3))} may increase the risk of bleeding. "
+        + FILLER * 6
+        for _ in range(4)
+    ]
+    return {
+        "set_id": f"{brand}-set-id",
+        "id": f"{brand}-id",
+        "effective_time": "20240101",
+        "openfda": {
+            "brand_name": [brand.upper()],
+            "generic_name": [generic],
+            "manufacturer_name": ["Bench Pharmaceuticals Inc."],
+            "product_type": ["HUMAN PRESCRIPTION DRUG"],
+            "route": ["ORAL"],
+        },
+        "boxed_warning": [f"WARNING: SERIOUS RISKS WITH {generic}. " + FILLER * 3],
+        "warnings": rng.sample(BOILERPLATE, 2) + [f"Warnings specific to {generic.lower()}. " + FILLER * 10],
+        "contraindications": rng.sample(BOILERPLATE, 1) + [FILLER * 2],
+        "adverse_reactions": ["The most common adverse reactions were nausea, headache and dizziness. " + FILLER * 12],
+        "drug_interactions": interactions,
+        "indications_and_usage": [f"{brand.title()} is indicated for the treatment of bench conditions. " + FILLER * 2],
+        "dosage_and_administration": [FILLER * 4],
+    }
+
+
+def synthetic_event(brand: str, i: int) -> Dict:
+    rng = random.Random(f"{brand}-{i}")
+    serious = str(rng.randint(1, 2))
+    return {
+        "safetyreportid": f"{brand.upper()}{i:08d}",
+        "receiptdate": f"2023{rng.randint(1, 12):02d}{rng.randint(1, 28):02d}",
+        "receivedate": f"2023{rng.randint(1, 12):02d}{rng.randint(1, 28):02d}",
+        "serious": serious,
+        "seriousnessdeath": "1" if serious == "1" and rng.random() < 0.04 else None,
+        "seriousnesshospitalization": "1" if serious == "1" and rng.random() < 0.5 else None,
+        "patient": {
+            "patientoutcome": str(rng.randint(1, 6)),
+            "reaction": [{"reactionmeddrapt": r, "reactionoutcome": str(rng.randint(1, 6))}
+                         for r in rng.sample(_REACTIONS, rng.randint(1, 4))],
+            "drug": [{"medicinalproduct": brand.upper(), "drugcharacterization": "1"}],
+        },
+    }
+
+
+def _field_values(value, path: List[str]) -> Set[str]:
+    """Distinct values at a dotted openFDA field path, descending into lists."""
+    if isinstance(value, list):
+        return set().union(*(_field_values(v, path) for v in value))
+    if not path:
+        return {str(value)} if value is not None else set()
+    if not isinstance(value, dict):
+        return set()
+    return _field_values(value.get(path[0]), path[1:])
+
+
+@lru_cache(maxsize=None)
+def _events(brand: str) -> List[Dict]:
+    return [synthetic_event(brand, i) for i in range(_EVENT_TOTAL)]
+
+
+@lru_cache(maxsize=None)
+def _count_results(field: str, brand: str) -> List[Dict]:
+    """What a count query returns, counted over the same reports /drug/event.json pages through."""
+    counts: Dict[str, int] = {}
+    for event in _events(brand):
+        for value in _field_values(event, field.split(".")):
+            counts[value] = counts.get(value, 0) + 1
+    if "date" in field:
+        return [{"time": t, "count": c} for t, c in sorted(counts.items())]
+    return sorted(({"term": t, "count": c} for t, c in counts.items()), key=lambda r: -r["count"])
+
+
+def _not_found() -> JSONResponse:
+    return JSONResponse({"error": {"code": "NOT_FOUND", "message": "No matches found!"}}, status_code=404)
+
+
+def create_app(
+    latency: float = 0.1, jitter: float = 0.05, error_rate: float = 0.0,
+    payloads_dir: Optional[str] = None,
+) -> FastAPI:
+    """The fake upstream app: each request waits latency plus up to jitter seconds,
+    and fails with 429 or 503 with probability error_rate."""
+    app = FastAPI(title="Fake openFDA / Resend")
+    stats = {"requests": 0, "errors": 0}
+
+    def recorded(kind: str, name: str) -> Optional[Dict]:
+        if not payloads_dir:
+            return None
+        path = os.path.join(payloads_dir, kind, f"{name}.json")
+        if not os.path.exists(path):
+            return None
+        with open(path) as f:
+            return json.load(f)
+
+    @app.middleware("http")
+    async def upstream_behaviour(request: Request, call_next):
+        if request.url.path == "/stats":
+            return await call_next(request)
+        stats["requests"] += 1
+        await asyncio.sleep(latency + random.uniform(0, jitter))
+        if error_rate and random.random() < error_rate:
+            stats["errors"] += 1
+            status = random.choice((429, 503))
+            return JSONResponse({"error": {"code": "SERVER_ERROR", "message": "Injected"}}, status_code=status)
+        return await call_next(request)
+
+    @app.get("/stats")
+    async def get_stats():
+        return stats
+
+    @app.get("/drug/label.json")
+    async def label(search: str = "", limit: int = 1):
+        match = _SEARCH_VALUE.search(search)
+        term = (match.group(1) if match else search).strip().lower()
+        payload = recorded("label", term)
+        if payload is not None:
+            return payload
+        if search.endswith("~"):
+            brands = [b for b in DRUGS if b.startswith(term[:3])]
+        else:
+            brands = [b for b, g in DRUGS.items() if term in (b, g.lower())]
+        if not brands:
+            return _not_found()
+        results = [synthetic_label(b, DRUGS[b]) for b in brands[:limit]]
+        return {"meta": {"results": {"skip": 0, "limit": limit, "total": len(brands)}}, "results": results}
+
+    @app.get("/drug/event.json")
+    async def event(search: str = "", limit: int = 1, skip: int = 0, count: str = ""):
+        match = _SEARCH_VALUE.search(search)
+        term = (match.group(1) if match else search).strip().lower()
+        payload = recorded("event", term)
+        if payload is not None and not count:
+            return payload
+        if term not in DRUGS:
+            return _not_found()
+        if count:
+            results = _count_results(count.replace(".exact", ""), term)[:limit or 100]
+            # Like openFDA, a count with nothing to count is a 404
+            return {"meta": {}, "results": results} if results else _not_found()
+        results = _events(term)[skip:skip + limit]
+        return {"meta": {"results": {"skip": skip, "limit": limit, "total": _EVENT_TOTAL}}, "results": results}
+
+    @app.post("/emails")
+    async def send_email():
+        return {"id": f"fake-{random.getrandbits(48):012x}"}
+
+    @app.post("/emails/batch")
+    async def send_email_batch(request: Request):
+        emails = await request.json()
+        return {"data": [{"id": f"fake-{random.getrandbits(48):012x}"} for _ in emails]}
+
+    return app
+
+
+def record(names: List[str], payloads_dir: str) -> None:
+    """Save real openFDA responses for names, for use with --payloads."""
+    import httpx
+
+    params = {"api_key": os.environ["FDA_API_KEY"]} if os.getenv("FDA_API_KEY") else {}
+    with httpx.Client(base_url="https://api.fda.gov", timeout=30) as client:
+        for name in names:
+            key = " ".join(name.split()).lower()
+            for kind, path, search, limit in (
+                ("label", "/drug/label.json", f'openfda.brand_name:"{name}"', 1),
+                ("event", "/drug/event.json", f'patient.drug.medicinalproduct:"{name}"', 10),
+            ):
+                response = client.get(path, params={**params, "search": search, "limit": limit})
+                if response.status_code != 200:
+                    print(f"{kind} {name}: HTTP {response.status_code}, skipped")
+                    continue
+                os.makedirs(os.path.join(payloads_dir, kind), exist_ok=True)
+                with open(os.path.join(payloads_dir, kind, f"{key}.json"), "w") as f:
+                    f.write(response.text)
+                print(f"{kind} {name}: {len(response.content)} bytes")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(prog="python -m bench.fakes", description=__doc__.split("\n\n")[0])
+    sub = parser.add_subparsers(dest="command", required=True)
+    serve = sub.add_parser("serve", help="run the fake upstreams")
+    serve.add_argument("--host", default="127.0.0.1")
+    serve.add_argument("--port", type=int, default=9100)
+    serve.add_argument("--latency", type=float, default=0.1, help="seconds added to every response")
+    serve.add_argument("--jitter", type=float, default=0.05, help="up to this many extra seconds, uniformly")
+    serve.add_argument("--error-rate", type=float, default=0.0, help="fraction of requests failing with 429/503")
+    serve.add_argument("--payloads", default=None, help=f"recorded payloads directory (e.g. {DEFAULT_PAYLOADS_DIR})")
+    recorder = sub.add_parser("record", help="record real openFDA payloads")
+    recorder.add_argument("names", nargs="+")
+    recorder.add_argument("--payloads", default=DEFAULT_PAYLOADS_DIR)
+    args = parser.parse_args()
+
+    if args.command == "record":
+        record(args.names, args.payloads)
+        return
+
+    import uvicorn
+
+    app = create_app(args.latency, args.jitter, args.error_rate, args.payloads)
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,388 @@
+"""Load and latency benchmark for every API endpoint, against local stand-ins.
+
+Starts the fake openFDA/Resend server (bench.fakes) and the API with the stub
+LLM backend, then drives each scenario at the given concurrency for a fixed
+duration. Reports p50/p95/p99 latency, requests per second, errors and the
+server's memory per scenario, and saves the results as JSON so runs on
+different versions can be compared.
+
+    cd backend
+    python -m bench.load                                  # all scenarios
+    python -m bench.load --scenarios analyze-drugs drug-info --concurrency 50
+    python -m bench.load --fda-latency 0.3 --llm-latency 2 --llm-error-rate 0.02
+    python -m bench.load --compare bench/results/20250101-120000-abc1234.json
+
+Use --target http://host:port to drive an already running server instead (its
+upstreams are then whatever it is configured with).
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import statistics
+import subprocess
+import sys
+import time
+from dataclasses import dataclass
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+import httpx
+
+from bench.fakes import DRUGS
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIR = os.path.join(BACKEND_DIR, "bench", "results")
+
+_BRANDS = sorted(DRUGS)
+_DIAGNOSES = ["atrial fibrillation", "hypertension", "type 2 diabetes", "migraine", "depression"]
+_SYMPTOMS = ["headache", "nausea", "dizziness", "fatigue", "chest pain", "bleeding", "rash"]
+
+
+# Ids of emails queued before the email status scenario, which polls them
+_EMAIL_IDS: List[str] = []
+
+
+@dataclass
+class Scenario:
+    name: str
+    method: str
+    path: Callable[[random.Random], str]
+    body: Optional[Callable[[random.Random], Dict]] = None
+    # Run once before the scenario, with the scenario's client
+    prepare: Optional[Callable[[httpx.AsyncClient], Awaitable[None]]] = None
+
+
+def _analysis_body(rng: random.Random) -> Dict:
+    return {
+        "medications": rng.sample(_BRANDS, rng.randint(2, 6)),
+        "diagnosis": rng.choice(_DIAGNOSES),
+        "symptoms": rng.sample(_SYMPTOMS, 2),
+    }
+
+
+def _symptoms_body(rng: random.Random) -> Dict:
+    return {"diagnosis": rng.choice(_DIAGNOSES), "symptoms": rng.sample(_SYMPTOMS, 3)}
+
+
+def _email_body(rng: random.Random) -> Dict:
+    return {"to": "bench@example.com", "subject": "Bench", "message": "Load test"}
+
+
+async def _queue_emails(client: httpx.AsyncClient) -> None:
+    rng = random.Random(0)
+    for _ in range(50):
+        response = await client.post("/api/send-email", json=_email_body(rng))
+        if response.status_code == 202:
+            _EMAIL_IDS.append(response.json()["id"])
+    if not _EMAIL_IDS:
+        # Email not configured on the target: every status poll then counts as an error
+        _EMAIL_IDS.append("unknown")
+
+
+SCENARIOS: List[Scenario] = [
+    Scenario("root", "GET", lambda rng: "/"),
+    Scenario("stats", "GET", lambda rng: "/api/stats"),
+    Scenario("analyze-drugs", "POST", lambda rng: "/api/analyze-drugs", _analysis_body),
+    Scenario("analyze-drugs-stream", "POST", lambda rng: "/api/analyze-drugs/stream", _analysis_body),
+    Scenario(
+        "analyze-drugs-batch", "POST", lambda rng: "/api/analyze-drugs/batch",
+        lambda rng: {"items": [_analysis_body(rng) for _ in range(20)]},
+    ),
+    Scenario("analyze-symptoms", "POST", lambda rng: "/api/analyze-symptoms", _symptoms_body),
+    Scenario(
+        "analyze-symptoms-stream", "POST", lambda rng: "/api/analyze-symptoms/stream", _symptoms_body
+    ),
+    Scenario("drug-info", "GET", lambda rng: f"/api/drug-info/{rng.choice(_BRANDS)}"),
+    Scenario("search-drugs", "GET", lambda rng: f"/api/search-drugs?term={rng.choice(_BRANDS)[:4]}&limit=10"),
+    Scenario(
+        "drug-adverse-events", "GET", lambda rng: f"/api/drug-adverse-events?drug_name={rng.choice(_BRANDS)}&limit=10"
+    ),
+    Scenario(
+        "drug-adverse-events-summary", "GET",
+        lambda rng: f"/api/drug-adverse-events/summary?drug_name={rng.choice(_BRANDS)}"
+                    f"&top=20&bucket={rng.choice(('month', 'year'))}",
+    ),
+    Scenario("send-email", "POST", lambda rng: "/api/send-email", _email_body),
+    Scenario(
+        "send-email-status", "GET", lambda rng: f"/api/send-email/{rng.choice(_EMAIL_IDS)}",
+        prepare=_queue_emails,
+    ),
+    Scenario("metrics", "GET", lambda rng: "/metrics"),
+]
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _rss_mb(pid: int) -> Optional[float]:
+    """Resident memory of a process and its children (uvicorn workers) in MiB.
+
+    Read from /proc on Linux, otherwise from psutil if it is installed.
+    """
+    try:
+        total = 0
+        pids = [pid]
+        while pids:
+            current = pids.pop()
+            with open(f"/proc/{current}/status") as f:
+                for line in f:
+                    if line.startswith("VmRSS:"):
+                        total += int(line.split()[1])
+            with open(f"/proc/{current}/task/{current}/children") as f:
+                pids.extend(int(child) for child in f.read().split())
+        return total / 1024
+    except OSError:
+        pass
+    try:
+        import psutil
+    except ImportError:
+        return None
+    process = psutil.Process(pid)
+    return sum(p.memory_info().rss for p in [process] + process.children(recursive=True)) / (1024 * 1024)
+
+
+def _percentile(sorted_values: List[float], q: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, round(q * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def _git_revision() -> str:
+    try:
+        return subprocess.run(
+            ["git", "describe", "--always", "--dirty"], cwd=BACKEND_DIR,
+            capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def _wait_until_up(url: str, process: Optional[subprocess.Popen], timeout: float = 30.0) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process is not None and process.poll() is not None:
+            raise RuntimeError(f"{url} exited with status {process.returncode}")
+        try:
+            httpx.get(url, timeout=1.0)
+            return
+        except httpx.HTTPError:
+            time.sleep(0.1)
+    raise RuntimeError(f"{url} did not start within {timeout:g}s")
+
+
+async def _run_scenario(
+    base_url: str, scenario: Scenario, concurrency: int, duration: float, warmup: float,
+    no_cache: bool, server_pid: Optional[int], seed: int,
+) -> Dict:
+    latencies: List[float] = []
+    first_bytes: List[float] = []
+    statuses: Dict[str, int] = {}
+    peak_rss = 0.0
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=120.0) as client:
+        if scenario.prepare is not None:
+            await scenario.prepare(client)
+
+        async def one(rng: random.Random, record: bool) -> None:
+            path = scenario.path(rng)
+            if no_cache and scenario.body is not None:
+                path += ("&" if "?" in path else "?") + "no_cache=true"
+            body = scenario.body(rng) if scenario.body else None
+            started = time.perf_counter()
+            first_byte = None
+            try:
+                async with client.stream(scenario.method, path, json=body) as response:
+                    async for _ in response.aiter_raw():
+                        if first_byte is None:
+                            first_byte = time.perf_counter() - started
+                    status = str(response.status_code)
+            except httpx.HTTPError as e:
+                status = type(e).__name__
+            if record:
+                latencies.append(time.perf_counter() - started)
+                if first_byte is not None:
+                    first_bytes.append(first_byte)
+                statuses[status] = statuses.get(status, 0) + 1
+
+        async def worker(i: int, until: float, record: bool) -> None:
+            rng = random.Random(seed * 1000 + i)
+            while time.perf_counter() < until:
+                await one(rng, record)
+
+        async def sample_memory(until: float) -> None:
+            nonlocal peak_rss
+            while time.perf_counter() < until:
+                rss = _rss_mb(server_pid) if server_pid else None
+                if rss is not None:
+                    peak_rss = max(peak_rss, rss)
+                await asyncio.sleep(0.1)
+
+        if warmup:
+            until = time.perf_counter() + warmup
+            await asyncio.gather(*(worker(i, until, False) for i in range(concurrency)))
+
+        started = time.perf_counter()
+        until = started + duration
+        samplers = [sample_memory(until)] if server_pid else []
+        await asyncio.gather(*(worker(i, until, True) for i in range(concurrency)), *samplers)
+        elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    first_bytes.sort()
+    end_rss = _rss_mb(server_pid) if server_pid else None
+    ok = sum(count for status, count in statuses.items() if status.startswith("2"))
+    return {
+        "requests": len(latencies),
+        "errors": len(latencies) - ok,
+        "statuses": statuses,
+        "rps": round(len(latencies) / elapsed, 2),
+        "p50_ms": round(_percentile(latencies, 0.50) * 1000, 2),
+        "p95_ms": round(_percentile(latencies, 0.95) * 1000, 2),
+        "p99_ms": round(_percentile(latencies, 0.99) * 1000, 2),
+        "max_ms": round(latencies[-1] * 1000, 2) if latencies else 0.0,
+        "mean_ms": round(statistics.fmean(latencies) * 1000, 2) if latencies else 0.0,
+        "first_byte_p50_ms": round(_percentile(first_bytes, 0.50) * 1000, 2),
+        "peak_rss_mb": round(peak_rss, 1) if peak_rss else None,
+        "end_rss_mb": round(end_rss, 1) if end_rss else None,
+    }
+
+
+def _print_table(results: Dict[str, Dict], baseline: Optional[Dict[str, Dict]] = None) -> None:
+    header = (
+        f"{'scenario':<24} {'req':>6} {'err':>5} {'rps':>8} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}"
+        f" {'ttfb p50':>9} {'rss MB':>7}"
+    )
+    if baseline:
+        header += f"  {'Δp50':>7} {'Δp95':>7} {'Δrps':>7}"
+    print(header)
+
+    def delta(new: float, old: float) -> str:
+        return f"{(new - old) / old * 100:+6.1f}%" if old else "    n/a"
+
+    for name, r in results.items():
+        line = (
+            f"{name:<24} {r['requests']:>6} {r['errors']:>5} {r['rps']:>8.1f} {r['p50_ms']:>9.1f}"
+            f" {r['p95_ms']:>9.1f} {r['p99_ms']:>9.1f} {r['first_byte_p50_ms']:>9.1f}"
+            f" {r['peak_rss_mb'] or 0:>7.1f}"
+        )
+        old = (baseline or {}).get(name)
+        if old:
+            line += (
+                f"  {delta(r['p50_ms'], old['p50_ms'])} {delta(r['p95_ms'], old['p95_ms'])}"
+                f" {delta(r['rps'], old['rps'])}"
+            )
+        print(line)
+
+
+def _start_servers(args) -> Tuple[str, List[subprocess.Popen], int]:
+    fake_port, app_port = _free_port(), _free_port()
+    fake_cmd = [
+        sys.executable, "-m", "bench.fakes", "serve", "--port", str(fake_port),
+        "--latency", str(args.fda_latency), "--jitter", str(args.fda_jitter),
+        "--error-rate", str(args.fda_error_rate),
+    ]
+    if args.payloads:
+        fake_cmd += ["--payloads", args.payloads]
+    fake = subprocess.Popen(fake_cmd, cwd=BACKEND_DIR)
+    _wait_until_up(f"http://127.0.0.1:{fake_port}/stats", fake)
+
+    fake_url = f"http://127.0.0.1:{fake_port}"
+    env = dict(
+        os.environ,
+        FDA_BASE_URL=fake_url, RESEND_BASE_URL=fake_url, FDA_API_KEY="",
+        RESEND_API_KEY=os.getenv("RESEND_API_KEY") or "bench", LLM_BACKEND="stub",
+        STUB_LLM_LATENCY_SECONDS=str(args.llm_latency), STUB_LLM_JITTER_SECONDS=str(args.llm_jitter),
+        STUB_LLM_ERROR_RATE=str(args.llm_error_rate), STUB_LLM_RESPONSES_PATH=args.llm_responses or "",
+        DATA_DIR=args.data_dir, LABEL_CACHE_PATH=os.path.join(args.data_dir, "bench-label-cache.sqlite3"),
+        # The fakes have no quota; set these with --app-env to measure the limiter itself
+        FDA_RATE_LIMIT_PER_SECOND="0", RESEND_RATE_LIMIT_PER_SECOND="0",
+    )
+    for assignment in args.app_env:
+        key, _, value = assignment.partition("=")
+        env[key] = value
+    app_cmd = [
+        sys.executable, "-m", "uvicorn", "app.main:app", "--port", str(app_port),
+        "--log-level", "warning", "--workers", str(args.workers),
+    ]
+    app = subprocess.Popen(app_cmd, cwd=BACKEND_DIR, env=env)
+    base_url = f"http://127.0.0.1:{app_port}"
+    _wait_until_up(base_url + "/", app)
+    return base_url, [app, fake], app.pid
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(prog="python -m bench.load", description=__doc__.split("\n\n")[0])
+    names = [s.name for s in SCENARIOS]
+    parser.add_argument("--scenarios", nargs="+", choices=names, default=names)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--duration", type=float, default=10.0, help="measured seconds per scenario")
+    parser.add_argument("--warmup", type=float, default=2.0, help="unmeasured seconds before each scenario")
+    parser.add_argument("--no-cache", action="store_true", help="send no_cache=true to the analysis endpoints")
+    parser.add_argument("--fda-latency", type=float, default=0.15)
+    parser.add_argument("--fda-jitter", type=float, default=0.1)
+    parser.add_argument("--fda-error-rate", type=float, default=0.0)
+    parser.add_argument("--payloads", default=None, help="recorded openFDA payloads (see bench.fakes record)")
+    parser.add_argument("--llm-latency", type=float, default=1.5)
+    parser.add_argument("--llm-jitter", type=float, default=1.0)
+    parser.add_argument("--llm-error-rate", type=float, default=0.0)
+    parser.add_argument("--llm-responses", default=None, help="JSON file of recorded model output by prompt kind")
+    parser.add_argument("--workers", type=int, default=1, help="uvicorn worker processes")
+    parser.add_argument("--app-env", action="append", default=[], metavar="KEY=VALUE", help="extra server env")
+    parser.add_argument("--data-dir", default=os.path.join(RESULTS_DIR, "data"))
+    parser.add_argument("--target", default=None, help="drive this running server instead of starting one")
+    parser.add_argument("--label", default=None, help="name for the results file")
+    parser.add_argument("--output", default=None, help="results file (default: bench/results/<label>.json)")
+    parser.add_argument("--compare", default=None, help="earlier results file to compare against")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)["scenarios"]
+
+    processes: List[subprocess.Popen] = []
+    server_pid = None
+    revision = _git_revision()
+    if args.target:
+        base_url = args.target.rstrip("/")
+    else:
+        os.makedirs(args.data_dir, exist_ok=True)
+        base_url, processes, server_pid = _start_servers(args)
+
+    results: Dict[str, Dict] = {}
+    try:
+        for scenario in SCENARIOS:
+            if scenario.name not in args.scenarios:
+                continue
+            print(f"running {scenario.name} ...", file=sys.stderr)
+            results[scenario.name] = asyncio.run(_run_scenario(
+                base_url, scenario, args.concurrency, args.duration, args.warmup,
+                args.no_cache, server_pid, args.seed,
+            ))
+    finally:
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            process.wait(timeout=10)
+
+    _print_table(results, baseline)
+
+    label = args.label or f"{time.strftime('%Y%m%d-%H%M%S')}-{revision}"
+    output = args.output or os.path.join(RESULTS_DIR, f"{label}.json")
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    config = {k: v for k, v in vars(args).items() if k not in ("compare", "output")}
+    with open(output, "w") as f:
+        json.dump({"revision": revision, "created": time.time(), "config": config, "scenarios": results}, f, indent=2)
+    print(f"\nresults saved to {output}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
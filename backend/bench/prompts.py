@@ -0,0 +1,43 @@
+"""Measure how much the prompt builder trims FDA label text.
+
+Prints the estimated label tokens sent to the LLM with full sections and with
+the token-budgeted excerpts, and the time taken to build them.
+
+    cd backend
+    python -m bench.prompts [--sizes 2 5 20] [--budget 3000]
+"""
+import argparse
+import time
+
+from app.prompts import PromptBuilder, context_terms
+from bench.interactions import synthetic_drugs
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[2, 5, 20])
+    parser.add_argument("--budget", type=int, default=None, help="label token budget (default: PROMPT_LABEL_TOKEN_BUDGET)")
+    args = parser.parse_args()
+
+    builder = PromptBuilder(enabled=True)
+    if args.budget:
+        builder.budget = args.budget
+    terms = context_terms("atrial fibrillation", "bleeding", "headache")
+    print(f"{'drugs':>5}  {'tokens before':>13}  {'tokens after':>12}  {'sentences kept':>14}  {'cold ms':>8}  {'warm ms':>8}")
+    for size in args.sizes:
+        drugs = synthetic_drugs(size, seed=size)
+        started = time.perf_counter()
+        builder.label_excerpts(drugs, terms)
+        cold_ms = (time.perf_counter() - started) * 1000
+        started = time.perf_counter()
+        builder.label_excerpts(drugs, terms)
+        warm_ms = (time.perf_counter() - started) * 1000
+        report = builder.last
+        print(
+            f"{size:>5}  {report.tokens_before:>13}  {report.tokens_after:>12}"
+            f"  {report.sentences_kept:>6} / {report.sentences:<5}  {cold_ms:>8.1f}  {warm_ms:>8.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+"""Cold-start benchmark: import time and time to the first served request.
+
+Measures, over several fresh processes each:
+
+* import time of ``app.main`` (what a new worker pays before it can start);
+* time from spawning uvicorn until it answers ``GET /`` (process ready), and
+  until the first real request (a drug-info lookup against bench.fakes) has
+  been answered, with and without WARMUP_ON_STARTUP.
+
+    cd backend
+    python -m bench.startup
+    python -m bench.startup --runs 10 --llm-backend none
+
+The app's own view of the same numbers is under "startup" in /api/stats.
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Dict, List
+
+import httpx
+
+from bench.load import BACKEND_DIR, _free_port, _wait_until_up
+
+_IMPORT_SNIPPET = (
+    "import time; started = time.perf_counter(); import app.main; "
+    "print(time.perf_counter() - started)"
+)
+
+
+def _env(fake_url: str, data_dir: str, llm_backend: str, **extra: str) -> Dict[str, str]:
+    return dict(
+        os.environ,
+        FDA_BASE_URL=fake_url, RESEND_BASE_URL=fake_url, FDA_API_KEY="", LLM_BACKEND=llm_backend,
+        DATA_DIR=data_dir, LABEL_CACHE_PATH=os.path.join(data_dir, f"startup-{time.time_ns()}.sqlite3"),
+        **extra,
+    )
+
+
+def measure_import(env: Dict[str, str]) -> float:
+    result = subprocess.run(
+        [sys.executable, "-c", _IMPORT_SNIPPET], cwd=BACKEND_DIR, env=env,
+        capture_output=True, text=True, check=True,
+    )
+    return float(result.stdout.strip().splitlines()[-1])
+
+
+def measure_first_request(env: Dict[str, str], drug: str) -> Dict[str, float]:
+    port = _free_port()
+    base_url = f"http://127.0.0.1:{port}"
+    started = time.perf_counter()
+    app = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app.main:app", "--port", str(port), "--log-level", "warning"],
+        cwd=BACKEND_DIR, env=env,
+    )
+    try:
+        _wait_until_up(base_url + "/", app)
+        ready = time.perf_counter() - started
+        response = httpx.get(f"{base_url}/api/drug-info/{drug}", timeout=30.0)
+        first = time.perf_counter() - started
+        response.raise_for_status()
+        return {"ready": ready, "first_request": first}
+    finally:
+        app.terminate()
+        app.wait()
+
+
+def _summary(name: str, values: List[float]) -> str:
+    return (
+        f"{name:<34} median {statistics.median(values) * 1000:7.0f} ms"
+        f"   min {min(values) * 1000:7.0f} ms   max {max(values) * 1000:7.0f} ms"
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(prog="python -m bench.startup", description=__doc__.split("\n\n")[0])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--llm-backend", default="stub", help="LLM_BACKEND for the app (stub, none, gemini)")
+    parser.add_argument("--drug", default="lipitor", help="drug looked up by the first request")
+    args = parser.parse_args()
+
+    fake_port = _free_port()
+    fake = subprocess.Popen(
+        [sys.executable, "-m", "bench.fakes", "serve", "--port", str(fake_port), "--latency", "0.05"],
+        cwd=BACKEND_DIR,
+    )
+    try:
+        _wait_until_up(f"http://127.0.0.1:{fake_port}/stats", fake)
+        fake_url = f"http://127.0.0.1:{fake_port}"
+        with tempfile.TemporaryDirectory() as data_dir:
+            imports = [measure_import(_env(fake_url, data_dir, args.llm_backend)) for _ in range(args.runs)]
+            print(_summary("import app.main", imports))
+            for label, extra in (
+                ("cold", {}),
+                ("warm-up", {"WARMUP_ON_STARTUP": "true", "WARMUP_DRUGS": args.drug}),
+            ):
+                runs = [
+                    measure_first_request(_env(fake_url, data_dir, args.llm_backend, **extra), args.drug)
+                    for _ in range(args.runs)
+                ]
+                print(_summary(f"{label}: spawn -> ready", [r["ready"] for r in runs]))
+                print(_summary(f"{label}: spawn -> first response", [r["first_request"] for r in runs]))
+    finally:
+        fake.terminate()
+        fake.wait()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,16 @@
+"""Sentences shared by the synthetic labels of the benchmarks and the fake openFDA."""
+
+# Filler of the length and vocabulary of real label paragraphs
+FILLER = (
+    "Monitor patients closely when coadministered. Dose adjustment may be required "
+    "based on clinical response. Pharmacokinetic studies showed increased plasma "
+    "concentrations and prolonged half-life in healthy volunteers. "
+)
+
+# Warnings that appear word for word on many labels
+BOILERPLATE = [
+    "Keep out of reach of children.",
+    "If pregnant or breast-feeding, ask a health professional before use.",
+    "Hypersensitivity to any component of this product.",
+    "Stop use and ask a doctor if an allergic reaction occurs.",
+]
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# Tests import the app the way uvicorn runs it (from backend/), wherever pytest is started
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,35 @@
+import asyncio
+import os
+import time
+
+from app import adverse_events
+from app.adverse_events import AdverseEventStore
+
+
+def _rollup(drug_name, total):
+    return {
+        "drug_name": drug_name, "total_reports": total,
+        "serious": {"serious": total, "non_serious": 0}, "seriousness": {}, "reactions": [],
+        "reaction_outcomes": {}, "monthly": {}, "updated_at": time.time(),
+    }
+
+
+def test_rollups_without_reports_are_not_stored(tmp_path, monkeypatch):
+    calls = []
+
+    async def build_rollup(drug_name):
+        calls.append(drug_name)
+        return _rollup(drug_name, 3 if drug_name == "warfarin" else 0)
+
+    monkeypatch.setattr(adverse_events, "build_rollup", build_rollup)
+
+    async def main():
+        store = AdverseEventStore(path=os.path.join(tmp_path, "events.sqlite3"), ttl=3600)
+        results = [await store.get(name) for name in ("warfarin", "warfarin", "warfarinn", "warfarinn")]
+        await store.close()
+        return store, results
+
+    store, results = asyncio.run(main())
+    assert [source for _, source in results] == ["upstream", "store", "upstream", "upstream"]
+    assert calls == ["warfarin", "warfarinn", "warfarinn"]
+    assert store.counters["no_reports"] == 2
@@ -0,0 +1,68 @@
+import asyncio
+
+import pytest
+
+from app.fda import SingleFlight, normalize_drug_name
+
+
+def test_concurrent_callers_share_one_call():
+    calls = []
+
+    async def fetch(name):
+        calls.append(name)
+        await asyncio.sleep(0.01)
+        return name.upper()
+
+    async def main():
+        flights = SingleFlight()
+        results = await asyncio.gather(
+            *(flights.do("warfarin", lambda: fetch("warfarin")) for _ in range(5)),
+            flights.do("aspirin", lambda: fetch("aspirin")),
+        )
+        assert len(flights) == 0
+        # Once the call is done, the next caller makes a new one
+        await flights.do("warfarin", lambda: fetch("warfarin"))
+        return results
+
+    assert asyncio.run(main()) == ["WARFARIN"] * 5 + ["ASPIRIN"]
+    assert calls == ["warfarin", "aspirin", "warfarin"]
+
+
+def test_errors_reach_every_caller_and_are_not_kept():
+    calls = 0
+
+    async def fail():
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.01)
+        raise RuntimeError("upstream down")
+
+    async def main():
+        flights = SingleFlight()
+        results = await asyncio.gather(*(flights.do("k", fail) for _ in range(3)), return_exceptions=True)
+        assert all(isinstance(r, RuntimeError) for r in results)
+        with pytest.raises(RuntimeError):
+            await flights.do("k", fail)
+
+    asyncio.run(main())
+    assert calls == 2
+
+
+def test_cancelled_caller_does_not_cancel_the_call_for_others():
+    async def slow():
+        await asyncio.sleep(0.02)
+        return "label"
+
+    async def main():
+        flights = SingleFlight()
+        first = asyncio.ensure_future(flights.do("k", slow))
+        second = asyncio.ensure_future(flights.do("k", slow))
+        await asyncio.sleep(0)
+        first.cancel()
+        return await second
+
+    assert asyncio.run(main()) == "label"
+
+
+def test_normalize_drug_name():
+    assert normalize_drug_name("  Warfarin   Sodium ") == normalize_drug_name("warfarin sodium")
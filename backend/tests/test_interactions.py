@@ -0,0 +1,55 @@
+import pytest
+
+from app import label_text
+from app.interactions import InteractionMatcher, find_basic_conflicts
+from app.models import DrugInfo
+from bench.interactions import SyntheticDrug, legacy_basic_conflicts, synthetic_drugs
+
+# Enough other names to push the matcher from searching text to the word index
+PADDING = [f"padding{i} tablets" for i in range(10)]
+
+
+def _normalized(conflicts):
+    return [dict(c, details=sorted(c["details"])) for c in conflicts]
+
+
+@pytest.mark.parametrize("size", [3, 12])
+def test_same_conflicts_as_the_pairwise_scan(size):
+    drugs = synthetic_drugs(size)
+    # The pairwise scan matches the full generic name, which the label text never uses
+    legacy_drugs = [
+        SyntheticDrug(d.brand_name, d.generic_name.split()[0], d.warnings, d.contraindications, d.drug_interactions)
+        for d in drugs
+    ]
+    expected = _normalized(legacy_basic_conflicts(legacy_drugs))
+    label_text.clear()
+    assert _normalized(find_basic_conflicts(drugs)) == expected
+    # Second call served from the per-label word sets
+    assert _normalized(find_basic_conflicts(drugs)) == expected
+
+
+@pytest.mark.parametrize("padding", [[], PADDING])
+def test_names_match_on_whole_words_only(padding):
+    matcher = InteractionMatcher(["WARFARIN SODIUM", "ASPIRIN"] + padding)
+    assert matcher.mentions("Warfarin-induced bleeding (see ASPIRIN).") == {0, 1}
+    assert matcher.mentions("Avoid acetylsalicylic-acid.") == {1}
+    assert matcher.mentions("Warfarinate and aspirinlike products.") == set()
+    assert matcher.mentions("Contains sodium.") == set()
+
+
+def test_derived_text_is_kept_per_label_version():
+    label = {"set_id": "s1", "version": "3", "drug_interactions": ["Avoid aspirin."]}
+    calls = []
+
+    def build():
+        calls.append(1)
+        return "words"
+
+    label_text.clear()
+    first, again = DrugInfo.from_label("A", label), DrugInfo.from_label("A", label)
+    newer = DrugInfo.from_label("A", dict(label, version="4"))
+    unknown = DrugInfo(brand_name="B")
+    for drug in (first, again, newer, unknown, unknown):
+        assert label_text.derived(drug, "test", build) == "words"
+    assert first.label_key == ("s1", "3")
+    assert len(calls) == 4
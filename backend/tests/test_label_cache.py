@@ -0,0 +1,117 @@
+import asyncio
+import os
+
+import pytest
+
+from app.label_cache import LabelCache
+from app.resilience import CircuitOpenError
+
+
+class Upstream:
+    """Stands in for openFDA: returns the next label version on each call, or raises error."""
+
+    def __init__(self):
+        self.calls = 0
+        self.error = None
+
+    async def fetch(self):
+        self.calls += 1
+        if self.error is not None:
+            raise self.error
+        return {"version": self.calls}
+
+
+def _cache(tmp_path, **kwargs):
+    return LabelCache(path=os.path.join(tmp_path, "labels.sqlite3"), **kwargs)
+
+
+def test_fresh_entries_are_served_without_fetching(tmp_path):
+    async def main():
+        cache = _cache(tmp_path, ttl=60)
+        upstream = Upstream()
+        first = await cache.get_or_fetch("warfarin", upstream.fetch)
+        second = await cache.get_or_fetch("warfarin", upstream.fetch)
+        await cache.close()
+        return cache, upstream, first, second
+
+    cache, upstream, first, second = asyncio.run(main())
+    assert first == second == {"version": 1}
+    assert upstream.calls == 1
+    assert cache.counters["misses"] == 1
+    assert cache.counters["memory_hits"] == 1
+
+
+def test_stale_entry_is_served_while_refreshed_in_background(tmp_path):
+    async def main():
+        cache = _cache(tmp_path, ttl=0.05, stale=60)
+        upstream = Upstream()
+        await cache.get_or_fetch("warfarin", upstream.fetch)
+        await asyncio.sleep(0.06)
+        stale = await cache.get_or_fetch("warfarin", upstream.fetch)
+        await asyncio.sleep(0.02)  # let the refresh finish
+        refreshed = await cache.get_or_fetch("warfarin", upstream.fetch)
+        await cache.close()
+        return cache, upstream, stale, refreshed
+
+    cache, upstream, stale, refreshed = asyncio.run(main())
+    assert stale == {"version": 1}
+    assert refreshed == {"version": 2}
+    assert upstream.calls == 2
+    assert cache.counters["stale_hits"] == 1
+    assert cache.counters["refreshes"] == 1
+    # Only the fresh read counts as a hit, not the stale one
+    assert cache.counters["memory_hits"] == 1
+
+
+def test_missing_labels_are_cached(tmp_path):
+    upstream = Upstream()
+
+    async def none():
+        upstream.calls += 1
+
+    async def main():
+        cache = _cache(tmp_path, negative_ttl=60)
+        results = [await cache.get_or_fetch("zzz", none) for _ in range(3)]
+        await cache.close()
+        return cache, results
+
+    cache, results = asyncio.run(main())
+    assert results == [None, None, None]
+    assert upstream.calls == 1
+    assert cache.counters["negative_hits"] == 2
+
+
+def test_fetch_errors_are_not_cached(tmp_path):
+    async def main():
+        cache = _cache(tmp_path)
+        upstream = Upstream()
+        upstream.error = RuntimeError("503")
+        with pytest.raises(RuntimeError):
+            await cache.get_or_fetch("warfarin", upstream.fetch)
+        upstream.error = None
+        label = await cache.get_or_fetch("warfarin", upstream.fetch)
+        await cache.close()
+        return label
+
+    assert asyncio.run(main()) == {"version": 2}
+
+
+def test_expired_entry_is_served_while_circuit_is_open_after_restart(tmp_path):
+    async def main():
+        cache = _cache(tmp_path, ttl=0.01, stale=0.01, retain=60)
+        upstream = Upstream()
+        await cache.get_or_fetch("warfarin", upstream.fetch)
+        await cache.close()
+        await asyncio.sleep(0.05)
+
+        # Past the stale window, but kept in SQLite for the breaker fallback
+        restarted = _cache(tmp_path, ttl=0.01, stale=0.01, retain=60)
+        upstream.error = CircuitOpenError("fda", 30)
+        label = await restarted.get_or_fetch("warfarin", upstream.fetch)
+        await restarted.close()
+        return restarted, label
+
+    restarted, label = asyncio.run(main())
+    assert label == {"version": 1}
+    assert restarted.counters["served_while_open"] == 1
+    assert restarted.counters["persistent_hits"] == 0
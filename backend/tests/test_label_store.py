@@ -0,0 +1,115 @@
+import asyncio
+import json
+import os
+import zipfile
+
+import pytest
+
+from app import label_store as label_store_module
+from app.label_store import LabelStore
+
+
+def _label(set_id, brand, generic, effective_time="20230101", warnings="Bleeding risk."):
+    return {
+        "set_id": set_id,
+        "effective_time": effective_time,
+        "warnings": [warnings],
+        "openfda": {
+            "brand_name": [brand],
+            "generic_name": [generic],
+            "manufacturer_name": ["Acme"],
+            "product_type": ["HUMAN PRESCRIPTION DRUG"],
+        },
+    }
+
+
+LABELS = [
+    _label("1", "Coumadin", "WARFARIN SODIUM"),
+    _label("2", "Jantoven", "WARFARIN SODIUM", effective_time="20240101"),
+    _label("3", "Bayer Aspirin", "ASPIRIN"),
+    _label("4", "Zocor", "SIMVASTATIN"),
+]
+
+
+def _bulk_file(tmp_path, name, labels):
+    path = os.path.join(tmp_path, name)
+    with zipfile.ZipFile(path, "w") as archive:
+        archive.writestr(name[:-len(".zip")], json.dumps({"results": labels}))
+    return path
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = LabelStore(os.path.join(tmp_path, "labels.sqlite3"))
+    store.import_files([_bulk_file(tmp_path, "drug-label-0001-of-0001.json.zip", LABELS)])
+    store.load()
+    yield store
+    store.close()
+
+
+def test_exact_lookup_by_brand_or_generic_name(store):
+    async def main():
+        return (
+            await store.get_label("  coumadin "),
+            await store.get_label("Warfarin Sodium"),
+            await store.get_label("unknown"),
+        )
+
+    coumadin, warfarin, unknown = asyncio.run(main())
+    assert coumadin["set_id"] == "1"
+    # Several labels share the generic name: the most recent one wins
+    assert warfarin["set_id"] == "2"
+    assert unknown is None
+
+
+def test_prefix_matches_come_before_word_matches(store):
+    def brands(term, limit=10):
+        return [r["brand_name"] for r in asyncio.run(store.search(term, limit))]
+
+    # The in-memory prefix index holds the newest label per name; the FTS index finds the older one
+    assert brands("war") == ["Jantoven", "Coumadin"]
+    assert brands("asp") == ["Bayer Aspirin"]
+    # "sodium" only starts the second word of a name
+    assert sorted(brands("sodium")) == ["Coumadin", "Jantoven"]
+    assert brands("war", limit=1) == ["Jantoven"]
+    assert brands("zzz") == []
+
+
+def test_reimport_is_incremental(store, tmp_path):
+    assert store.import_files([os.path.join(tmp_path, "drug-label-0001-of-0001.json.zip")])["skipped_files"] == 1
+    update = [
+        _label("4", "Zocor", "SIMVASTATIN", effective_time="20250101", warnings="Myopathy."),
+        _label("3", "Bayer Aspirin", "ASPIRIN", effective_time="20200101", warnings="Older."),
+        _label("5", "Lipitor", "ATORVASTATIN CALCIUM"),
+    ]
+    totals = store.import_files([_bulk_file(tmp_path, "drug-label-update.json.zip", update)])
+    assert (totals["inserted"], totals["updated"], totals["unchanged"]) == (1, 1, 1)
+
+    store.load()
+    assert asyncio.run(store.get_label("zocor"))["warnings"] == ["Myopathy."]
+    assert asyncio.run(store.get_label("bayer aspirin"))["warnings"] == ["Bleeding risk."]
+    # The updated label is still found, once, through the FTS index
+    assert [r["brand_name"] for r in asyncio.run(store.search("simva"))] == ["Zocor"]
+    assert [r["brand_name"] for r in asyncio.run(store.search("atorva"))] == ["Lipitor"]
+
+
+def test_running_store_picks_up_imports_in_the_background(store, tmp_path, monkeypatch):
+    monkeypatch.setattr(label_store_module, "LABEL_STORE_RELOAD_SECONDS", 0)
+
+    async def main():
+        before = await store.get_label("lipitor")
+        # Another process imports a file
+        importer = LabelStore(store.path)
+        importer.import_files([_bulk_file(tmp_path, "more.json.zip", [_label("5", "Lipitor", "ATORVASTATIN")])])
+        importer.close()
+        # Lookups start a background reload and are served from the current index...
+        during = await store.get_label("lipitor")
+        await store._reload
+        # ...until the rebuilt one is swapped in
+        after = await store.get_label("lipitor")
+        return before, during, after
+
+    before, during, after = asyncio.run(main())
+    assert before is None and during is None
+    assert after["set_id"] == "5"
+    assert store.stats()["brand_names"] == 5
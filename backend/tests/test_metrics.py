@@ -0,0 +1,46 @@
+import asyncio
+import os
+
+from app import metrics
+from app.label_cache import LabelCache
+
+
+def test_concurrent_upstream_calls_report_wall_time():
+    timings = metrics._RequestTimings()
+    # Three overlapping 100 ms calls between 1.0 and 1.15, and one stage run twice in a row
+    timings.upstream += [
+        ("fda", "/drug/label.json", "200", 0.1, 1.1),
+        ("fda", "/drug/label.json", "200", 0.1, 1.12),
+        ("fda", "/drug/label.json", "200", 0.1, 1.15),
+    ]
+    timings.spans += [("conflicts", 0.002, 1.2), ("conflicts", 0.003, 1.3)]
+    header = metrics.server_timing(timings, total=0.3)
+    assert header == (
+        'conflicts;dur=5.0;desc="2 calls, 5.0 ms summed", '
+        'fda;dur=150.0;desc="3 calls, 300.0 ms summed", total;dur=300.0'
+    )
+
+
+def test_background_refresh_is_not_recorded_on_the_request(tmp_path):
+    seen = []
+
+    async def fetch():
+        seen.append(metrics._current.get())
+        metrics.observe_upstream("fda", "/drug/label.json", "200", 0.01)
+        return {"version": len(seen)}
+
+    async def main():
+        cache = LabelCache(path=os.path.join(tmp_path, "labels.sqlite3"), ttl=0.01, stale=60)
+        request = metrics._RequestTimings()
+        token = metrics._current.set(request)
+        await cache.get_or_fetch("warfarin", fetch)
+        await asyncio.sleep(0.02)
+        await cache.get_or_fetch("warfarin", fetch)  # stale: refreshed in the background
+        await asyncio.sleep(0.01)
+        metrics._current.reset(token)
+        await cache.close()
+        return request
+
+    request = asyncio.run(main())
+    assert seen[0] is request and seen[1] is None
+    assert len(request.upstream) == 1
@@ -0,0 +1,36 @@
+import pytest
+
+from app.models import (
+    AdvancedAnalysisOutput, BatchAnalysis, DifferentialDiagnosisOutput, EnhancedInfo, parse_llm_output,
+)
+
+TRUNCATED_ANALYSIS = (
+    '```json\n{"advanced_conflicts": [{"drugs": ["Coumadin", "aspirin"], "type": "pharmacodynamic",'
+    ' "severity": "high", "description": "Additive bleeding risk."}, {"drugs": ["Cou'
+)
+
+
+def test_fenced_and_bare_output_parse():
+    fenced = 'Here you go:\n```json\n{"advanced_conflicts": [], "additional_warnings": []}\n```'
+    bare = 'Sure. {"summary": "Pain reliever.", "extra": 1} Hope this helps.'
+    assert parse_llm_output(fenced, AdvancedAnalysisOutput).advanced_conflicts == []
+    assert parse_llm_output(bare, EnhancedInfo).summary == "Pain reliever."
+
+
+@pytest.mark.parametrize("schema", [AdvancedAnalysisOutput, BatchAnalysis, DifferentialDiagnosisOutput, EnhancedInfo])
+def test_truncated_output_is_a_parse_failure(schema):
+    # The inner conflict object decodes on its own, but must not pass for the answer
+    with pytest.raises(ValueError):
+        parse_llm_output(TRUNCATED_ANALYSIS, schema)
+
+
+@pytest.mark.parametrize("schema", [AdvancedAnalysisOutput, BatchAnalysis, DifferentialDiagnosisOutput, EnhancedInfo])
+def test_off_schema_output_is_a_parse_failure(schema):
+    with pytest.raises(ValueError):
+        parse_llm_output('{"foo": 1}', schema)
+
+
+def test_truncated_differential_is_a_parse_failure():
+    text = '{"diagnosis_similarity": 0.8, "alternatives": [{"condition": "Influenza", "similarity_score": 0.'
+    with pytest.raises(ValueError):
+        parse_llm_output(text, DifferentialDiagnosisOutput)
@@ -0,0 +1,161 @@
+import asyncio
+import dataclasses
+import hashlib
+import json
+import os
+
+import httpx
+import pytest
+
+from app import outbox as outbox_module
+from app.http_clients import PoolConfig
+from app.outbox import EmailOutbox
+
+
+class FakeResend:
+    """Stands in for app.http_clients.clients, with Resend answered by handler."""
+
+    def __init__(self, handler):
+        self.calls = []
+
+        def record(request):
+            self.calls.append((request.url.path, request.headers["idempotency-key"], json.loads(request.content)))
+            return handler(request)
+
+        self.resend = httpx.AsyncClient(transport=httpx.MockTransport(record), base_url="http://resend.test")
+        self.configs = {"resend": PoolConfig(
+            name="resend", base_url="http://resend.test", timeout=0.01, connect_timeout=0.01, max_connections=1,
+            max_keepalive_connections=1, keepalive_expiry=1.0, http2=False, rate_limit_max_wait=0.0,
+        )}
+
+
+@pytest.fixture
+def fast_retries(monkeypatch):
+    monkeypatch.setattr(outbox_module, "EMAIL_RETRY_BASE_SECONDS", 0.01)
+    monkeypatch.setattr(outbox_module, "EMAIL_RETRY_MAX_SECONDS", 0.01)
+    monkeypatch.setattr(outbox_module, "EMAIL_CLAIM_SECONDS", 0.05)
+    monkeypatch.setattr(outbox_module, "EMAIL_LEASE_MARGIN_SECONDS", 0.0)
+
+
+def _resend(monkeypatch, handler):
+    fake = FakeResend(handler)
+    monkeypatch.setattr(outbox_module, "clients", fake)
+    return fake
+
+
+def _accept(request):
+    body = json.loads(request.content)
+    if isinstance(body, list):
+        return httpx.Response(200, json={"data": [{"id": f"re-{m['to'][0]}"} for m in body]})
+    return httpx.Response(200, json={"id": f"re-{body['to'][0]}"})
+
+
+async def _enqueue(outbox, *addresses):
+    return [await outbox.enqueue(to, "Report", "...") for to in addresses]
+
+
+def test_due_messages_are_sent_as_one_batch(tmp_path, monkeypatch):
+    fake = _resend(monkeypatch, _accept)
+
+    async def main():
+        outbox = EmailOutbox(os.path.join(tmp_path, "outbox.sqlite3"))
+        ids = await _enqueue(outbox, "a@x.test", "b@x.test", "c@x.test")
+        assert await outbox.deliver_due() == 3
+        assert await outbox.deliver_due() == 0
+        statuses = [await outbox.status(i) for i in ids]
+        await outbox.close()
+        return ids, statuses
+
+    ids, statuses = asyncio.run(main())
+    assert [s["status"] for s in statuses] == ["sent"] * 3
+    assert [s["provider_id"] for s in statuses] == ["re-a@x.test", "re-b@x.test", "re-c@x.test"]
+    [(path, key, body)] = fake.calls
+    assert path == "/emails/batch" and len(body) == 3
+    assert key == hashlib.sha256(",".join(sorted(ids)).encode()).hexdigest()
+
+
+def test_lease_is_never_shorter_than_a_resend_call(tmp_path, monkeypatch):
+    fake = _resend(monkeypatch, _accept)
+    monkeypatch.setattr(outbox_module, "EMAIL_CLAIM_SECONDS", 5.0)
+    monkeypatch.setattr(outbox_module, "EMAIL_LEASE_MARGIN_SECONDS", 1.0)
+    outbox = EmailOutbox(os.path.join(tmp_path, "outbox.sqlite3"))
+    assert outbox.lease_seconds == 5.0
+    # A client with transport retries would hold a claim for several attempts
+    fake.configs["resend"] = dataclasses.replace(fake.configs["resend"], retries=3, timeout=10.0)
+    assert outbox.lease_seconds > fake.configs["resend"].call_budget_seconds() > 40
+
+
+def test_expired_lease_is_taken_over_with_the_same_batch(tmp_path, monkeypatch, fast_retries):
+    fake = _resend(monkeypatch, _accept)
+
+    async def main():
+        path = os.path.join(tmp_path, "outbox.sqlite3")
+        crashed, survivor = EmailOutbox(path), EmailOutbox(path)
+        ids = await _enqueue(crashed, "a@x.test", "b@x.test")
+        # The first worker claims the batch and dies before sending it
+        claimed, batch = await crashed._claim()
+        assert len(claimed) == 2
+        assert await survivor.deliver_due() == 0  # still leased
+        await asyncio.sleep(0.1)
+        assert await survivor.deliver_due() == 2
+        statuses = [await survivor.status(i) for i in ids]
+        await crashed.close()
+        await survivor.close()
+        return batch, statuses
+
+    batch, statuses = asyncio.run(main())
+    assert [s["status"] for s in statuses] == ["sent", "sent"]
+    [(_, key, _)] = fake.calls
+    assert key == batch
+
+
+def test_failed_batch_is_retried_unchanged(tmp_path, monkeypatch, fast_retries):
+    responses = [httpx.Response(503, json={"message": "try later"})]
+    fake = _resend(monkeypatch, lambda request: responses.pop(0) if responses else _accept(request))
+
+    async def main():
+        outbox = EmailOutbox(os.path.join(tmp_path, "outbox.sqlite3"))
+        ids = await _enqueue(outbox, "a@x.test", "b@x.test")
+        await outbox.deliver_due()
+        retrying = await outbox.status(ids[0])
+        # A message queued meanwhile does not join the batch being retried
+        late = await outbox.enqueue("c@x.test", "Report", "...")
+        await asyncio.sleep(0.05)
+        assert sorted([await outbox.deliver_due(), await outbox.deliver_due()]) == [1, 2]
+        statuses = [await outbox.status(i) for i in ids + [late]]
+        await outbox.close()
+        return retrying, statuses
+
+    retrying, statuses = asyncio.run(main())
+    assert retrying["status"] == "queued" and retrying["last_error"] == "HTTP 503: try later"
+    assert [s["status"] for s in statuses] == ["sent"] * 3
+    assert [s["attempts"] for s in statuses] == [2, 2, 1]
+    batches = [(key, len(body)) for path, key, body in fake.calls if path == "/emails/batch"]
+    assert batches[0] == batches[1] and batches[0][1] == 2
+    assert [path for path, _, _ in fake.calls].count("/emails") == 1
+
+
+def test_rejected_batch_is_split_so_one_bad_address_fails_alone(tmp_path, monkeypatch):
+    def handler(request):
+        body = json.loads(request.content)
+        messages = body if isinstance(body, list) else [body]
+        if any(m["to"] == ["not-an-address"] for m in messages):
+            return httpx.Response(422, json={"message": "Invalid `to` field"})
+        return _accept(request)
+
+    fake = _resend(monkeypatch, handler)
+
+    async def main():
+        outbox = EmailOutbox(os.path.join(tmp_path, "outbox.sqlite3"))
+        ids = await _enqueue(outbox, "a@x.test", "not-an-address", "c@x.test")
+        assert await outbox.deliver_due() == 3
+        statuses = [await outbox.status(i) for i in ids]
+        await outbox.close()
+        return ids, statuses
+
+    ids, statuses = asyncio.run(main())
+    assert [s["status"] for s in statuses] == ["sent", "failed", "sent"]
+    assert statuses[1]["last_error"] == "HTTP 422: Invalid `to` field"
+    # One batch call, then each message on its own under its own key
+    assert [path for path, _, _ in fake.calls] == ["/emails/batch"] + ["/emails"] * 3
+    assert sorted(key for _, key, _ in fake.calls[1:]) == sorted(ids)
@@ -0,0 +1,113 @@
+import asyncio
+
+import httpx
+import pytest
+
+from app.http_clients import PoolConfig, _ResilientTransport
+from app.resilience import CLOSED, HALF_OPEN, OPEN, CircuitBreaker, CircuitOpenError, RateLimitedError, TokenBucket
+
+
+def test_token_bucket_bursts_then_paces_then_rejects():
+    async def main():
+        bucket = TokenBucket(rate=10, burst=2, max_wait=0.15)
+        started = asyncio.get_running_loop().time()
+        await bucket.acquire()
+        await bucket.acquire()
+        burst = asyncio.get_running_loop().time() - started
+        await bucket.acquire()  # waits ~100 ms for the next token
+        paced = asyncio.get_running_loop().time() - started
+        # Two callers arrive at once: the first queues ~100 ms, the second would wait ~200 ms
+        results = await asyncio.gather(bucket.acquire(), bucket.acquire(), return_exceptions=True)
+        return bucket, burst, paced, results
+
+    bucket, burst, paced, results = asyncio.run(main())
+    assert burst < 0.05 <= paced
+    assert results[0] is None and isinstance(results[1], RateLimitedError)
+    assert (bucket.waits, bucket.rejected, bucket.waiting) == (2, 1, 0)
+
+
+def test_token_bucket_with_rate_zero_never_limits():
+    bucket = TokenBucket(rate=0, burst=1)
+    assert all(bucket.try_acquire() for _ in range(100))
+
+
+def test_breaker_opens_then_lets_one_trial_through():
+    breaker = CircuitBreaker("fda", failure_threshold=2, reset_seconds=0.01)
+    for _ in range(2):
+        breaker.before_call()
+        breaker.record_failure()
+    assert breaker.state == OPEN
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+
+    asyncio.run(asyncio.sleep(0.02))
+    breaker.before_call()  # the trial call
+    assert breaker.state == HALF_OPEN
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()  # only one trial at a time
+    breaker.record_failure()
+    assert breaker.state == OPEN and breaker.opened == 2
+
+    asyncio.run(asyncio.sleep(0.02))
+    breaker.before_call()
+    breaker.record_success()
+    assert breaker.state == CLOSED and breaker.failures == 0
+    assert breaker.short_circuited == 2
+
+
+def _transport(handler, **config):
+    config = PoolConfig(
+        name="fda", base_url="http://fda.test", timeout=1.0, connect_timeout=1.0, max_connections=1,
+        max_keepalive_connections=1, keepalive_expiry=1.0, http2=False, **config,
+    )
+    return _ResilientTransport(httpx.MockTransport(handler), config)
+
+
+def _get(transport):
+    async def main():
+        async with httpx.AsyncClient(transport=transport, base_url="http://fda.test") as client:
+            return await client.get("/drug/label.json")
+
+    return asyncio.run(main())
+
+
+def test_transport_retries_then_opens_breaker():
+    statuses = iter([503, 200, 503, 503, 503, 503])
+
+    def handler(request):
+        return httpx.Response(next(statuses), headers={"retry-after": "0"})
+
+    transport = _transport(handler, retries=1, breaker_failures=2)
+    assert _get(transport).status_code == 200
+    assert transport.counters["retries"] == 1
+    assert _get(transport).status_code == 503
+    assert _get(transport).status_code == 503
+    assert transport.breaker.state == OPEN
+    with pytest.raises(CircuitOpenError):
+        _get(transport)
+
+
+def test_rate_limited_half_open_trial_is_not_a_success():
+    sent = []
+
+    def handler(request):
+        sent.append(request)
+        return httpx.Response(503)
+
+    transport = _transport(
+        handler, breaker_failures=1, breaker_reset_seconds=0.01, rate_limit=1, rate_limit_burst=1,
+        rate_limit_max_wait=0.0,
+    )
+    assert _get(transport).status_code == 503
+    assert transport.breaker.state == OPEN
+
+    asyncio.run(asyncio.sleep(0.02))
+    # The trial is let through by the breaker, but the limiter has no token for it
+    with pytest.raises(RateLimitedError):
+        _get(transport)
+    assert len(sent) == 1
+    assert transport.breaker.state == HALF_OPEN
+    # The trial slot was released: the next call is the trial
+    transport.limiter.rate = 0
+    assert _get(transport).status_code == 503
+    assert transport.breaker.state == OPEN
@@ -92,6 +92,35 @@ function similarityBar(score) {
     </div>`;
 }
 
+// Read an NDJSON response, calling onEvent for each parsed line as it arrives
+async function readNdjson(res, onEvent) {
+  const reader  = res.body.getReader();
+  const decoder = new TextDecoder();
+  let buffer = '';
+  for (;;) {
+    const { value, done } = await reader.read();
+    buffer += decoder.decode(value || new Uint8Array(), { stream: !done });
+    let nl;
+    while ((nl = buffer.indexOf('\n')) >= 0) {
+      const line = buffer.slice(0, nl).trim();
+      buffer = buffer.slice(nl + 1);
+      if (line) onEvent(JSON.parse(line));
+    }
+    if (done) break;
+  }
+}
+
+// Format a Server-Timing value ("labels;dur=12.3, gemini;dur=840.1") as a note on where time went
+function serverTimingNote(value) {
+  if (!value) return '';
+  const parts = value.split(',').map(entry => {
+    const [name, ...params] = entry.trim().split(';');
+    const dur = params.find(p => p.trim().startsWith('dur='));
+    return dur ? `${escapeHtml(name)} ${Math.round(parseFloat(dur.split('=')[1]))} ms` : null;
+  }).filter(Boolean);
+  return parts.length ? `<p class="server-timing">Server time: ${parts.join(' · ')}</p>` : '';
+}
+
 function showError(containerId, msg) {
   const el = document.getElementById(containerId);
   el.classList.remove('hidden');
@@ -120,15 +149,33 @@ document.getElementById('drug-analyze-btn').addEventListener('click', async () =
   resultsEl.classList.add('hidden');
 
   try {
-    const res = await fetch(`${API_BASE}/api/analyze-drugs`, {
+    const res = await fetch(`${API_BASE}/api/analyze-drugs/stream`, {
       method: 'POST',
       headers: { 'Content-Type': 'application/json' },
       body: JSON.stringify({ medications, diagnosis, symptoms }),
     });
 
     if (!res.ok) throw new Error(`Server error ${res.status}`);
-    const data = await res.json();
-    renderDrugResults(data, resultsEl);
+
+    // Render FDA results as soon as they are in; AI analysis fills in when it arrives
+    const data = { drug_infos: new Array(medications.length), basic_conflicts: [], advanced_analysis: null };
+    let received = 0;
+    await readNdjson(res, event => {
+      if (event.event === 'drug_info') {
+        data.drug_infos[event.index] = event.data;
+        received += 1;
+        setLoading(true, `Fetched FDA data for ${received} of ${medications.length} medications…`);
+      } else if (event.event === 'basic_conflicts') {
+        data.basic_conflicts = event.data;
+        setLoading(false);
+        renderDrugResults(data, resultsEl, true);
+      } else if (event.event === 'advanced_analysis') {
+        data.advanced_analysis = event.data;
+        renderDrugResults(data, resultsEl);
+      } else if (event.event === 'done') {
+        resultsEl.insertAdjacentHTML('beforeend', serverTimingNote(event.server_timing));
+      }
+    });
   } catch (err) {
     showError('drug-results', err.message || 'Could not connect to the backend. Is it running?');
   } finally {
@@ -136,19 +183,23 @@ document.getElementById('drug-analyze-btn').addEventListener('click', async () =
   }
 });
 
-function renderDrugResults(data, container) {
+function renderDrugResults(data, container, aiPending = false) {
   const { drug_infos = [], basic_conflicts = [], advanced_analysis = {} } = data;
   const adv = advanced_analysis || {};
 
   let html = '';
 
+  if (aiPending) {
+    html += `<div class="summary-card"><p>⏳ AI analysis in progress — FDA results below.</p></div>`;
+  }
+
   // ── Conflict summary ──
   const allConflicts = [
     ...(basic_conflicts || []),
     ...(adv.advanced_conflicts || []),
   ];
 
-  if (allConflicts.length === 0) {
+  if (allConflicts.length === 0 && !aiPending) {
     html += `<div class="summary-card"><p>✅ No significant drug conflicts detected between the listed medications.</p></div>`;
   }
 
@@ -288,6 +339,7 @@ document.getElementById('symptom-analyze-btn').addEventListener('click', async (
     if (!res.ok) throw new Error(`Server error ${res.status}`);
     const data = await res.json();
     renderSymptomResults(data, diagnosis, symptoms, resultsEl);
+    if (!data.error) resultsEl.insertAdjacentHTML('beforeend', serverTimingNote(res.headers.get('Server-Timing')));
   } catch (err) {
     showError('symptom-results', err.message || 'Could not connect to the backend.');
   } finally {
@@ -431,6 +483,7 @@ window.loadDrugDetail = async function(name) {
       html += `<div class="info-section"><div class="info-section-label">${s.label}</div><div class="info-section-text">${escapeHtml(text)}${text.length >= 600 ? '…' : ''}</div></div>`;
     });
 
+    html += serverTimingNote(res.headers.get('Server-Timing'));
     html += `</div>`;
     area.innerHTML = html;
   } catch (err) {